@@ -0,0 +1,143 @@
+"""
+Cold-start times of the CLI, the web server and the embedding service.
+
+Every measurement runs in a fresh interpreter:
+
+- imports: wall time of `python -c "import <module>"`, less that of a bare
+  interpreter, for the modules each entry point imports
+- cli: wall time of `python -m cli --help` and `python -m cli echo hi`
+- servers: seconds from launching uvicorn until `/health` (live) and
+  `/ready` (warmed up, dependencies reachable) answer 200
+
+`/ready` of the web server also needs the search backend and the embedding
+service; with neither running it is reported as null after `--timeout`.
+`SEARCH_ENGINE_FLAVOR=local` and `--embedding` make it reachable on one
+machine:
+
+    python -m bench.cold_start
+    SEARCH_ENGINE_FLAVOR=local python -m bench.cold_start --embedding --out cold.json
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+from typing import Dict, List, Optional
+
+IMPORTS = ("cli", "main", "es_utils", "processor", "indexer", "summarizer", "embedding_service")
+CLI_COMMANDS = (["--help"], ["echo", "hi"])
+
+
+def wall_time(args: List[str], repeat: int) -> float:
+    """Median wall time of running `args` to completion."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def bench_imports(modules: List[str], repeat: int) -> Dict[str, float]:
+    baseline = wall_time([sys.executable, "-c", "pass"], repeat)
+    return {
+        module: max(0.0, wall_time([sys.executable, "-c", f"import {module}"], repeat) - baseline)
+        for module in modules
+    }
+
+
+def bench_cli(repeat: int) -> Dict[str, float]:
+    return {
+        " ".join(command): wall_time([sys.executable, "-m", "cli", *command], repeat)
+        for command in CLI_COMMANDS
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(url: str, deadline: float) -> bool:
+    while time.perf_counter() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return True
+        except (urllib.error.URLError, OSError):
+            pass
+        time.sleep(0.05)
+    return False
+
+
+def bench_server(app: str, port: int, timeout: float, env: Optional[Dict] = None) -> Dict[str, Optional[float]]:
+    """Launch `app` with uvicorn and time /health and /ready; the server is left running."""
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app, "--host", "127.0.0.1", "--port", str(port)],
+        env={**os.environ, **(env or {})},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = start + timeout
+    live = wait_for(f"http://127.0.0.1:{port}/health", deadline)
+    live_seconds = time.perf_counter() - start if live else None
+    ready = live and wait_for(f"http://127.0.0.1:{port}/ready", deadline)
+    ready_seconds = time.perf_counter() - start if ready else None
+    return {"process": process, "live_seconds": live_seconds, "ready_seconds": ready_seconds}
+
+
+def _seconds(value: Optional[float]) -> str:
+    return "timed out" if value is None else f"{value:.2f}s"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per import and CLI measurement; the median is kept")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Seconds to wait for each server to become ready")
+    parser.add_argument("--embedding", action="store_true", help="Also start the embedding service")
+    parser.add_argument("--no-servers", action="store_true", help="Only measure imports and the CLI")
+    parser.add_argument("--out", type=Path, help="Write the results as JSON")
+    args = parser.parse_args()
+
+    results: Dict = {"imports": bench_imports(list(IMPORTS), args.repeat), "cli": bench_cli(args.repeat)}
+    for module, seconds in results["imports"].items():
+        print(f"import {module}: {seconds * 1000:.0f}ms")
+    for command, seconds in results["cli"].items():
+        print(f"cli {command}: {seconds * 1000:.0f}ms")
+
+    if not args.no_servers:
+        processes = []
+        results["servers"] = {}
+        try:
+            env = {}
+            if args.embedding:
+                port = free_port()
+                server = bench_server("embedding_service:app", port, args.timeout)
+                processes.append(server.pop("process"))
+                results["servers"]["embedding_service"] = server
+                env["EMBEDDING_SERVICE_URL"] = f"http://127.0.0.1:{port}"
+            server = bench_server("main:app", free_port(), args.timeout, env)
+            processes.append(server.pop("process"))
+            results["servers"]["main"] = server
+        finally:
+            for process in processes:
+                process.terminate()
+                process.wait()
+        for name, server in results["servers"].items():
+            print(f"{name}: live {_seconds(server['live_seconds'])}, ready {_seconds(server['ready_seconds'])}")
+
+    if args.out:
+        args.out.write_text(json.dumps(results, indent=2))
+        print(f"Wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
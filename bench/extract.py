@@ -0,0 +1,100 @@
+"""
+Micro-benchmark for the AST chunk extractor.
+
+Compares the current single-pass extractor against the previous
+implementation (a nested `ast.walk` per definition plus a `splitlines()`
+per chunk, with classes and nested functions embedded in full) over a
+corpus of Python files, the stdlib by default. Also reports the model
+tokens each extractor sends to the embedder: in total, and after the
+model's CHUNK_MAX_TOKENS truncation.
+
+    python -m bench.extract [--root PATH] [--repeat N]
+"""
+import argparse
+import ast
+import sysconfig
+import time
+from pathlib import Path
+from typing import Dict, List
+
+from processor import CHUNK_MAX_TOKENS, count_tokens, extract_chunks_from_source
+
+
+def legacy_extract(source: str) -> List[Dict]:
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return []
+
+    chunks = []
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            start_line = node.lineno - 1
+            end_line = max(
+                [child.lineno for child in ast.walk(node) if hasattr(child, "lineno")],
+                default=start_line
+            )
+            code = "\n".join(source.splitlines()[start_line:end_line])
+            chunks.append({
+                "name": getattr(node, "name", "<unknown>"),
+                "type": type(node).__name__,
+                "code": code,
+                "start_line": start_line + 1,
+                "end_line": end_line
+            })
+    return chunks
+
+
+def load_corpus(root: Path) -> List[str]:
+    sources = []
+    for path in sorted(root.rglob("*.py")):
+        try:
+            sources.append(path.read_text(encoding="utf-8"))
+        except (UnicodeDecodeError, OSError):
+            continue
+    return sources
+
+
+def run(extract, sources: List[str], repeat: int) -> Dict:
+    best = float("inf")
+    chunks = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        chunks = sum(1 for source in sources for _ in extract(source))
+        best = min(best, time.perf_counter() - start)
+    return {"chunks": chunks, "seconds": best}
+
+
+def token_stats(extract, sources: List[str]) -> Dict:
+    tokens = embedded = 0
+    for source in sources:
+        for chunk in extract(source):
+            chunk_tokens = sum(count_tokens(chunk["code"].split("\n")))
+            tokens += chunk_tokens
+            embedded += min(chunk_tokens, CHUNK_MAX_TOKENS)
+    return {"tokens": tokens, "embedded_tokens": embedded}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--root", type=Path, default=Path(sysconfig.get_paths()["stdlib"]))
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    sources = load_corpus(args.root)
+    print(f"Corpus: {args.root} ({len(sources)} files)")
+
+    results = {
+        "legacy": run(legacy_extract, sources, args.repeat),
+        "hierarchical": run(extract_chunks_from_source, sources, args.repeat),
+    }
+    for name, result in results.items():
+        result.update(token_stats(legacy_extract if name == "legacy" else extract_chunks_from_source, sources))
+        print(f"{name:>12}: {result['chunks']} chunks in {result['seconds']:.2f}s "
+              f"({result['chunks'] / result['seconds']:.0f} chunks/s), {result['tokens']} tokens, "
+              f"{result['embedded_tokens']} embedded after truncation")
+    print(f"     speedup: {results['legacy']['seconds'] / results['hierarchical']['seconds']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
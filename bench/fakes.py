@@ -0,0 +1,554 @@
+"""
+Deterministic, in-process stand-ins for the services the indexer and the
+web server talk to, so benchmarks run offline and give the same numbers
+run after run:
+
+- `FakeEmbedder`: hash-seeded unit vectors, with an optional per-token cost
+- `FakeCluster`: the slice of the Elasticsearch/OpenSearch REST API the
+  backends use (bulk, search with both kNN query shapes, msearch, delete by
+  query, settings, documents, terms/cardinality aggregations, stats,
+  aliases, `_meta`, reindex),
+  served to real `Elasticsearch` and `AsyncElasticsearch` clients through
+  `fake_clients`
+- `FakeLLM`: an OpenAI-compatible async client streaming a fixed summary
+"""
+import asyncio
+import fnmatch
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from elastic_transport import ApiResponseMeta, BaseAsyncNode, BaseNode, HttpHeaders
+from elasticsearch import AsyncElasticsearch, Elasticsearch
+
+try:
+    from elastic_transport._node import NodeApiResponse
+except ImportError:
+    # elastic-transport < 8.13 takes a plain (meta, body) tuple
+    def NodeApiResponse(meta, body):
+        return meta, body
+
+EMBEDDING_DIMS = 384
+
+_TERM_RE = re.compile(r"\w+")
+# The one `script_score` script shape the backends send: a score looked up
+# in a params map by a keyword field's value
+_SCRIPT_LOOKUP_RE = re.compile(r"params\.(\w+)\[doc\['(\w+)'\]\.value\]")
+
+
+class FakeEmbedder:
+    """
+    Stands in for `ModelCache` (`encode`) and the embedding clients
+    (`get_embeddings`). A text always maps to the same unit vector.
+    """
+
+    def __init__(self, dims: int = EMBEDDING_DIMS, seconds_per_token: float = 0.0):
+        self.dims = dims
+        self.seconds_per_token = seconds_per_token
+        self.texts = 0
+
+    def _vector(self, text: str) -> np.ndarray:
+        seed = int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dims).astype(np.float32)
+        return vector / np.linalg.norm(vector)
+
+    def encode(self, texts: Union[str, List[str]], batch_size: int = 32) -> np.ndarray:
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        if self.seconds_per_token:
+            time.sleep(self.seconds_per_token * sum(len(_TERM_RE.findall(text)) for text in texts))
+        self.texts += len(texts)
+        embeddings = np.stack([self._vector(text) for text in texts]) if texts else np.empty((0, self.dims), np.float32)
+        return embeddings[0] if single else embeddings
+
+    def get_embeddings(self, texts: Union[str, List[str]]) -> np.ndarray:
+        return self.encode([texts] if isinstance(texts, str) else texts)
+
+    def cache_stats(self):
+        return None
+
+
+class AsyncFakeEmbedder(FakeEmbedder):
+    """`FakeEmbedder` with the interface of `AsyncEmbeddingClient`."""
+
+    async def get_embeddings(self, texts: Union[str, List[str]]) -> np.ndarray:
+        return super().get_embeddings(texts)
+
+    async def aclose(self):
+        pass
+
+
+class FakeLLM:
+    """
+    Just enough of `AsyncOpenAI` for `summarizer.query_model_stream`: every
+    completion streams `tokens` tokens, `seconds_per_token` apart.
+    """
+
+    def __init__(self, tokens: int = 50, seconds_per_token: float = 0.001):
+        self.tokens = tokens
+        self.seconds_per_token = seconds_per_token
+        self.calls = 0
+        self.chat = self
+        self.completions = self
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        return self._stream()
+
+    async def _stream(self):
+        for i in range(self.tokens):
+            await asyncio.sleep(self.seconds_per_token)
+            delta = type("Delta", (), {"content": f"token{i} "})()
+            yield type("Chunk", (), {"choices": [type("Choice", (), {"delta": delta})()]})()
+
+
+class _Index:
+    def __init__(self, body: Dict, created: int = 0):
+        self.settings: Dict = dict((body.get("settings") or {}).get("index", {}))
+        self.settings["creation_date"] = str(created)
+        self.mappings: Dict = body.get("mappings") or {"properties": {}}
+        self.docs: "OrderedDict[str, Dict]" = OrderedDict()
+        self._matrix: Optional[Tuple[List[str], np.ndarray]] = None
+
+    def put(self, doc_id: str, source: Dict):
+        self.docs.pop(doc_id, None)
+        self.docs[doc_id] = source
+        self._matrix = None
+
+    def delete(self, doc_id: str) -> bool:
+        self._matrix = None
+        return self.docs.pop(doc_id, None) is not None
+
+    def matrix(self) -> Tuple[List[str], np.ndarray]:
+        """IDs and normalized vectors of the documents that have an embedding."""
+        if self._matrix is None:
+            ids = [doc_id for doc_id, doc in self.docs.items() if doc.get("embedding")]
+            vectors = np.asarray([self.docs[doc_id]["embedding"] for doc_id in ids], dtype=np.float32)
+            if len(ids):
+                vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+            self._matrix = (ids, vectors.reshape(len(ids), -1))
+        return self._matrix
+
+
+class FakeCluster:
+    """
+    In-memory single-node cluster. Searches are exact (brute-force kNN, a
+    term-frequency score for `match`), so results are deterministic; the
+    point is to exercise the clients, request bodies and response handling
+    of the backends, not to model Lucene's performance. `latency` adds a
+    fixed delay to every request, as a network round trip would. Store
+    sizes in index stats are the JSON size of the documents.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.indices: Dict[str, _Index] = {}
+        # Alias -> the one index it points at
+        self.aliases: Dict[str, str] = {}
+        self.requests: Counter = Counter()
+        self._created = 0
+        self._lock = threading.RLock()
+
+    # Transport entry point
+
+    def handle(self, method: str, target: str, body: Optional[bytes]) -> Tuple[int, Dict]:
+        path = target.split("?", 1)[0]
+        parts = [part for part in path.split("/") if part]
+        endpoint = next((part for part in parts if part.startswith("_")), "_index" if parts else "_root")
+        self.requests[f"{method} {endpoint}"] += 1
+        with self._lock:
+            try:
+                return self._route(method, parts, body)
+            except KeyError as e:
+                return 404, {"error": {"type": "index_not_found_exception", "reason": f"no such index {e}"}, "status": 404}
+
+    def _route(self, method: str, parts: List[str], body: Optional[bytes]) -> Tuple[int, Dict]:
+        data = json.loads(body) if body and parts and parts[-1] not in ("_bulk", "_msearch") else {}
+        if not parts:
+            return 200, {"version": {"number": "8.8.0"}, "tagline": "You Know, for Search"}
+        name = parts[0]
+        if parts[-1] == "_bulk":
+            return 200, self._bulk(body or b"")
+        if parts[-1] == "_msearch":
+            return 200, self._msearch(body or b"", name if len(parts) > 1 else None)
+        if name == "_pit":
+            return 200, {"succeeded": True, "num_freed": 1}
+        if name == "_aliases":
+            self._update_aliases(data["actions"])
+            return 200, {"acknowledged": True}
+        if name == "_alias":
+            if parts[1] not in self.aliases:
+                return 404, {"error": f"alias [{parts[1]}] missing", "status": 404}
+            return 200, {self.aliases[parts[1]]: {"aliases": {parts[1]: {}}}}
+        if name == "_reindex":
+            source, dest = self.indices[self._name(data["source"]["index"])], data["dest"]["index"]
+            target = self.indices.setdefault(self._name(dest), self._new_index({}))
+            for doc_id, doc in source.docs.items():
+                target.put(doc_id, dict(doc))
+            return 200, {"total": len(source.docs), "created": len(source.docs), "failures": []}
+        if name == "_cluster":
+            return 200, {"status": "green", "timed_out": False}
+        if len(parts) == 1:
+            if method == "HEAD":
+                return (200 if name in self.indices or name in self.aliases else 404), {}
+            if method == "PUT":
+                self.indices[name] = self._new_index(data)
+                for alias in data.get("aliases", {}):
+                    self.aliases[alias] = name
+                return 200, {"acknowledged": True, "index": name}
+            if method == "DELETE":
+                for index in self._resolve(name, missing_ok=True):
+                    self.indices.pop(index, None)
+                    self.aliases = {alias: target for alias, target in self.aliases.items() if target != index}
+                return 200, {"acknowledged": True}
+            if method == "GET":
+                return 200, {
+                    index: {
+                        "aliases": {alias: {} for alias, target in self.aliases.items() if target == index},
+                        "mappings": self.indices[index].mappings,
+                        "settings": {"index": dict(self.indices[index].settings)},
+                    }
+                    for index in self._resolve(name, missing_ok=True)
+                }
+
+        action = parts[1]
+        if action == "_search":
+            return 200, self._search(name, data)
+        if action == "_pit":
+            return 200, {"id": name}
+        if action == "_mapping":
+            if method == "GET":
+                return 200, {index: {"mappings": self.indices[index].mappings} for index in self._resolve(name)}
+            for index in self._resolve(name):
+                mappings = self.indices[index].mappings
+                mappings.setdefault("properties", {}).update(data.get("properties", {}))
+                if "_meta" in data:
+                    mappings["_meta"] = data["_meta"]
+            return 200, {"acknowledged": True}
+        if action == "_settings":
+            if method == "GET":
+                return 200, {index: {"settings": {"index": dict(self.indices[index].settings)}} for index in self._resolve(name)}
+            for index in self._resolve(name):
+                self.indices[index].settings.update(data.get("index", data))
+            return 200, {"acknowledged": True}
+        if action == "_count":
+            index = self.indices[self._name(name)]
+            return 200, {"count": sum(1 for doc in index.docs.values() if self._matches(doc, data.get("query")))}
+        if action == "_stats":
+            return 200, {"indices": {
+                index: {"primaries": {
+                    "docs": {"count": len(self.indices[index].docs)},
+                    "store": {"size_in_bytes": sum(len(json.dumps(doc)) for doc in self.indices[index].docs.values())},
+                }}
+                for index in self._resolve(name)
+            }}
+        if action in ("_refresh", "_forcemerge"):
+            self._resolve(name)
+            return 200, {"_shards": {"total": 1, "successful": 1, "failed": 0}}
+        if action == "_delete_by_query":
+            index = self.indices[self._name(name)]
+            doomed = [doc_id for doc_id, doc in index.docs.items() if self._matches(doc, data.get("query"))]
+            for doc_id in doomed:
+                index.delete(doc_id)
+            return 200, {"deleted": len(doomed), "failures": []}
+        if action == "_doc":
+            name = self._name(name)
+            if method == "GET":
+                doc = self.indices[name].docs.get(parts[2])
+                if doc is None:
+                    return 404, {"_index": name, "_id": parts[2], "found": False}
+                return 200, {"_index": name, "_id": parts[2], "found": True, "_source": doc}
+            self.indices.setdefault(name, self._new_index({})).put(parts[2], data)
+            return 200, {"_index": name, "_id": parts[2], "result": "created"}
+        return 400, {"error": {"type": "illegal_argument_exception", "reason": f"unsupported: {method} /{'/'.join(parts)}"}}
+
+    def _new_index(self, body: Dict) -> _Index:
+        # Creation dates are strictly increasing, as generations are ordered by them
+        self._created = max(self._created + 1, int(time.time() * 1000))
+        return _Index(body, self._created)
+
+    def _name(self, name: str) -> str:
+        """The index behind an alias, or `name` itself."""
+        return self.aliases.get(name, name)
+
+    def _resolve(self, name: str, missing_ok: bool = False) -> List[str]:
+        """Indices named by a comma-separated list of names, aliases and wildcards."""
+        names = []
+        for part in name.split(","):
+            if "*" in part:
+                names.extend(sorted(index for index in self.indices if fnmatch.fnmatchcase(index, part)))
+            elif self._name(part) in self.indices:
+                names.append(self._name(part))
+        if not names and not missing_ok:
+            raise KeyError(name)
+        return names
+
+    def _update_aliases(self, actions: List[Dict]):
+        aliases = dict(self.aliases)
+        doomed = []
+        for action in actions:
+            (kind, params), = action.items()
+            if kind == "add":
+                if params["index"] not in self.indices:
+                    raise KeyError(params["index"])
+                aliases[params["alias"]] = params["index"]
+            elif kind == "remove":
+                aliases.pop(params["alias"], None)
+            elif kind == "remove_index":
+                doomed.append(params["index"])
+        # Applied all at once, as the real API does
+        for index in doomed:
+            del self.indices[index]
+        self.aliases = aliases
+
+    # Bulk
+
+    def _bulk(self, body: bytes) -> Dict:
+        lines = [line for line in body.split(b"\n") if line.strip()]
+        items = []
+        i = 0
+        while i < len(lines):
+            (op, meta), = json.loads(lines[i]).items()
+            index = self.indices.setdefault(self._name(meta["_index"]), self._new_index({}))
+            if op == "delete":
+                found = index.delete(meta["_id"])
+                items.append({op: {"_index": meta["_index"], "_id": meta["_id"], "status": 200 if found else 404}})
+                i += 1
+                continue
+            source = json.loads(lines[i + 1])
+            i += 2
+            if op == "create" and meta["_id"] in index.docs:
+                items.append({op: {"_index": meta["_index"], "_id": meta["_id"], "status": 409, "error": {
+                    "type": "version_conflict_engine_exception", "reason": "document already exists"}}})
+                continue
+            index.put(meta["_id"], source.get("doc", source) if op == "update" else source)
+            items.append({op: {"_index": meta["_index"], "_id": meta["_id"], "status": 201}})
+        errors = any(item[next(iter(item))]["status"] >= 300 for item in items)
+        return {"took": 0, "errors": errors, "items": items}
+
+    # Search
+
+    def _msearch(self, body: bytes, default_index: Optional[str]) -> Dict:
+        lines = [json.loads(line) for line in body.split(b"\n") if line.strip()]
+        responses = []
+        for header, search in zip(lines[0::2], lines[1::2]):
+            index = header.get("index") or default_index or (search.get("pit") or {}).get("id")
+            try:
+                responses.append({**self._search(index, search), "status": 200})
+            except KeyError as e:
+                responses.append({"error": {"type": "index_not_found_exception", "reason": str(e)}, "status": 404})
+        return {"took": 0, "responses": responses}
+
+    def _search(self, name: Optional[str], body: Dict) -> Dict:
+        name = self._name(name or (body.get("pit") or {}).get("id"))
+        index = self.indices[name]
+        query = body.get("query")
+
+        if "knn" in body:
+            # Elasticsearch: top-level `knn` with a list of filter clauses
+            knn = body["knn"]
+            scored = self._knn(index, knn["query_vector"], knn["k"], {"bool": {"filter": knn.get("filter", [])}})
+        elif query and "knn" in query:
+            # OpenSearch: `knn` query on the vector field with a bool filter
+            knn = query["knn"]["embedding"]
+            scored = self._knn(index, knn["vector"], knn["k"], knn.get("filter"))
+        else:
+            scored = [
+                (self._score(doc, query), doc_id, doc)
+                for doc_id, doc in index.docs.items()
+                if self._matches(doc, query)
+            ]
+            scored.sort(key=lambda hit: -hit[0])
+
+        positions = {doc_id: i for i, doc_id in enumerate(index.docs)} if "sort" in body else {}
+        hits = [
+            {"_index": name, "_id": doc_id, "_score": score, "_source": self._source(doc, body.get("_source")),
+             "_seq": positions.get(doc_id), "_doc": doc}
+            for score, doc_id, doc in scored
+        ]
+        if "sort" in body:
+            hits = self._sort(hits, body["sort"], body.get("search_after"))
+        for hit in hits:
+            hit.pop("_seq")
+            hit.pop("_doc")
+
+        start = body.get("from", 0)
+        hits = hits[start:start + body.get("size", 10)]
+        response = {"took": 0, "timed_out": False, "hits": {"total": {"value": len(scored), "relation": "eq"}, "hits": hits}}
+        if body.get("pit"):
+            response["pit_id"] = body["pit"]["id"]
+        if body.get("aggs"):
+            response["aggregations"] = self._aggregations(body["aggs"], [doc for _, _, doc in scored])
+        return response
+
+    @staticmethod
+    def _aggregations(aggs: Dict, docs: List[Dict]) -> Dict:
+        results = {}
+        for name, agg in aggs.items():
+            (kind, params), = agg.items()
+            values = [doc[params["field"]] for doc in docs if doc.get(params["field"]) is not None]
+            if kind == "terms":
+                counts = Counter(values).most_common(params.get("size", 10))
+                results[name] = {"buckets": [{"key": key, "doc_count": count} for key, count in counts]}
+            elif kind == "cardinality":
+                results[name] = {"value": len(set(values))}
+            else:
+                raise ValueError(f"Unsupported aggregation: {kind}")
+        return results
+
+    def _knn(self, index: _Index, vector: Sequence[float], k: int, filter_query: Optional[Dict]) -> List[Tuple]:
+        ids, matrix = index.matrix()
+        if not ids:
+            return []
+        query = np.asarray(vector, dtype=np.float32)
+        query /= max(float(np.linalg.norm(query)), 1e-12)
+        scores = (matrix @ query + 1) / 2
+        hits = []
+        for row in np.argsort(-scores, kind="stable"):
+            doc = index.docs[ids[row]]
+            if self._matches(doc, filter_query):
+                hits.append((float(scores[row]), ids[row], doc))
+                if len(hits) == k:
+                    break
+        return hits
+
+    def _matches(self, doc: Dict, query: Optional[Dict]) -> bool:
+        if not query or "match_all" in query:
+            return True
+        if "script_score" in query:
+            return self._matches(doc, query["script_score"]["query"])
+        if "bool" in query:
+            clauses = query["bool"]
+            filters = clauses.get("filter", [])
+            filters = filters if isinstance(filters, list) else [filters]
+            if not all(self._matches(doc, clause) for clause in filters):
+                return False
+            should = clauses.get("should", [])
+            if should and clauses.get("minimum_should_match", 1):
+                return any(self._score(doc, clause) > 0 for clause in should)
+            return True
+        if "term" in query:
+            (field, value), = query["term"].items()
+            value = value["value"] if isinstance(value, dict) else value
+            return doc.get(field) == value
+        if "terms" in query:
+            (field, values), = query["terms"].items()
+            return doc.get(field) in values
+        if "match" in query:
+            return self._score(doc, query) > 0
+        raise ValueError(f"Unsupported query: {query}")
+
+    def _score(self, doc: Dict, query: Optional[Dict]) -> float:
+        if not query or "match_all" in query:
+            return 1.0
+        if "script_score" in query:
+            script = query["script_score"]["script"]
+            param, field = _SCRIPT_LOOKUP_RE.fullmatch(script["source"]).groups()
+            return float(script["params"][param][doc[field]])
+        if "bool" in query:
+            return sum(self._score(doc, clause) for clause in query["bool"].get("should", [])) or 1.0
+        if "match" in query:
+            (field, text), = query["match"].items()
+            terms = Counter(_TERM_RE.findall(str(doc.get(field, "")).lower()))
+            return float(sum(terms[term] for term in _TERM_RE.findall(str(text).lower())))
+        if "term" in query:
+            (field, value), = query["term"].items()
+            boost = value.get("boost", 1.0) if isinstance(value, dict) else 1.0
+            return boost if self._matches(doc, query) else 0.0
+        return 1.0 if self._matches(doc, query) else 0.0
+
+    @staticmethod
+    def _source(doc: Dict, source_filter) -> Dict:
+        if source_filter is None or source_filter is True:
+            return doc
+        if source_filter is False:
+            return {}
+        if isinstance(source_filter, list):
+            source_filter = {"includes": source_filter}
+        includes = source_filter.get("includes")
+        excludes = set(source_filter.get("excludes", []))
+        return {
+            field: value for field, value in doc.items()
+            if (includes is None or field in includes) and field not in excludes
+        }
+
+    @staticmethod
+    def _sort(hits: List[Dict], sort: List, search_after: Optional[List]) -> List[Dict]:
+        keys = []
+        for clause in sort:
+            field, order = next(iter(clause.items())) if isinstance(clause, dict) else (clause, "asc")
+            keys.append((field, order))
+
+        def values(hit):
+            out = []
+            for field, _ in keys:
+                if field == "_score":
+                    out.append(hit["_score"])
+                elif field == "_shard_doc":
+                    out.append(hit["_seq"])
+                else:
+                    out.append(hit["_doc"].get(field, ""))
+            return out
+
+        for hit in hits:
+            hit["sort"] = values(hit)
+
+        def sort_key(hit):
+            # Flip descending numeric keys; string keys in this index are all ascending
+            return [-v if order == "desc" else v for v, (_, order) in zip(hit["sort"], keys)]
+
+        hits.sort(key=sort_key)
+        if search_after is not None:
+            after = [-v if order == "desc" else v for v, (_, order) in zip(search_after, keys)]
+            hits = [hit for hit in hits if sort_key(hit) > after]
+        return hits
+
+
+def _response(node, status: int, data: Dict, method: str, start: float):
+    headers = HttpHeaders({"content-type": "application/json", "x-elastic-product": "Elasticsearch"})
+    meta = ApiResponseMeta(
+        status=status, http_version="1.1", headers=headers, duration=time.perf_counter() - start, node=node.config
+    )
+    return NodeApiResponse(meta, b"" if method == "HEAD" else json.dumps(data).encode("utf-8"))
+
+
+class FakeNode(BaseNode):
+    """Transport node answering from a `FakeCluster` instead of over HTTP."""
+
+    cluster: FakeCluster
+
+    def perform_request(self, method, target, body=None, headers=None, request_timeout=None):
+        start = time.perf_counter()
+        if self.cluster.latency:
+            time.sleep(self.cluster.latency)
+        status, data = self.cluster.handle(method, target, body)
+        return _response(self, status, data, method, start)
+
+
+class AsyncFakeNode(BaseAsyncNode):
+    cluster: FakeCluster
+
+    async def perform_request(self, method, target, body=None, headers=None, request_timeout=None):
+        start = time.perf_counter()
+        if self.cluster.latency:
+            await asyncio.sleep(self.cluster.latency)
+        status, data = self.cluster.handle(method, target, body)
+        return _response(self, status, data, method, start)
+
+    async def close(self):
+        pass
+
+
+def fake_clients(cluster: FakeCluster) -> Tuple[Elasticsearch, AsyncElasticsearch]:
+    """Real sync and async clients whose only node is `cluster`."""
+    node = type("BoundFakeNode", (FakeNode,), {"cluster": cluster})
+    async_node = type("BoundAsyncFakeNode", (AsyncFakeNode,), {"cluster": cluster})
+    return (
+        Elasticsearch("http://fake-cluster:9200", node_class=node),
+        AsyncElasticsearch("http://fake-cluster:9200", node_class=async_node),
+    )
@@ -0,0 +1,108 @@
+"""
+Concurrent load against a running web server.
+
+Fires `--requests` requests at `--concurrency` against one endpoint and
+reports throughput and latency percentiles. For streaming endpoints the
+time to the first body chunk is reported as well.
+
+    python -m bench.query_load --path /search --query "make a post request"
+    python -m bench.query_load --path /summarizer/stream --concurrency 20
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import Dict, List, Optional, Sequence, Union
+
+import httpx
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def pick(p: float) -> float:
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+    return {"p50": pick(50), "p95": pick(95), "p99": pick(99), "max": ordered[-1]}
+
+
+async def run_load(
+    base_url: str,
+    path: str,
+    params: Union[Dict, Sequence[Dict]],
+    requests: int,
+    concurrency: int,
+    timeout: float,
+    transport: Optional[httpx.AsyncBaseTransport] = None,
+) -> Dict:
+    """
+    `params` may be a list, cycled through request by request. Pass an
+    `httpx.ASGITransport` as `transport` to load an app in-process.
+    """
+    params_list = [params] if isinstance(params, dict) else list(params)
+    latencies: List[float] = []
+    first_chunk: List[float] = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(
+        base_url=base_url, timeout=timeout, limits=httpx.Limits(max_connections=concurrency), transport=transport
+    ) as client:
+
+        async def one(i: int):
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    async with client.stream("GET", path, params=params_list[i % len(params_list)]) as response:
+                        first = None
+                        async for _ in response.aiter_bytes():
+                            if first is None:
+                                first = time.perf_counter() - start
+                        if response.status_code >= 400:
+                            errors += 1
+                            return
+                except httpx.HTTPError:
+                    errors += 1
+                    return
+                latencies.append(time.perf_counter() - start)
+                if first is not None:
+                    first_chunk.append(first)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(requests)))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "path": path,
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "seconds": elapsed,
+        "requests_per_second": len(latencies) / elapsed if elapsed else 0.0,
+        "latency": percentiles(latencies),
+        "time_to_first_chunk": percentiles(first_chunk),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--path", default="/search")
+    parser.add_argument("--query", default="make a post request")
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    args = parser.parse_args()
+
+    result = asyncio.run(run_load(
+        args.base_url, args.path, {"q": args.query, "k": args.k}, args.requests, args.concurrency, args.timeout
+    ))
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+"""
+Offline benchmark suite: indexing throughput and query latency.
+
+Runs every stage against the deterministic fakes in `bench.fakes`, so it
+needs no embedding service, Elasticsearch or LLM, and results only change
+when the code does:
+
+- extraction: files and chunks per second of the chunk extractor
+- embedding: chunks per second through `embed_batch`
+- ingest: documents per second of `index_chunks` inside `bulk_load`, per
+  backend flavor, and the backend's `storage_report` afterwards
+- queries: p50/p95/p99 latency of `/search` (vector and hybrid) and
+  `/summarizer/stream` under concurrent load, served in-process, per flavor
+
+The `elasticsearch` and `opensearch` flavors send their own query shapes
+to a `FakeCluster` through the real clients; append `-dedup` to a flavor
+(e.g. `--flavors elasticsearch,elasticsearch-dedup`) for dedup vector storage. Pass `--es-host` to run them
+against a real cluster instead (use a scratch cluster: the suite writes to
+the chunk index under the repo name `bench`), and `--real-embedder` to
+embed with `ModelCache`.
+
+    python -m bench.suite --out bench-results.json
+    python -m bench.suite --baseline bench-results.json --out new.json
+
+Run it from the repository root (the web app resolves its templates and
+static files relative to the working directory). Requests go through
+`httpx.ASGITransport`, which buffers response bodies, so streaming
+behaviour is best measured with `bench.query_load` against a server.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import sysconfig
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+FLAVORS = ("elasticsearch", "opensearch", "local")
+BENCH_REPO = "bench"
+
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    from bench.query_load import percentiles
+    return percentiles(samples)
+
+
+def load_sources(root: Path, max_files: int) -> Dict[str, str]:
+    """Relative path -> source of the first `max_files` Python files under `root`, in path order."""
+    sources = {}
+    for path in sorted(root.rglob("*.py")):
+        if len(sources) >= max_files:
+            break
+        try:
+            sources[str(path.relative_to(root))] = path.read_text(encoding="utf-8")
+        except (UnicodeDecodeError, OSError):
+            continue
+    return sources
+
+
+def bench_extraction(sources: Dict[str, str], repeat: int) -> Dict:
+    from processor import extract_chunks_from_source
+
+    # Warm up the tokenizer outside the timed runs
+    list(extract_chunks_from_source("def warm_up():\n    pass\n"))
+    best = float("inf")
+    chunks = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        chunks = sum(1 for source in sources.values() for _ in extract_chunks_from_source(source))
+        best = min(best, time.perf_counter() - start)
+    return {
+        "files": len(sources),
+        "chunks": chunks,
+        "seconds": best,
+        "files_per_second": len(sources) / best,
+        "chunks_per_second": chunks / best,
+    }
+
+
+def extract_all(sources: Dict[str, str]) -> List[Dict]:
+    from processor import extract_chunks_from_source, link_chunks
+
+    chunks = []
+    for rel_path, source in sources.items():
+        chunks.extend(link_chunks(extract_chunks_from_source(source), rel_path, BENCH_REPO))
+    return chunks
+
+
+def bench_embedding(chunks: List[Dict], batch_size: int) -> Dict:
+    from processor import embed_batch
+
+    batch_seconds = []
+    start = time.perf_counter()
+    for i in range(0, len(chunks), batch_size):
+        batch_start = time.perf_counter()
+        embed_batch(chunks[i:i + batch_size])
+        batch_seconds.append(time.perf_counter() - batch_start)
+    elapsed = time.perf_counter() - start
+    return {
+        "chunks": len(chunks),
+        "batch_size": batch_size,
+        "seconds": elapsed,
+        "chunks_per_second": len(chunks) / elapsed if elapsed else 0.0,
+        "batch_latency": _percentiles(batch_seconds),
+    }
+
+
+def make_backend(flavor: str, es_host: Optional[str], latency: float, index_dir: str):
+    if flavor == "local":
+        from local_index import LocalBackend
+        backend = LocalBackend(index_dir)
+    else:
+        from es_utils import ElasticsearchBackend
+        flavor, _, storage = flavor.partition("-")
+        if es_host:
+            from elasticsearch import AsyncElasticsearch, Elasticsearch
+            clients = Elasticsearch(es_host), AsyncElasticsearch(es_host)
+        else:
+            from bench.fakes import FakeCluster, fake_clients
+            clients = fake_clients(FakeCluster(latency=latency))
+        backend = ElasticsearchBackend(flavor, es=clients[0], async_es=clients[1], storage=storage or "inline")
+    backend.ensure_index()
+    backend.delete_repo_chunks(BENCH_REPO)
+    return backend
+
+
+def bench_ingest(backend, chunks: List[Dict], batch_size: int) -> Dict:
+    start = time.perf_counter()
+    with backend.bulk_load():
+        written = sum(backend.index_chunks(chunks[i:i + batch_size]) for i in range(0, len(chunks), batch_size))
+    elapsed = time.perf_counter() - start
+    return {"docs": written, "seconds": elapsed, "docs_per_second": written / elapsed if elapsed else 0.0}
+
+
+def query_params(chunks: List[Dict], count: int = 50) -> List[str]:
+    """Deterministic, distinct queries made of the chunks' names."""
+    names = sorted({chunk["name"] for chunk in chunks})
+    step = max(1, len(names) // count)
+    return [f"how does {name.replace('_', ' ')} work" for name in names[::step][:count]]
+
+
+async def bench_queries(queries: List[str], requests: int, concurrency: int, llm_tokens: int) -> Dict:
+    import httpx
+
+    import es_utils
+    import main
+    import summarizer
+    from bench.fakes import AsyncFakeEmbedder, FakeLLM
+    from bench.query_load import run_load
+    from query_cache import QueryCache
+    from summary_cache import SummaryCache
+
+    # Measure the backend on every request, not the caches
+    es_utils.async_embedding_client = AsyncFakeEmbedder()
+    es_utils.query_cache = QueryCache(0, 0, shared_url="")
+    summarizer.async_client = FakeLLM(tokens=llm_tokens)
+    summarizer.summary_cache = SummaryCache(maxsize=0)
+
+    transport = httpx.ASGITransport(app=main.app)
+    loads = {
+        "/search?mode=vector": ("/search", [{"q": q, "k": 5, "mode": "vector"} for q in queries]),
+        "/search?mode=hybrid": ("/search", [{"q": q, "k": 5, "mode": "hybrid"} for q in queries]),
+        "/summarizer/stream": ("/summarizer/stream", [{"q": q, "k": 3} for q in queries]),
+    }
+    results = {}
+    for name, (path, params) in loads.items():
+        results[name] = await run_load("http://bench", path, params, requests, concurrency, 60.0, transport=transport)
+    return results
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline: Dict, current: Dict, prefix: str = "") -> List[str]:
+    """One line per numeric result present in both runs, with its relative change."""
+    lines = []
+    for key, value in current.items():
+        if key == "meta" or key not in baseline:
+            continue
+        name = f"{prefix}{key}"
+        old = baseline[key]
+        if isinstance(value, dict) and isinstance(old, dict):
+            lines.extend(compare(old, value, f"{name}."))
+        elif isinstance(value, (int, float)) and isinstance(old, (int, float)) and old:
+            lines.append(f"{name}: {old:.4g} -> {value:.4g} ({(value - old) / old:+.1%})")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", type=Path, default=Path(sysconfig.get_paths()["stdlib"]) / "email",
+                        help="Directory of Python files to index (default: the stdlib's email package)")
+    parser.add_argument("--max-files", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3, help="Extraction runs; the best is kept")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--flavors", default=",".join(FLAVORS))
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--llm-tokens", type=int, default=50, help="Tokens streamed by the fake LLM")
+    parser.add_argument("--es-latency", type=float, default=0.0, help="Seconds added to every fake cluster request")
+    parser.add_argument("--es-host", help="Run the ES/OpenSearch flavors against this cluster")
+    parser.add_argument("--real-embedder", action="store_true", help="Embed with ModelCache instead of the fake")
+    parser.add_argument("--out", type=Path, help="Write the results as JSON")
+    parser.add_argument("--baseline", type=Path, help="Results of an earlier run to compare with")
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.getcwd())
+    import processor
+    from bench.fakes import FakeEmbedder
+    from search_backend import set_backend
+
+    if not args.real_embedder:
+        processor._model = FakeEmbedder()
+
+    sources = load_sources(args.corpus, args.max_files)
+    print(f"Corpus: {args.corpus} ({len(sources)} files)")
+    results: Dict = {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "timestamp": time.time(),
+            "args": {key: str(value) for key, value in vars(args).items()},
+        },
+    }
+
+    results["extraction"] = bench_extraction(sources, args.repeat)
+    print(f"extraction: {results['extraction']['chunks_per_second']:.0f} chunks/s")
+
+    chunks = extract_all(sources)
+    results["embedding"] = bench_embedding(chunks, args.batch_size)
+    print(f"embedding: {results['embedding']['chunks_per_second']:.0f} chunks/s")
+
+    queries = query_params(chunks)
+    results["ingest"], results["storage"], results["queries"] = {}, {}, {}
+    for flavor in [flavor for flavor in args.flavors.split(",") if flavor]:
+        with tempfile.TemporaryDirectory() as index_dir:
+            backend = make_backend(flavor, args.es_host, args.es_latency, index_dir)
+            results["ingest"][flavor] = bench_ingest(backend, chunks, args.batch_size)
+            print(f"ingest[{flavor}]: {results['ingest'][flavor]['docs_per_second']:.0f} docs/s")
+            results["storage"][flavor] = backend.storage_report()
+            print(f"storage[{flavor}]: {results['storage'][flavor]['bytes_per_chunk']:.0f} bytes per chunk")
+
+            set_backend(backend)
+            try:
+                results["queries"][flavor] = asyncio.run(
+                    bench_queries(queries, args.requests, args.concurrency, args.llm_tokens)
+                )
+            finally:
+                set_backend(None)
+                if args.es_host:
+                    backend.delete_repo_chunks(BENCH_REPO)
+            for name, load in results["queries"][flavor].items():
+                latency = load["latency"]
+                print(f"queries[{flavor}] {name}: p50 {latency.get('p50', 0) * 1000:.1f}ms "
+                      f"p95 {latency.get('p95', 0) * 1000:.1f}ms p99 {latency.get('p99', 0) * 1000:.1f}ms "
+                      f"({load['errors']} errors)")
+
+    if args.out:
+        args.out.write_text(json.dumps(results, indent=2))
+        print(f"Wrote {args.out}")
+    if args.baseline:
+        print("\n".join(compare(json.loads(args.baseline.read_text()), results)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Checkpoint journal for resumable indexing runs.
+
+A run appends a file to the journal before its first chunk goes to the
+index ("start") and again once all of its chunks are written ("done"). When
+a run is killed, the next run for the same repo and target commit finds the
+journal, skips the files that are done, and deletes the chunks of files
+that were started but not finished before indexing them again. A finished
+run removes its journal.
+
+The first line identifies the run as JSON; every further line is a JSON
+`[event, file path]` pair.
+"""
+import json
+import os
+import threading
+from pathlib import Path
+from typing import IO, List, Optional, Set
+
+CHECKPOINT_DIR = Path(os.getenv("CHECKPOINT_DIR", "./.cache/checkpoints"))
+
+
+class CheckpointJournal:
+    def __init__(self, repo_name: str, commit: str, full: bool, directory: Path = CHECKPOINT_DIR):
+        """
+        Load the journal of an interrupted run of the same kind (full or
+        incremental) to the same commit, if there is one. Nothing is written
+        until `begin`.
+        """
+        self.path = Path(directory) / f"{repo_name.replace('/', '__')}.journal"
+        self.header = {"repo": repo_name, "commit": commit, "full": full}
+        self.started: Set[str] = set()
+        self.completed: Set[str] = set()
+        # A journal was found: some run for the repo was interrupted
+        self.interrupted = False
+        # ... and it is this run's
+        self.resumed = False
+        self._file: Optional[IO[str]] = None
+        self._lock = threading.Lock()
+
+        if not self.path.exists():
+            return
+        self.interrupted = True
+        lines = self.path.read_text(encoding="utf-8").split("\n")
+        try:
+            header = json.loads(lines[0])
+        except ValueError:
+            return
+        if header == self.header:
+            self.resumed = True
+            # The last entry may have been cut short by the kill; only
+            # newline-terminated entries count
+            for line in lines[1:-1]:
+                event, file_path = json.loads(line)
+                (self.completed if event == "done" else self.started).add(file_path)
+
+    @property
+    def partial(self) -> List[str]:
+        """Files of the interrupted run that may have some of their chunks in the index."""
+        return sorted(self.started - self.completed)
+
+    def begin(self):
+        """Start recording; a stale journal of another run is replaced."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if not self.resumed:
+            tmp = self.path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(self.header) + "\n", encoding="utf-8")
+            os.replace(tmp, self.path)
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def start(self, file_path: str):
+        """Record a file about to have chunks written."""
+        self._append("start", file_path, self.started)
+
+    def mark(self, file_path: str):
+        """Record a file whose chunks are all in the index."""
+        self._append("done", file_path, self.completed)
+
+    def _append(self, event: str, file_path: str, paths: Set[str]):
+        with self._lock:
+            paths.add(file_path)
+            if self._file is not None:
+                # Flushed to the OS per entry, which is enough to survive the
+                # process being killed
+                self._file.write(json.dumps([event, file_path]) + "\n")
+                self._file.flush()
+
+    def close(self):
+        """Stop recording and keep the journal, so the next run resumes."""
+        with self._lock:
+            if self._file is not None:
+                os.fsync(self._file.fileno())
+                self._file.close()
+                self._file = None
+
+    def finish(self):
+        """The run completed: drop the journal."""
+        self.close()
+        self.path.unlink(missing_ok=True)
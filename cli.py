@@ -1,10 +1,8 @@
+import os
 import typer
-from pathlib import Path
-import shutil
-from git import Repo
-from processor import extract_chunks_from_file, embed_chunks
-from es_utils import ensure_index, index_chunks
 
+# Commands import what they use, so `--help` or `echo` doesn't load the
+# indexer, the search client or the embedding model
 app = typer.Typer()
 
 @app.command()
@@ -15,23 +13,174 @@ def echo(message: str):
     print(message)
 
 @app.command()
-def index_repo(github_url: str):
-    print("HEY")
-    repo_name = github_url.split("/")[-1].removesuffix(".git")
-    tmp_dir = Path("/tmp") / repo_name
+def index_repo(
+    github_url: str,
+    full: bool = typer.Option(False, "--full", help="Drop the repo's chunks and re-index every file"),
+    extract_workers: int = typer.Option(os.cpu_count() or 1, help="Processes parsing files into chunks"),
+    batch_size: int = typer.Option(64, help="Chunks per embedding batch (batches span files)"),
+    writer_workers: int = typer.Option(2, help="Threads writing batches to the index"),
+    queue_size: int = typer.Option(8, help="Max items buffered between pipeline stages"),
+    mode: str = typer.Option(None, help='"worktree" (kept clone) or "blobs" (shallow bare clone); default REPO_FETCH_MODE'),
+):
+    from indexer import REPO_FETCH_MODE, index_repo as run_index
+    from pipeline import PipelineConfig
+    from processor import get_model
 
-    if tmp_dir.exists():
-        shutil.rmtree(tmp_dir)
-    Repo.clone_from(github_url, tmp_dir)
+    config = PipelineConfig(
+        extract_workers=extract_workers,
+        batch_size=batch_size,
+        writer_workers=writer_workers,
+        queue_size=queue_size,
+    )
+    result = run_index(github_url, config, full=full, mode=mode or REPO_FETCH_MODE)
+    stats = result.stats
 
-    ensure_index()
+    mode = "incremental" if result.incremental else "full"
+    print(
+        f"Indexed repo: {result.repo_name} @ {result.commit[:12]} ({mode}: "
+        f"{stats.files} files, {stats.chunks} chunks, {len(result.deleted_files)} files removed "
+        f"in {stats.seconds:.1f}s)"
+    )
 
-    for py_file in tmp_dir.rglob("*.py"):
-        chunks = extract_chunks_from_file(py_file)
-        embedded = embed_chunks(chunks, str(py_file.relative_to(tmp_dir)), repo_name)
-        index_chunks(embedded)
+    cache_stats = get_model().cache_stats() if stats.chunks else None
+    if cache_stats:
+        print(f"Embedding cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses")
 
-    print(f"Indexed repo: {repo_name}")
+@app.command()
+def index_repos(
+    url_file: typer.FileText = typer.Argument(..., help="File with one GitHub URL per line"),
+    full: bool = typer.Option(False, "--full", help="Drop each repo's chunks and re-index every file"),
+    workers: int = typer.Option(2, help="Repos indexed at once"),
+):
+    """
+    Index many repos through the job scheduler, reusing their kept checkouts.
+    """
+    from jobs import FAILED, JobScheduler
+
+    urls = [line.strip() for line in url_file if line.strip() and not line.startswith("#")]
+    scheduler = JobScheduler(workers=workers, max_queue=max(len(urls), 1))
+    for url in urls:
+        scheduler.submit(url, full=full)
+
+    while not scheduler.join(timeout=10):
+        stats = scheduler.stats()
+        print(
+            f"{stats['completed'] + stats['failed']}/{len(urls)} done, {stats['running']} running, "
+            f"{stats['queue_depth']} queued, {stats['chunks_per_second']:.0f} chunks/s"
+        )
+    scheduler.shutdown(wait=True)
+
+    for job in scheduler.list():
+        if job.state == FAILED:
+            print(f"Failed: {job.repo_name}: {job.error}")
+        else:
+            print(f"Indexed repo: {job.repo_name} @ {job.commit[:12]} ({job.stats.files} files, {job.stats.chunks} chunks)")
+    stats = scheduler.stats()
+    print(f"{stats['completed']} succeeded, {stats['failed']} failed, {stats['chunks_indexed']} chunks")
+
+@app.command()
+def migrate_index():
+    """
+    Copy existing chunks onto the current mapping (HNSW-indexed vectors) as
+    a new index generation and make it live.
+    """
+    from es_utils import migrate_index as run_migration
+
+    generation = run_migration()
+    print(f"Migrated chunks to generation {generation}")
+
+@app.command()
+def rebuild_index(
+    url_file: typer.FileText = typer.Argument(..., help="File with one GitHub URL per line"),
+    mode: str = typer.Option(None, help='"worktree" (kept clone) or "blobs" (shallow bare clone); default REPO_FETCH_MODE'),
+    resume: str = typer.Option(None, help="Generation of a killed rebuild to finish"),
+):
+    """
+    Index the repos into a new index generation next to the live one, then
+    swap it in and drop old generations. Searches keep running meanwhile.
+    """
+    from indexer import REPO_FETCH_MODE, rebuild_index as run_rebuild
+
+    urls = [line.strip() for line in url_file if line.strip() and not line.startswith("#")]
+    generation, results = run_rebuild(
+        urls,
+        mode=mode or REPO_FETCH_MODE,
+        generation=resume,
+        on_generation=lambda generation: print(f"Building generation {generation} (resume with --resume {generation})"),
+    )
+    for result in results:
+        stats = result.stats
+        print(f"Indexed repo: {result.repo_name} @ {result.commit[:12]} ({stats.files} files, {stats.chunks} chunks)")
+    print(f"Generation {generation} is live")
+
+@app.command()
+def index_generations():
+    """
+    List the index generations, newest first, with the model they were built with.
+    """
+    from es_utils import index_generations as list_generations
+
+    for generation in list_generations():
+        meta = generation["meta"]
+        state = "live" if generation["live"] else "published" if "published_at" in meta else "unpublished"
+        model = "unknown model"
+        if meta:
+            model = (
+                f"{meta['embedding_model']} ({meta['embedding_dims']} dims, "
+                f"{meta['vector_storage']}/{meta['vector_quantization']})"
+            )
+        print(f"{generation['generation']}: {state}, {model}")
+
+@app.command()
+def storage_report():
+    """
+    Show stored bytes per chunk, and for Elasticsearch/OpenSearch the
+    estimated vector memory per chunk of every storage and quantization.
+    """
+    from es_utils import storage_report as run_report
+
+    report = run_report()
+    chunks, contents = report["chunks"], report["contents"]
+    print(f"{chunks} chunks, ~{contents} distinct contents ({chunks / max(contents, 1):.2f} chunks per content)")
+    print(f"Stored ({report['layout']}): {report['bytes_per_chunk']:.0f} bytes per chunk")
+    for part, size in report["parts"].items():
+        print(f"  {part}: {size:.0f}")
+    if "memory_per_chunk" in report:
+        print("Estimated vector memory per chunk:")
+        for layout, size in report["memory_per_chunk"].items():
+            current = " (current)" if layout == report["layout"] else ""
+            print(f"  {layout}: {size:.0f}{current}")
+
+@app.command()
+def prune_vectors():
+    """
+    Delete stored vectors no chunk refers to any more (VECTOR_STORAGE=dedup).
+    Pause indexing while it runs.
+    """
+    from es_utils import prune_vectors as run_prune
+
+    print(f"Pruned {run_prune()} vectors")
+
+@app.command()
+def build_ivf(n_lists: int = typer.Option(0, help="Number of clusters (default: sqrt of the row count)")):
+    """
+    Cluster the local index (SEARCH_ENGINE_FLAVOR=local) so searches only
+    scan the closest clusters.
+    """
+    from local_index import LocalBackend
+
+    lists = LocalBackend().build_ivf(n_lists or None)
+    print(f"Built IVF with {lists} lists")
+
+@app.command()
+def compact_index():
+    """
+    Drop deleted and replaced rows from the local index.
+    """
+    from local_index import LocalBackend
+
+    rows = LocalBackend().compact()
+    print(f"Compacted local index to {rows} rows")
 
 if __name__ == "__main__":
     app()
@@ -0,0 +1,2 @@
+# test_embedding_service.py is a manual check against a running embedding service
+collect_ignore = ["test_embedding_service.py"]
@@ -0,0 +1,84 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+
+class MicroBatcher:
+    """
+    Coalesce concurrent embedding requests into one model batch.
+
+    Requests are queued on the event loop; a single collector task pulls the
+    first waiting request, then keeps adding requests until the batch holds
+    `max_batch_size` texts or `max_wait_ms` has passed. The batch is encoded on
+    a dedicated executor thread so the event loop never blocks on the model,
+    and every caller gets back only the rows for its own texts.
+    """
+
+    def __init__(self, encode_fn: Callable[[List[str]], np.ndarray], max_batch_size: int = 64, max_wait_ms: float = 5.0):
+        self.encode_fn = encode_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embed")
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._collect())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._executor.shutdown(wait=False)
+
+    async def encode(self, texts: List[str]) -> np.ndarray:
+        if self._queue is None:
+            raise RuntimeError("MicroBatcher.start() has not been called")
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((texts, future))
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch: List[Tuple[List[str], asyncio.Future]] = [await self._queue.get()]
+            size = len(batch[0][0])
+            deadline = loop.time() + self.max_wait
+            while size < self.max_batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                batch.append(item)
+                size += len(item[0])
+
+            await self._run_batch(loop, batch)
+
+    async def _run_batch(self, loop, batch: List[Tuple[List[str], asyncio.Future]]):
+        texts = [text for request_texts, _ in batch for text in request_texts]
+        try:
+            embeddings = await loop.run_in_executor(self._executor, self.encode_fn, texts)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        offset = 0
+        for request_texts, future in batch:
+            end = offset + len(request_texts)
+            if not future.done():
+                future.set_result(embeddings[offset:end])
+            offset = end
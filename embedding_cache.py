@@ -0,0 +1,129 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+# SQLite's default limit on bound parameters is 999 on older builds
+_SQL_BATCH = 500
+
+
+class EmbeddingCache:
+    """
+    Persistent, content-addressed embedding cache backed by SQLite.
+
+    Vectors are stored as float32 blobs keyed by sha256(model name + text), so
+    unchanged functions, vendored copies and forks are only ever embedded once
+    per model. The file can be shared between processes (the indexer and the
+    embedding service); SQLite's WAL mode lets readers and a writer overlap.
+    Once the cache holds more than `max_entries` vectors, the least recently
+    used ones are evicted.
+    """
+
+    def __init__(self, path: str, max_entries: int = 250_000):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._puts_since_evict = 0
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key BLOB PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL"
+                ") WITHOUT ROWID"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+            self._conn.commit()
+
+    @classmethod
+    def from_env(cls) -> Optional["EmbeddingCache"]:
+        """Build the cache from EMBEDDING_CACHE_* settings, or None if disabled."""
+        path = os.getenv("EMBEDDING_CACHE_PATH", "./.cache/embeddings.sqlite3")
+        if not path or path.lower() in ("0", "off", "none"):
+            return None
+        return cls(path, int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", 250_000)))
+
+    @staticmethod
+    def key(model_name: str, text: str) -> bytes:
+        return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).digest()
+
+    def get_many(self, model_name: str, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """Look up cached vectors; misses come back as None."""
+        keys = [self.key(model_name, text) for text in texts]
+        found: Dict[bytes, bytes] = {}
+        with self._lock:
+            for i in range(0, len(keys), _SQL_BATCH):
+                batch = keys[i:i + _SQL_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                found.update(self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ))
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, k) for k in found]
+                )
+                self._conn.commit()
+            self.hits += sum(1 for k in keys if k in found)
+            self.misses += sum(1 for k in keys if k not in found)
+
+        return [np.frombuffer(found[k], dtype="<f4") if k in found else None for k in keys]
+
+    def put_many(self, model_name: str, texts: Sequence[str], vectors: np.ndarray):
+        vectors = np.asarray(vectors, dtype="<f4")
+        now = time.time()
+        rows = [(self.key(model_name, text), vector.tobytes(), now) for text, vector in zip(texts, vectors)]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)", rows)
+            self._conn.commit()
+            self._puts_since_evict += len(rows)
+            # Counting rows is a full scan, so only check the bound now and then
+            if self._puts_since_evict >= max(1, self.max_entries // 100):
+                self._puts_since_evict = 0
+                self._evict()
+
+    def _evict(self):
+        count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        if count <= self.max_entries:
+            return
+        # Evict a little extra so we don't evict again on the very next put
+        excess = count - int(self.max_entries * 0.9)
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE key IN "
+            "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (excess,)
+        )
+        self._conn.commit()
+
+    def encode(self, model_name: str, texts: Sequence[str], encode_fn: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """
+        Return float32 embeddings for `texts`, calling `encode_fn` only on
+        the texts that are not cached yet.
+        """
+        cached = self.get_many(model_name, texts)
+        missing = [i for i, vector in enumerate(cached) if vector is None]
+        if missing:
+            computed = np.asarray(encode_fn([texts[i] for i in missing]), dtype=np.float32)
+            self.put_many(model_name, [texts[i] for i in missing], computed)
+            for i, vector in zip(missing, computed):
+                cached[i] = vector
+        if not cached:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.stack(cached)
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "max_entries": self.max_entries,
+        }
@@ -1,11 +1,56 @@
-import requests
+import os
 from typing import List, Union
 
+import numpy as np
+
+import embedding_wire
+from metrics import SIZE_BUCKETS, Histogram, trace_headers
+
+WIRE_FORMATS = {
+    "float32": embedding_wire.FLOAT32,
+    "float16": embedding_wire.FLOAT16,
+    "msgpack": embedding_wire.MSGPACK,
+    "json": embedding_wire.JSON,
+}
+# Response format requested from the embedding service by default
+DEFAULT_WIRE_FORMAT = os.getenv("EMBEDDING_WIRE_FORMAT", "float32")
+
+embedding_request_seconds = Histogram(
+    "embedding_client_request_seconds", "Calls to the embedding service's /embed", ["client"]
+)
+embedding_request_texts = Histogram(
+    "embedding_client_request_texts", "Texts per call to the embedding service", ["client"], buckets=SIZE_BUCKETS
+)
+
+
+def _accept_header(wire_format: str) -> str:
+    # Always list JSON last so an older service still answers
+    return f"{WIRE_FORMATS[wire_format]}, {embedding_wire.JSON};q=0.1"
+
+
 class EmbeddingClient:
-    def __init__(self, base_url: str = "http://localhost:8001"):
+    def __init__(
+        self,
+        base_url: str = "http://localhost:8001",
+        wire_format: str = DEFAULT_WIRE_FORMAT,
+        timeout: float = 30.0,
+        pool_size: int = 10,
+    ):
         self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.headers = {"Accept": _accept_header(wire_format)}
+        # requests and httpx are imported by the client that uses them, since
+        # each adds ~0.1s to the startup of every importer of this module
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        # One pooled, keep-alive session per client
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
         
-    def get_embeddings(self, texts: Union[str, List[str]]) -> List[List[float]]:
+    def get_embeddings(self, texts: Union[str, List[str]]) -> np.ndarray:
         """
         Get embeddings for one or more texts.
         
@@ -13,22 +58,88 @@ class EmbeddingClient:
             texts: A single string or a list of strings to get embeddings for
             
         Returns:
-            A list of embedding vectors (each vector is a list of floats)
+            A (len(texts), dims) array. Binary responses are wrapped without
+            copying, so the array is read-only.
         """
         if isinstance(texts, str):
             texts = [texts]
             
-        response = requests.post(
-            f"{self.base_url}/embed",
-            json={"texts": texts}
-        )
+        embedding_request_texts.observe(len(texts), client="sync")
+        with embedding_request_seconds.time(client="sync"):
+            response = self.session.post(
+                f"{self.base_url}/embed",
+                json={"texts": texts},
+                headers={**self.headers, **trace_headers()},
+                timeout=self.timeout,
+            )
         response.raise_for_status()
-        return response.json()["embeddings"]
+        return embedding_wire.decode(response.content, response.headers.get("Content-Type"), response.headers)
     
     def health_check(self) -> bool:
         """Check if the embedding service is healthy"""
+        import requests
+
         try:
-            response = requests.get(f"{self.base_url}/health", timeout=5)
+            response = self.session.get(f"{self.base_url}/health", timeout=5)
             return response.status_code == 200
         except requests.RequestException:
             return False
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncEmbeddingClient:
+    """`EmbeddingClient` for use from async code (e.g. FastAPI routes)."""
+
+    def __init__(
+        self,
+        base_url: str = "http://localhost:8001",
+        wire_format: str = DEFAULT_WIRE_FORMAT,
+        timeout: float = 30.0,
+        pool_size: int = 10,
+    ):
+        self.base_url = base_url.rstrip('/')
+        self.headers = {"Accept": _accept_header(wire_format)}
+        import httpx
+
+        self.client = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        )
+
+    async def get_embeddings(self, texts: Union[str, List[str]]) -> np.ndarray:
+        """Async version of `EmbeddingClient.get_embeddings`."""
+        if isinstance(texts, str):
+            texts = [texts]
+
+        embedding_request_texts.observe(len(texts), client="async")
+        with embedding_request_seconds.time(client="async"):
+            response = await self.client.post(
+                f"{self.base_url}/embed", json={"texts": texts}, headers={**self.headers, **trace_headers()}
+            )
+        response.raise_for_status()
+        return embedding_wire.decode(response.content, response.headers.get("Content-Type"), response.headers)
+
+    async def health_check(self) -> bool:
+        """Check if the embedding service is healthy"""
+        import httpx
+
+        try:
+            response = await self.client.get(f"{self.base_url}/health", timeout=5)
+            return response.status_code == 200
+        except httpx.HTTPError:
+            return False
+
+    async def ready_check(self) -> bool:
+        """Check if the embedding service has loaded its model and can serve /embed"""
+        import httpx
+
+        try:
+            response = await self.client.get(f"{self.base_url}/ready", timeout=5)
+            return response.status_code == 200
+        except httpx.HTTPError:
+            return False
+
+    async def aclose(self):
+        await self.client.aclose()
@@ -1,5 +1,13 @@
-from sentence_transformers import SentenceTransformer
 import threading
+import time
+from embedding_cache import EmbeddingCache
+from inference_backends import load_backend
+from metrics import SIZE_BUCKETS, Histogram
+
+MODEL_NAME = "all-MiniLM-L6-v2"
+
+encode_seconds = Histogram("model_encode_seconds", "ModelCache.encode calls, embedding cache lookups included")
+encode_batch_size = Histogram("model_encode_batch_size", "Texts per ModelCache.encode call", buckets=SIZE_BUCKETS)
 
 class ModelCache:
     _instance = None
@@ -14,8 +22,29 @@ class ModelCache:
 
     def __init__(self):
         if not hasattr(self, 'model'):
-            self.model = SentenceTransformer("all-MiniLM-L6-v2", cache_folder="./.cache")
+            # torch, onnx or onnx-int8, picked by EMBEDDING_BACKEND
+            self.model = load_backend(model_name=MODEL_NAME, cache_folder="./.cache")
+            self.embedding_cache = EmbeddingCache.from_env()
 
     
-    def encode(self, query):
-        return self.model.encode(query)
\ No newline at end of file
+    def encode(self, query, batch_size: int = 32):
+        """
+        Embed a string or a list of strings. Texts already in the embedding
+        cache are not sent to the model.
+        """
+        single = isinstance(query, str)
+        texts = [query] if single else list(query)
+        encode_batch_size.observe(len(texts))
+
+        start = time.perf_counter()
+        if self.embedding_cache is None:
+            embeddings = self.model.encode(texts, batch_size=batch_size)
+        else:
+            embeddings = self.embedding_cache.encode(
+                self.model.cache_name, texts, lambda misses: self.model.encode(misses, batch_size=batch_size)
+            )
+        encode_seconds.observe(time.perf_counter() - start)
+        return embeddings[0] if single else embeddings
+
+    def cache_stats(self):
+        return self.embedding_cache.stats() if self.embedding_cache is not None else None
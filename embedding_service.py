@@ -1,7 +1,13 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from embedding_model import ModelCache
+from embedding_batcher import MicroBatcher
+import embedding_wire
+import metrics
+import asyncio
+import os
+import time
 import uvicorn
 from typing import List, Union
 
@@ -17,24 +23,89 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize model cache
-model_cache = ModelCache()
+# Request timings; the caller's X-Trace-Id is kept and echoed back
+app.add_middleware(metrics.MetricsMiddleware)
+
+# Load the model in the background at startup; /ready reports 503 until then
+WARM_UP_ON_STARTUP = os.getenv("WARM_UP_ON_STARTUP", "true").lower() in ("1", "true", "yes")
+
+# The model is loaded on first use, on the batcher's thread
+model_cache = None
+warm_up_seconds = None
+_warm_up_task = None
+
+warm_up_histogram = metrics.Histogram("warm_up_seconds", "Time taken by the startup warm-up")
+
+def encode(texts):
+    global model_cache
+    if model_cache is None:
+        model_cache = ModelCache()
+    return model_cache.encode(texts)
+
+# Concurrent /embed calls are coalesced into one model batch
+batcher = MicroBatcher(
+    encode,
+    max_batch_size=int(os.getenv("EMBED_MAX_BATCH_SIZE", 64)),
+    max_wait_ms=float(os.getenv("EMBED_MAX_WAIT_MS", 5)),
+)
+
+async def warm_up():
+    """Load the model and run one batch through it, on the batcher's thread."""
+    global warm_up_seconds
+    start = time.perf_counter()
+    try:
+        await batcher.encode(["def warm_up(): pass"])
+    except Exception as e:
+        print(f"Warm-up failed: {e}")
+        return
+    warm_up_seconds = time.perf_counter() - start
+    warm_up_histogram.observe(warm_up_seconds)
+    print(f"Warmed up in {warm_up_seconds:.2f}s")
+
+@app.on_event("startup")
+async def start_batcher():
+    global _warm_up_task
+    await batcher.start()
+    if WARM_UP_ON_STARTUP:
+        _warm_up_task = asyncio.create_task(warm_up())
+
+@app.on_event("shutdown")
+async def stop_batcher():
+    await batcher.stop()
 
 class EmbeddingRequest(BaseModel):
     texts: Union[str, List[str]]
 
 @app.post("/embed")
-async def get_embeddings(request: EmbeddingRequest):
+async def get_embeddings(request: EmbeddingRequest, http_request: Request):
     try:
-        if isinstance(request.texts, str):
-            embeddings = model_cache.encode([request.texts])
-            return {"embeddings": embeddings.tolist()}
-        else:
-            embeddings = model_cache.encode(request.texts)
+        texts = [request.texts] if isinstance(request.texts, str) else request.texts
+        embeddings = await batcher.encode(texts)
+
+        # Binary formats are negotiated through Accept; JSON is the fallback
+        media_type = embedding_wire.negotiate(http_request.headers.get("accept"))
+        if media_type == embedding_wire.JSON:
             return {"embeddings": embeddings.tolist()}
+        body, headers = embedding_wire.encode(embeddings, media_type)
+        return Response(content=body, media_type=media_type, headers=headers)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/cache/stats")
+async def cache_stats():
+    return {"embedding_cache": model_cache.cache_stats() if model_cache is not None else None}
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/ready")
+async def ready():
+    """Readiness: the model is loaded (by the warm-up, or by the first /embed)"""
+    if model_cache is None:
+        return Response('{"status": "loading"}', status_code=503, media_type="application/json")
+    return {"status": "ready", "warm_up_seconds": warm_up_seconds}
+
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
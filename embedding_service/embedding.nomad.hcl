@@ -21,6 +21,8 @@ job "embedding-service" {
 
       env {
         PYTHONUNBUFFERED = "1"
+        EMBEDDING_BACKEND = "onnx-int8"
+        EMBEDDING_THREADS = "1"
       }
 
       resources {
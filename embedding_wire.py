@@ -0,0 +1,76 @@
+"""
+Wire formats for `/embed` responses.
+
+Clients pick a format through the `Accept` header; JSON stays the fallback
+for clients that don't ask for anything else.
+
+- `application/x-float32`, `application/x-float16`: the raw little-endian
+  matrix, with its shape in the `X-Embedding-Shape` header ("rows,dims").
+- `application/msgpack`: `{"shape": [rows, dims], "dtype": "<f4", "data": <bytes>}`
+  (only offered when msgpack is installed).
+- `application/json`: `{"embeddings": [[...], ...]}`.
+"""
+import json
+from typing import Dict, Mapping, Optional, Tuple
+
+import numpy as np
+
+try:
+    import msgpack
+except ImportError:  # optional dependency
+    msgpack = None
+
+FLOAT32 = "application/x-float32"
+FLOAT16 = "application/x-float16"
+MSGPACK = "application/msgpack"
+JSON = "application/json"
+
+SHAPE_HEADER = "X-Embedding-Shape"
+
+_RAW_DTYPES = {FLOAT32: "<f4", FLOAT16: "<f2"}
+
+
+def negotiate(accept: Optional[str]) -> str:
+    """Pick the response media type for an `Accept` header value."""
+    for part in (accept or "").split(","):
+        media_type = part.split(";")[0].strip().lower()
+        if media_type in _RAW_DTYPES:
+            return media_type
+        if media_type == MSGPACK and msgpack is not None:
+            return MSGPACK
+    return JSON
+
+
+def encode(embeddings: np.ndarray, media_type: str) -> Tuple[bytes, Dict[str, str]]:
+    """Serialize a (rows, dims) matrix; returns the body and extra headers."""
+    embeddings = np.atleast_2d(embeddings)
+    shape = ",".join(str(n) for n in embeddings.shape)
+
+    if media_type in _RAW_DTYPES:
+        data = np.ascontiguousarray(embeddings, dtype=_RAW_DTYPES[media_type])
+        return data.tobytes(), {SHAPE_HEADER: shape}
+    if media_type == MSGPACK:
+        data = np.ascontiguousarray(embeddings, dtype="<f4")
+        return msgpack.packb({"shape": list(data.shape), "dtype": "<f4", "data": data.tobytes()}), {}
+    raise ValueError(f"Unsupported embedding media type: {media_type}")
+
+
+def decode(content: bytes, content_type: str, headers: Mapping[str, str]) -> np.ndarray:
+    """
+    Turn an `/embed` response body back into a (rows, dims) array.
+
+    Raw and msgpack bodies are wrapped without copying, so the returned
+    array is read-only.
+    """
+    media_type = (content_type or JSON).split(";")[0].strip().lower()
+
+    if media_type in _RAW_DTYPES:
+        rows, dims = (int(n) for n in headers[SHAPE_HEADER].split(","))
+        return np.frombuffer(content, dtype=_RAW_DTYPES[media_type]).reshape(rows, dims)
+    if media_type == MSGPACK:
+        if msgpack is None:
+            raise RuntimeError("msgpack response received but msgpack is not installed")
+        payload = msgpack.unpackb(content)
+        return np.frombuffer(payload["data"], dtype=payload["dtype"]).reshape(payload["shape"])
+
+    return np.asarray(json.loads(content)["embeddings"], dtype=np.float32)
@@ -1,77 +1,1468 @@
+import asyncio
 import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Sequence, Tuple
 
 from dotenv import load_dotenv
-from elasticsearch import Elasticsearch
 
-from embedding_client import EmbeddingClient
+from embedding_client import AsyncEmbeddingClient, EmbeddingClient
+from metrics import Histogram
+from query_cache import QueryCache
+from search_backend import (
+    RRF_RANK_WINDOW,
+    SearchBackend,
+    chunk_id,
+    close_backend,
+    content_hash,
+    decode_cursor,
+    encode_cursor,
+    get_backend,
+    project,
+    reciprocal_rank_fusion,
+    with_id_fields,
+)
 
-# Initialize the embedding client
-embedding_client = EmbeddingClient("http://localhost:8001")
+if TYPE_CHECKING:
+    # The client library takes about half a second to import; it is only
+    # loaded once an Elasticsearch backend is created
+    from elasticsearch import AsyncElasticsearch, Elasticsearch
 
 load_dotenv()
+EMBEDDING_SERVICE_URL = os.getenv("EMBEDDING_SERVICE_URL", "http://localhost:8001")
+EMBEDDING_TIMEOUT = float(os.getenv("EMBEDDING_TIMEOUT", 10))
 ES_HOST = os.getenv("ES_HOST", "http://localhost:9200")
-try:
-    es = Elasticsearch(ES_HOST)
-    if not es.ping():
-        raise ValueError(f"Connection to Elasticsearch at {ES_HOST} failed.")
-except Exception as e:
-    raise RuntimeError(f"Error connecting to Elasticsearch: {e}")
+ES_TIMEOUT = float(os.getenv("ES_TIMEOUT", 10))
+
+# Embedding clients, created on first use by get_embedding_client()/get_async_embedding_client()
+embedding_client: Optional[EmbeddingClient] = None
+async_embedding_client: Optional[AsyncEmbeddingClient] = None
+
+# Query vectors and search results, invalidated on every index write
+query_cache = QueryCache()
+
+# Aliases of the live index generation: each generation is a set of physical
+# indices named "<alias>-<generation>" (see ElasticsearchBackend.create_generation)
 INDEX_NAME = "code_chunks"
+# Tracks the last indexed commit of each repo, keyed by repo name
+STATE_INDEX_NAME = f"{INDEX_NAME}_state"
+# One vector per distinct chunk content, keyed by `content_hash` (dedup storage)
+VECTOR_INDEX_NAME = f"{INDEX_NAME}_vectors"
+# Generations kept after a swap besides the live one, for rolling back and
+# for paging cursors still reading them
+INDEX_GENERATIONS_KEPT = int(os.getenv("ES_INDEX_GENERATIONS_KEPT", 1))
+# Request timeout of reindexing, force-merging and waiting for replicas
+ES_MAINTENANCE_TIMEOUT = float(os.getenv("ES_MAINTENANCE_TIMEOUT", 3600))
+# Index settings of a generation being loaded
+BULK_SETTINGS = {"refresh_interval": "-1", "number_of_replicas": 0}
+# Also apply BULK_SETTINGS to the live indices during full runs of `index_repo`;
+# searches then lose their replicas and miss new chunks until the run ends
+BULK_LOAD_LIVE = os.getenv("ES_BULK_LOAD_LIVE", "true").lower() in ("1", "true", "yes")
+# Overlapping `bulk_load`s per physical index, and the settings the outermost one
+# replaced (None: already tuned, by another process or at creation)
+_bulk_loads: Dict[str, int] = {}
+_bulk_saved: Dict[str, Optional[Dict]] = {}
+_bulk_lock = threading.Lock()
 
-def ensure_index():
-    if not es.indices.exists(index=INDEX_NAME):
-        es.indices.create(index=INDEX_NAME, body={ # type: ignore
-            "mappings": {
-                "properties": {
-                    "embedding": {"type": "dense_vector", "dims": 384},
-                    "code": {"type": "text"},
-                    "name": {"type": "keyword"},
-                    "type": {"type": "keyword"},
-                    "file_path": {"type": "keyword"},
-                    "repo": {"type": "keyword"},
-                    "start_line": {"type": "integer"},
-                    "end_line": {"type": "integer"},
-                }
+# Bulk requests are cut by size rather than document count, since chunk
+# sizes vary wildly between one-line helpers and large classes
+BULK_MAX_CHUNK_BYTES = int(os.getenv("ES_BULK_MAX_CHUNK_BYTES", 10 * 1024 * 1024))
+BULK_MAX_RETRIES = int(os.getenv("ES_BULK_MAX_RETRIES", 5))
+
+SEARCH_ENGINE_FLAVOR = os.getenv("SEARCH_ENGINE_FLAVOR", "elasticsearch")
+EMBEDDING_DIMS = 384
+# HNSW graph settings for the `embedding` field
+HNSW_M = int(os.getenv("HNSW_M", 16))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", 100))
+# Quantization of the vectors in the HNSW graph: "int8" (ES >= 8.12,
+# OpenSearch lucene engine >= 2.16), "int4" (ES >= 8.15) or "bit" (ES BBQ,
+# >= 8.18). On OpenSearch "int4" and "bit" are the faiss engine's on-disk
+# mode at 8x and 32x compression (>= 2.17). The raw float vectors stay on
+# disk either way, which is what rescoring reads.
+VECTOR_QUANTIZATIONS = ("none", "int8", "int4", "bit")
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "none")
+# Elasticsearch `index_options.type` of each quantization
+ES_HNSW_TYPES = {"none": "hnsw", "int8": "int8_hnsw", "int4": "int4_hnsw", "bit": "bbq_hnsw"}
+# OpenSearch on-disk `compression_level` of the binary quantizations
+OPENSEARCH_COMPRESSION_LEVELS = {"int4": "8x", "bit": "32x"}
+OPENSEARCH_KNN_ENGINE = os.getenv("OPENSEARCH_KNN_ENGINE", "lucene")
+# Re-rank k * oversample quantized candidates by their raw vectors (ES >= 8.18,
+# OpenSearch on-disk >= 2.17); 0 turns rescoring off
+VECTOR_RESCORE_OVERSAMPLE = float(os.getenv("VECTOR_RESCORE_OVERSAMPLE", 0))
+# kNN candidates gathered per shard, as a multiple of k
+KNN_NUM_CANDIDATES_FACTOR = int(os.getenv("KNN_NUM_CANDIDATES_FACTOR", 10))
+
+# Fields that can be used as search pre-filters
+FILTER_FIELDS = ("repo", "type", "file_path", "parent_id")
+
+# "inline": every chunk document holds its embedding. "dedup": chunk
+# documents hold a `content_hash` instead, and VECTOR_INDEX_NAME holds one
+# vector per distinct content, so code repeated across forks, vendored
+# libraries and generated files is stored and graphed once
+VECTOR_STORAGES = ("inline", "dedup")
+VECTOR_STORAGE = os.getenv("VECTOR_STORAGE", "inline")
+# Dedup storage: distinct contents gathered by kNN per requested hit
+DEDUP_CANDIDATES_FACTOR = int(os.getenv("DEDUP_CANDIDATES_FACTOR", 4))
+# Dedup storage: filters matching chunks of at most this many distinct
+# contents are applied exactly inside the kNN search; broader filters are
+# applied to the candidates it returns
+DEDUP_PREFILTER_MAX_CONTENTS = int(os.getenv("DEDUP_PREFILTER_MAX_CONTENTS", 10_000))
+
+# "vector" (kNN on `embedding`), "lexical" (BM25 on `code`/`name`, no
+# embedding call) or "hybrid" (both, fused with reciprocal rank fusion)
+SEARCH_MODES = ("vector", "lexical", "hybrid")
+SEARCH_MODE = os.getenv("SEARCH_MODE", "vector")
+HYBRID_LEXICAL_WEIGHT = float(os.getenv("HYBRID_LEXICAL_WEIGHT", 1.0))
+HYBRID_VECTOR_WEIGHT = float(os.getenv("HYBRID_VECTOR_WEIGHT", 1.0))
+# Boost of an exact `name` match over matches in `code`
+LEXICAL_NAME_BOOST = float(os.getenv("LEXICAL_NAME_BOOST", 3.0))
+
+# How long a point in time used for paging stays open between pages
+PIT_KEEP_ALIVE = os.getenv("ES_PIT_KEEP_ALIVE", "2m")
+# Upper bound of `k` (and `num_candidates`) in a kNN search
+MAX_KNN_K = 10_000
+
+search_seconds = Histogram(
+    "search_seconds", "search_by_text calls, by mode and whether the hits came from the query cache", ["mode", "cache"]
+)
+search_stage_seconds = Histogram(
+    "search_stage_seconds", "Query embedding and backend search within search_by_text", ["stage", "mode"]
+)
+
+def embedding_mapping(search_engine_flavor: str = SEARCH_ENGINE_FLAVOR) -> Tuple[Dict, Dict]:
+    """The HNSW-indexed `embedding` field and the index settings it needs."""
+    if VECTOR_QUANTIZATION not in VECTOR_QUANTIZATIONS:
+        raise ValueError(
+            f"Unknown VECTOR_QUANTIZATION {VECTOR_QUANTIZATION!r}; expected one of {', '.join(VECTOR_QUANTIZATIONS)}"
+        )
+
+    if search_engine_flavor == "opensearch":
+        parameters = {"m": HNSW_M, "ef_construction": HNSW_EF_CONSTRUCTION}
+        field = {"type": "knn_vector", "dimension": EMBEDDING_DIMS}
+        engine = OPENSEARCH_KNN_ENGINE
+        if VECTOR_QUANTIZATION in OPENSEARCH_COMPRESSION_LEVELS:
+            # Binary quantization only exists in the faiss engine's on-disk mode
+            engine = "faiss"
+            field["mode"] = "on_disk"
+            field["compression_level"] = OPENSEARCH_COMPRESSION_LEVELS[VECTOR_QUANTIZATION]
+        elif VECTOR_QUANTIZATION == "int8" and engine == "lucene":
+            parameters["encoder"] = {"name": "sq"}
+        field["method"] = {
+            "name": "hnsw",
+            "space_type": "cosinesimil",
+            "engine": engine,
+            "parameters": parameters,
+        }
+        return field, {"index": {"knn": True}}
+
+    field = {
+        "type": "dense_vector",
+        "dims": EMBEDDING_DIMS,
+        "index": True,
+        "similarity": "cosine",
+        "index_options": {
+            "type": ES_HNSW_TYPES[VECTOR_QUANTIZATION],
+            "m": HNSW_M,
+            "ef_construction": HNSW_EF_CONSTRUCTION,
+        },
+    }
+    return field, {}
+
+def index_body(search_engine_flavor: str = SEARCH_ENGINE_FLAVOR, storage: str = VECTOR_STORAGE) -> Dict:
+    """
+    Settings and mappings for a new chunk index: with an HNSW-indexed
+    `embedding` for inline storage, without one for dedup storage.
+    """
+    properties = {
+        "code": {"type": "text"},
+        "name": {"type": "keyword"},
+        "type": {"type": "keyword"},
+        "file_path": {"type": "keyword"},
+        "repo": {"type": "keyword"},
+        "start_line": {"type": "integer"},
+        "end_line": {"type": "integer"},
+        # Enclosing class, or first window of a split definition (see processor.extract_chunks_from_source)
+        "parent_id": {"type": "keyword"},
+        # Git blob SHA of the file the chunk came from, for change detection
+        "blob_sha": {"type": "keyword"},
+        # Compressed AST JSON (see processor.compress_ast), stored but not indexed
+        "ast": {"type": "binary"},
+        # search_backend.content_hash of `code`; the key of the chunk's vector in dedup storage
+        "content_hash": {"type": "keyword"},
+    }
+    body: Dict = {"mappings": {"properties": properties}}
+    if storage == "inline":
+        properties["embedding"], settings = embedding_mapping(search_engine_flavor)
+        if settings:
+            body["settings"] = settings
+    return body
+
+def vector_index_body(search_engine_flavor: str = SEARCH_ENGINE_FLAVOR) -> Dict:
+    """Settings and mappings for VECTOR_INDEX_NAME (dedup storage)."""
+    embedding, settings = embedding_mapping(search_engine_flavor)
+    body: Dict = {"mappings": {"properties": {"content_hash": {"type": "keyword"}, "embedding": embedding}}}
+    if settings:
+        body["settings"] = settings
+    return body
+
+def state_index_body() -> Dict:
+    """Settings and mappings for STATE_INDEX_NAME."""
+    return {
+        "mappings": {
+            "properties": {
+                "repo": {"type": "keyword"},
+                "commit": {"type": "keyword"},
+                "indexed_at": {"type": "date"},
             }
-        })
+        }
+    }
 
-def index_chunks(chunks: list):
-    for chunk in chunks:
-        es.index(index=INDEX_NAME, document=chunk)
+def vector_memory_estimates(chunks: int, contents: int, dims: int = EMBEDDING_DIMS) -> Dict[str, float]:
+    """
+    Estimated HNSW working set in bytes per chunk, for each "storage/quantization"
+    layout: one quantized vector plus ~2 * HNSW_M neighbour IDs on the
+    graph's bottom layer, per chunk (inline) or per distinct content (dedup).
+    The raw float vectors kept on disk are not part of it.
+    """
+    vector_bytes = {"none": dims * 4, "int8": dims + 4, "int4": dims / 2 + 4, "bit": dims / 8 + 16}
+    graph_bytes = 2 * HNSW_M * 4
+    estimates = {}
+    for storage in VECTOR_STORAGES:
+        vectors = chunks if storage == "inline" else contents
+        for quantization, size in vector_bytes.items():
+            estimates[f"{storage}/{quantization}"] = vectors * (size + graph_bytes) / chunks if chunks else 0.0
+    return estimates
 
-def dsl_query(query_vector: str, top_k: int = 5, search_engine_flavor: str = "elasticsearch"):
+def _serializable(chunk: Dict) -> Dict:
+    """
+    Turn a float32 `embedding` row into a list as the bulk request is
+    built: the client's own NumPy support breaks on NumPy 2.
+    """
+    embedding = chunk.get("embedding")
+    if hasattr(embedding, "tolist"):
+        chunk["embedding"] = embedding.tolist()
+    return chunk
+
+def _filter_clauses(filters: Optional[Dict]) -> List[Dict]:
+    """Turn {"repo": "x", "type": ["ClassDef", ...]} into term/terms clauses."""
+    clauses = []
+    for field, value in (filters or {}).items():
+        if field not in FILTER_FIELDS:
+            raise ValueError(f"Unsupported filter field: {field}")
+        if value is None:
+            continue
+        if isinstance(value, (list, tuple, set)):
+            clauses.append({"terms": {field: list(value)}})
+        else:
+            clauses.append({"term": {field: value}})
+    return clauses
+
+# Large fields only returned when asked for by name
+HEAVY_FIELDS = ["embedding", "ast"]
+
+def source_filter(fields: Optional[Sequence[str]] = None) -> Dict:
+    """`_source` filter returning `fields`, or everything but HEAVY_FIELDS."""
+    if fields is None:
+        return {"excludes": HEAVY_FIELDS}
+    return {"includes": list(fields)}
+
+def dsl_query(
+    query_vector: List[float],
+    top_k: int = 5,
+    search_engine_flavor: str = "elasticsearch",
+    filters: Optional[Dict] = None,
+    fields: Optional[Sequence[str]] = None,
+):
+    """
+    Approximate kNN search body. Filters are applied inside the kNN search
+    (pre-filtering), so a filtered query still returns `top_k` hits.
+    """
+    body = _knn_body(query_vector, top_k, search_engine_flavor, _filter_clauses(filters))
+    body["_source"] = source_filter(fields)
+    return body
+
+def _knn_body(query_vector: List[float], top_k: int, search_engine_flavor: str, filter_clauses: List[Dict]) -> Dict:
+    rescore = VECTOR_RESCORE_OVERSAMPLE if VECTOR_QUANTIZATION != "none" else 0
     if search_engine_flavor == "elasticsearch":
-        body = {
-            "size": top_k,
-            "query": {
-                "script_score": {
-                    "query": {"match_all": {}},
-                    "script": {
-                        "source": "cosineSimilarity(params.query_vector, 'embedding') + 1.0",
-                        "params": {"query_vector": query_vector}
-                    }
-                }
-            }
+        knn = {
+            "field": "embedding",
+            "query_vector": query_vector,
+            "k": top_k,
+            "num_candidates": min(max(top_k * KNN_NUM_CANDIDATES_FACTOR, 100), MAX_KNN_K),
         }
+        if filter_clauses:
+            knn["filter"] = filter_clauses
+        if rescore:
+            knn["rescore_vector"] = {"oversample": rescore}
+        return {"size": top_k, "knn": knn}
     elif search_engine_flavor == "opensearch":
-        body = {
+        knn = {"vector": query_vector, "k": top_k}
+        if filter_clauses:
+            knn["filter"] = {"bool": {"filter": filter_clauses}}
+        if rescore:
+            knn["rescore"] = {"oversample_factor": rescore}
+        return {
             "query": {
                 "knn": {
-                    "embedding": {
-                        "vector": query_vector,
-                        "k": top_k,
-                    }
+                    "embedding": knn
                 }
             },
             "size": top_k
         }
+    else:
+        raise ValueError(f"Unsupported search engine flavor: {search_engine_flavor}")
 
-    return body
+def lexical_query(
+    query: str,
+    top_k: int = 5,
+    filters: Optional[Dict] = None,
+    fields: Optional[Sequence[str]] = None,
+) -> Dict:
+    """
+    BM25 search body: full-text `match` on `code`, plus a boosted exact
+    `term` on `name` so identifier queries like `ensure_index` rank the
+    definition first.
+    """
+    return {
+        "size": top_k,
+        "_source": source_filter(fields),
+        "query": {
+            "bool": {
+                "should": [
+                    {"match": {"code": query}},
+                    {"term": {"name": {"value": query.strip(), "boost": LEXICAL_NAME_BOOST}}},
+                ],
+                "minimum_should_match": 1,
+                "filter": _filter_clauses(filters),
+            }
+        },
+    }
+
+
+class ElasticsearchBackend(SearchBackend):
+    """
+    Chunks stored in an Elasticsearch (or OpenSearch) index, with their
+    vectors inline or, with `storage="dedup"`, one per distinct content in
+    VECTOR_INDEX_NAME.
+
+    Reads and writes go through the aliases of the live generation, or with
+    `generation` straight to that generation's physical indices (a build
+    that is not live yet).
+    """
+
+    def __init__(
+        self,
+        search_engine_flavor: str = SEARCH_ENGINE_FLAVOR,
+        es: Optional["Elasticsearch"] = None,
+        async_es: Optional["AsyncElasticsearch"] = None,
+        storage: str = VECTOR_STORAGE,
+        generation: Optional[str] = None,
+    ):
+        """
+        `es`/`async_es` replace the clients for ES_HOST (e.g. in benchmarks).
+        Nothing is sent to the cluster until the first request; use `ping`
+        or `aping` to check that it is reachable.
+        """
+        from elasticsearch import AsyncElasticsearch, Elasticsearch
+
+        if storage not in VECTOR_STORAGES:
+            raise ValueError(f"Unknown VECTOR_STORAGE {storage!r}; expected one of {', '.join(VECTOR_STORAGES)}")
+        self.search_engine_flavor = search_engine_flavor
+        self.dedup = storage == "dedup"
+        self.generation = generation
+        suffix = f"-{generation}" if generation else ""
+        self.index_name = INDEX_NAME + suffix
+        self.state_index_name = STATE_INDEX_NAME + suffix
+        self.vector_index_name = VECTOR_INDEX_NAME + suffix
+        self.es = es or Elasticsearch(ES_HOST, request_timeout=ES_TIMEOUT)
+        # Used by the web server so searches don't block the event loop
+        self.async_es = async_es or AsyncElasticsearch(ES_HOST, request_timeout=ES_TIMEOUT)
+
+    def ping(self) -> bool:
+        return self.es.ping()
+
+    async def aping(self) -> bool:
+        return await self.async_es.ping()
+
+    def ensure_index(self):
+        """
+        Create the indices if there are none (a first generation behind the
+        aliases), add fields newer than the index, and refuse to go on if the
+        index holds vectors of another model or storage.
+        """
+        es = self.es
+        if self.generation is None and not es.indices.exists(index=INDEX_NAME):
+            self.swap_generation(self.create_generation(bulk=False))
+            return
+
+        meta = self.index_meta()
+        expected = self.generation_meta()
+        mismatched = [key for key in ("embedding_model", "embedding_dims", "vector_storage")
+                      if key in meta and meta[key] != expected[key]]
+        if mismatched:
+            found = ", ".join(f"{key}={meta[key]}" for key in mismatched)
+            wanted = ", ".join(f"{key}={expected[key]}" for key in mismatched)
+            raise ValueError(
+                f"{self.index_name} was built with {found}, not {wanted}; build a new generation with "
+                f"`python -m cli rebuild-index`"
+            )
+
+        # Indices created before these fields existed would otherwise map them dynamically
+        es.indices.put_mapping(index=self.index_name, properties={
+            "ast": {"type": "binary"},
+            "parent_id": {"type": "keyword"},
+            "blob_sha": {"type": "keyword"},
+            "content_hash": {"type": "keyword"},
+        })
+        if self.generation is None:
+            # Companions missing from an index from before `_meta`, e.g. the
+            # vectors after switching to dedup storage
+            live = self.live_generation()
+            for alias, _, body in self._indices():
+                if not es.indices.exists(index=alias):
+                    if live:
+                        es.indices.create(index=f"{alias}-{live}", body={**body, "aliases": {alias: {}}}) # type: ignore
+                    else:
+                        es.indices.create(index=alias, body=body) # type: ignore
+
+    def index_chunks(self, chunks: Iterable[Dict]) -> int:
+        """
+        Upsert chunks through the `_bulk` API.
+
+        Requests are split by byte size and rejected (429) documents are retried
+        with exponential backoff. Raises `helpers.BulkIndexError` if any document
+        still fails.
+
+        With dedup storage each chunk is written without its embedding, and
+        the embedding is created under the chunk's `content_hash` unless a
+        vector for that content is already stored.
+
+        Returns:
+            int: Number of chunks written
+        """
+        from elasticsearch import helpers
+
+        written, errors = 0, []
+        for ok, item in helpers.streaming_bulk(
+            self.es,
+            self._index_actions(chunks),
+            chunk_size=10_000,
+            max_chunk_bytes=BULK_MAX_CHUNK_BYTES,
+            max_retries=BULK_MAX_RETRIES,
+            initial_backoff=1,
+            max_backoff=30,
+            raise_on_error=False,
+        ):
+            (op_type, result), = item.items()
+            if ok:
+                written += op_type == "index"
+            elif not (op_type == "create" and result.get("status") == 409):
+                errors.append(item)
+        if errors:
+            raise helpers.BulkIndexError(f"{len(errors)} document(s) failed to index.", errors)
+        return written
+
+    def _index_actions(self, chunks: Iterable[Dict]) -> Iterable[Dict]:
+        stored = set()
+        for chunk in chunks:
+            chunk["content_hash"] = key = content_hash(chunk["code"])
+            if self.dedup:
+                source = {field: value for field, value in chunk.items() if field != "embedding"}
+            else:
+                source = _serializable(chunk)
+            yield {"_op_type": "index", "_index": self.index_name, "_id": chunk_id(chunk), "_source": source}
+            if self.dedup and key not in stored:
+                stored.add(key)
+                # A conflict (409) means the content is already stored
+                yield {
+                    "_op_type": "create",
+                    "_index": self.vector_index_name,
+                    "_id": key,
+                    "_source": _serializable({"content_hash": key, "embedding": chunk["embedding"]}),
+                }
+
+    @contextmanager
+    def bulk_load(self):
+        """
+        Tune this backend's indices for a large load: disable refresh and
+        drop replicas, then restore the settings and refresh once the last
+        of any overlapping loads is done, even if the load fails. Indices
+        found already tuned (by a load in another process, or created so by
+        `create_generation`) are left for their owner to restore. Loads into
+        the live indices (generation None) are only tuned with
+        ES_BULK_LOAD_LIVE.
+        """
+        if self.generation is None and not BULK_LOAD_LIVE:
+            yield
+            return
+
+        es = self.es
+        names = [self.index_name, self.vector_index_name] if self.dedup else [self.index_name]
+        if self.generation is None:
+            # Count loads by physical index, whichever alias or generation they came through
+            names = [physical for name in names for physical in es.indices.get(index=name)]
+        with _bulk_lock:
+            # Only the outermost load of an index saves its settings
+            first = [name for name in names if not _bulk_loads.get(name)]
+            if first:
+                for name, body in es.indices.get_settings(index=",".join(first)).items():
+                    saved = {key: body["settings"]["index"].get(key) for key in BULK_SETTINGS}
+                    # Saving another load's settings would leave them in place for good
+                    tuned = all(str(saved[key]) == str(value) for key, value in BULK_SETTINGS.items())
+                    _bulk_saved[name] = None if tuned else saved
+                es.indices.put_settings(index=",".join(first), settings={"index": BULK_SETTINGS})
+            for name in names:
+                _bulk_loads[name] = _bulk_loads.get(name, 0) + 1
+        try:
+            yield
+        finally:
+            with _bulk_lock:
+                last = []
+                for name in names:
+                    _bulk_loads[name] -= 1
+                    if not _bulk_loads[name]:
+                        del _bulk_loads[name]
+                        last.append(name)
+                # A None value resets the setting to the cluster default
+                for name in last:
+                    saved = _bulk_saved.pop(name)
+                    if saved is not None:
+                        es.indices.put_settings(index=name, settings={"index": saved})
+                es.indices.refresh(index=",".join(names))
+
+    def delete_file_chunks(self, repo_name: str, file_paths: Iterable[str], batch_size: int = 1000):
+        """Delete every chunk indexed for the given files of a repo."""
+        file_paths = list(file_paths)
+        for i in range(0, len(file_paths), batch_size):
+            self.es.delete_by_query(
+                index=self.index_name,
+                query={"bool": {"filter": [
+                    {"term": {"repo": repo_name}},
+                    {"terms": {"file_path": file_paths[i:i + batch_size]}},
+                ]}},
+                conflicts="proceed",
+                refresh=True,
+            )
+
+    def delete_repo_chunks(self, repo_name: str):
+        """Delete every chunk indexed for a repo."""
+        self.es.delete_by_query(
+            index=self.index_name,
+            query={"term": {"repo": repo_name}},
+            conflicts="proceed",
+            refresh=True,
+        )
+
+    def get_indexed_commit(self, repo_name: str) -> Optional[str]:
+        """Return the commit SHA the repo was last fully indexed at, if any."""
+        from elasticsearch import NotFoundError
+
+        try:
+            doc = self.es.get(index=self.state_index_name, id=repo_name)
+        except NotFoundError:
+            return None
+        return doc["_source"].get("commit")
+
+    def get_file_blobs(self, repo_name: str) -> Dict[str, Optional[str]]:
+        """
+        One composite aggregation over (file_path, blob_sha) instead of
+        reading every chunk; files indexed before `blob_sha` existed map to None.
+        """
+        sources = [
+            {"file_path": {"terms": {"field": "file_path"}}},
+            {"blob_sha": {"terms": {"field": "blob_sha", "missing_bucket": True}}},
+        ]
+        blobs: Dict[str, Optional[str]] = {}
+        after = None
+        while True:
+            composite = {"size": 10_000, "sources": sources}
+            if after is not None:
+                composite["after"] = after
+            results = self.es.search(
+                index=self.index_name,
+                size=0,
+                query={"term": {"repo": repo_name}},
+                aggs={"files": {"composite": composite}},
+            )
+            agg = results["aggregations"]["files"]
+            for bucket in agg["buckets"]:
+                key = bucket["key"]
+                # A file with chunks of two blobs (an interrupted run) counts as changed
+                blobs[key["file_path"]] = None if key["file_path"] in blobs else key["blob_sha"]
+            after = agg.get("after_key")
+            if not agg["buckets"] or after is None:
+                return blobs
+
+    def set_indexed_commit(self, repo_name: str, commit: str):
+        self.es.index(
+            index=self.state_index_name,
+            id=repo_name,
+            document={
+                "repo": repo_name,
+                "commit": commit,
+                "indexed_at": datetime.now(timezone.utc).isoformat(),
+            },
+            refresh=True,
+        )
+
+    @staticmethod
+    def _sources(results: Dict) -> List[Dict]:
+        return [hit["_source"] for hit in results["hits"]["hits"]]
+
+    def search(
+        self,
+        query_vector: List[float],
+        top_k: int = 5,
+        filters: Optional[Dict] = None,
+        fields: Optional[Sequence[str]] = None,
+    ) -> List[Dict]:
+        if self.dedup:
+            return self._dedup_search(query_vector, top_k, filters, fields)
+        body = dsl_query(query_vector, top_k, self.search_engine_flavor, filters, fields)
+        return self._sources(self.es.search(index=self.index_name, body=body)) # type: ignore
+
+    async def asearch(
+        self,
+        query_vector: List[float],
+        top_k: int = 5,
+        filters: Optional[Dict] = None,
+        fields: Optional[Sequence[str]] = None,
+    ) -> List[Dict]:
+        if self.dedup:
+            return await self._adedup_search(query_vector, top_k, filters, fields)
+        body = dsl_query(query_vector, top_k, self.search_engine_flavor, filters, fields)
+        return self._sources(await self.async_es.search(index=self.index_name, body=body)) # type: ignore
+
+    # Dedup storage: kNN runs over the distinct contents in VECTOR_INDEX_NAME,
+    # then the chunks of the best contents are fetched in content score order.
+    # Filters are on chunk fields, so a filtered search first looks up which
+    # contents have matching chunks and restricts the kNN search to those.
+
+    @staticmethod
+    def _prefilter_body(filters: Optional[Dict]) -> Optional[Dict]:
+        clauses = _filter_clauses(filters)
+        if not clauses:
+            return None
+        return {
+            "size": 0,
+            "query": {"bool": {"filter": clauses}},
+            "aggs": {"contents": {"terms": {"field": "content_hash", "size": DEDUP_PREFILTER_MAX_CONTENTS + 1}}},
+        }
+
+    def _dedup_knn_body(self, query_vector: List[float], top_k: int, prefilter: Optional[Dict]) -> Optional[Dict]:
+        """kNN body for the contents; None if no chunk matches the filters."""
+        clauses = []
+        if prefilter is not None:
+            buckets = prefilter["aggregations"]["contents"]["buckets"]
+            if not buckets:
+                return None
+            if len(buckets) <= DEDUP_PREFILTER_MAX_CONTENTS:
+                clauses = [{"terms": {"content_hash": [bucket["key"] for bucket in buckets]}}]
+        k = min(top_k * DEDUP_CANDIDATES_FACTOR, MAX_KNN_K)
+        body = _knn_body(query_vector, k, self.search_engine_flavor, clauses)
+        body["_source"] = False
+        return body
+
+    @staticmethod
+    def _join_body(
+        contents: Dict, top_k: int, filters: Optional[Dict], fields: Optional[Sequence[str]]
+    ) -> Optional[Dict]:
+        """The best `top_k` chunks of the kNN hits in `contents`, each scored as its content."""
+        scores = {hit["_id"]: hit["_score"] for hit in contents["hits"]["hits"]}
+        if not scores:
+            return None
+        clauses = [{"terms": {"content_hash": list(scores)}}, *_filter_clauses(filters)]
+        return {
+            "size": top_k,
+            "_source": source_filter(fields),
+            "query": {
+                "script_score": {
+                    "query": {"bool": {"filter": clauses}},
+                    "script": {"source": "params.scores[doc['content_hash'].value]", "params": {"scores": scores}},
+                }
+            },
+            "sort": [{"_score": "desc"}, {"repo": "asc"}, {"file_path": "asc"}, {"start_line": "asc"}],
+        }
+
+    def _dedup_search(
+        self, query_vector: List[float], top_k: int, filters: Optional[Dict], fields: Optional[Sequence[str]]
+    ) -> List[Dict]:
+        prefilter_body = self._prefilter_body(filters)
+        prefilter = None
+        if prefilter_body:
+            prefilter = self.es.search(index=self.index_name, body=prefilter_body) # type: ignore
+        knn_body = self._dedup_knn_body(query_vector, top_k, prefilter)
+        if knn_body is None:
+            return []
+        contents = self.es.search(index=self.vector_index_name, body=knn_body) # type: ignore
+        join_body = self._join_body(contents, top_k, filters, fields)
+        if join_body is None:
+            return []
+        return self._sources(self.es.search(index=self.index_name, body=join_body)) # type: ignore
+
+    async def _adedup_search(
+        self, query_vector: List[float], top_k: int, filters: Optional[Dict], fields: Optional[Sequence[str]]
+    ) -> List[Dict]:
+        prefilter_body = self._prefilter_body(filters)
+        prefilter = None
+        if prefilter_body:
+            prefilter = await self.async_es.search(index=self.index_name, body=prefilter_body) # type: ignore
+        knn_body = self._dedup_knn_body(query_vector, top_k, prefilter)
+        if knn_body is None:
+            return []
+        contents = await self.async_es.search(index=self.vector_index_name, body=knn_body) # type: ignore
+        join_body = self._join_body(contents, top_k, filters, fields)
+        if join_body is None:
+            return []
+        return self._sources(await self.async_es.search(index=self.index_name, body=join_body)) # type: ignore
+
+    def lexical_search(
+        self,
+        query: str,
+        top_k: int = 5,
+        filters: Optional[Dict] = None,
+        fields: Optional[Sequence[str]] = None,
+    ) -> List[Dict]:
+        body = lexical_query(query, top_k, filters, fields)
+        return self._sources(self.es.search(index=self.index_name, body=body)) # type: ignore
+
+    async def alexical_search(
+        self,
+        query: str,
+        top_k: int = 5,
+        filters: Optional[Dict] = None,
+        fields: Optional[Sequence[str]] = None,
+    ) -> List[Dict]:
+        body = lexical_query(query, top_k, filters, fields)
+        return self._sources(await self.async_es.search(index=self.index_name, body=body)) # type: ignore
+
+    def _hybrid_bodies(
+        self,
+        query: str,
+        query_vector: List[float],
+        window: int,
+        filters: Optional[Dict],
+        fields: Optional[Sequence[str]],
+    ) -> List[Dict]:
+        """The lexical and the kNN search body; fusing needs the `chunk_id` fields."""
+        id_fields = with_id_fields(fields)
+        return [
+            lexical_query(query, window, filters, id_fields),
+            dsl_query(query_vector, window, self.search_engine_flavor, filters, id_fields),
+        ]
+
+    @staticmethod
+    def _msearch_body(bodies: List[Dict], index: Optional[str]) -> List[Dict]:
+        header = {"index": index} if index else {}
+        return [part for body in bodies for part in (header, body)]
+
+    @staticmethod
+    def _rankings(responses: Dict) -> List[List[Dict]]:
+        rankings = []
+        for response in responses["responses"]:
+            if "error" in response:
+                raise RuntimeError(f"Search failed: {response['error']}")
+            rankings.append([hit["_source"] for hit in response["hits"]["hits"]])
+        return rankings
+
+    def hybrid_search(
+        self,
+        query: str,
+        query_vector: List[float],
+        top_k: int = 5,
+        filters: Optional[Dict] = None,
+        weights: Tuple[float, float] = (1.0, 1.0),
+        fields: Optional[Sequence[str]] = None,
+    ) -> List[Dict]:
+        """
+        BM25 and kNN in one `_msearch` round trip, fused client-side. (The
+        server-side `rrf` retriever needs a licensed ES >= 8.14 and doesn't
+        exist on OpenSearch.) With dedup storage the kNN side takes requests
+        of its own, so the two searches are sent separately.
+        """
+        if self.dedup:
+            return super().hybrid_search(query, query_vector, top_k, filters, weights, fields)
+        bodies = self._hybrid_bodies(query, query_vector, max(top_k, RRF_RANK_WINDOW), filters, fields)
+        responses = self.es.msearch(searches=self._msearch_body(bodies, self.index_name))
+        return project(reciprocal_rank_fusion(self._rankings(responses), weights, top_k), fields)
+
+    async def ahybrid_search(
+        self,
+        query: str,
+        query_vector: List[float],
+        top_k: int = 5,
+        filters: Optional[Dict] = None,
+        weights: Tuple[float, float] = (1.0, 1.0),
+        fields: Optional[Sequence[str]] = None,
+    ) -> List[Dict]:
+        if self.dedup:
+            window = max(top_k, RRF_RANK_WINDOW)
+            id_fields = with_id_fields(fields)
+            rankings = await asyncio.gather(
+                self.alexical_search(query, window, filters, id_fields),
+                self.asearch(query_vector, window, filters, id_fields),
+            )
+            return project(reciprocal_rank_fusion(rankings, weights, top_k), fields)
+        bodies = self._hybrid_bodies(query, query_vector, max(top_k, RRF_RANK_WINDOW), filters, fields)
+        responses = await self.async_es.msearch(searches=self._msearch_body(bodies, self.index_name))
+        return project(reciprocal_rank_fusion(self._rankings(responses), weights, top_k), fields)
+
+    # Browsing in chunk order. The sort keys are the `chunk_id` fields, so
+    # they are unique and `search_after` resumes exactly without a PIT.
+
+    @staticmethod
+    def _browse_body(page_size: int, state: Dict, filters: Optional[Dict], fields: Optional[Sequence[str]]) -> Dict:
+        body = {
+            "size": page_size,
+            "_source": source_filter(fields),
+            "query": {"bool": {"filter": _filter_clauses(filters)}},
+            "sort": [{"repo": "asc"}, {"file_path": "asc"}, {"start_line": "asc"}, {"name": "asc"}],
+            "track_total_hits": False,
+        }
+        if state.get("after"):
+            body["search_after"] = state["after"]
+        return body
+
+    @staticmethod
+    def _browse_result(results: Dict, page_size: int) -> Tuple[List[Dict], Optional[str]]:
+        hits = results["hits"]["hits"]
+        next_state = {"after": hits[-1]["sort"]} if len(hits) == page_size else None
+        return [hit["_source"] for hit in hits], encode_cursor(next_state)
+
+    def browse(
+        self,
+        page_size: int = 100,
+        cursor: Optional[str] = None,
+        filters: Optional[Dict] = None,
+        fields: Optional[Sequence[str]] = None,
+    ) -> Tuple[List[Dict], Optional[str]]:
+        body = self._browse_body(page_size, decode_cursor(cursor), filters, fields)
+        return self._browse_result(self.es.search(index=self.index_name, body=body), page_size) # type: ignore
+
+    async def abrowse(
+        self,
+        page_size: int = 100,
+        cursor: Optional[str] = None,
+        filters: Optional[Dict] = None,
+        fields: Optional[Sequence[str]] = None,
+    ) -> Tuple[List[Dict], Optional[str]]:
+        body = self._browse_body(page_size, decode_cursor(cursor), filters, fields)
+        results = await self.async_es.search(index=self.index_name, body=body) # type: ignore
+        return self._browse_result(results, page_size)
+
+    # Paging. Every page of a cursor searches the same point in time (PIT),
+    # so concurrent writes can't shift hits between pages. Lexical pages
+    # resume with `search_after`; kNN has no `search_after`, so vector and
+    # hybrid pages widen `k` and skip the hits already returned.
+
+    def _page_bodies(
+        self,
+        mode: str,
+        query: str,
+        query_vector: Optional[List[float]],
+        page_size: int,
+        state: Dict,
+        filters: Optional[Dict],
+        fields: Optional[Sequence[str]],
+    ) -> List[Dict]:
+        offset = state.get("offset", 0)
+        if mode == "lexical":
+            body = lexical_query(query, page_size, filters, fields)
+            body["sort"] = [{"_score": "desc"}, {"_shard_doc": "asc"}]
+            body["track_total_hits"] = False
+            if state.get("after"):
+                body["search_after"] = state["after"]
+            bodies = [body]
+        elif mode == "vector":
+            body = dsl_query(query_vector, min(offset + page_size, MAX_KNN_K), self.search_engine_flavor, filters, fields)
+            body["from"] = offset
+            body["size"] = page_size
+            bodies = [body]
+        elif mode == "hybrid":
+            window = min(max(offset + page_size, RRF_RANK_WINDOW), MAX_KNN_K)
+            bodies = self._hybrid_bodies(query, query_vector, window, filters, fields)
+        else:
+            raise ValueError(f"Unsupported search mode: {mode}")
+
+        for body in bodies:
+            body["pit"] = {"id": state["pit"], "keep_alive": PIT_KEEP_ALIVE}
+        return bodies
+
+    def _page_result(
+        self,
+        mode: str,
+        responses: Dict,
+        page_size: int,
+        state: Dict,
+        weights: Tuple[float, float],
+        fields: Optional[Sequence[str]],
+    ) -> Tuple[List[Dict], Optional[Dict]]:
+        """The page's hits and the next cursor state (None on the last page)."""
+        offset = state.get("offset", 0)
+        next_state = {"pit": responses["responses"][0].get("pit_id", state["pit"]), "offset": offset}
+        if mode == "hybrid":
+            fused = reciprocal_rank_fusion(self._rankings(responses), weights, offset + page_size)
+            page = project(fused[offset:], fields)
+        else:
+            page = self._rankings(responses)[0]
+            if mode == "lexical" and page:
+                next_state["after"] = responses["responses"][0]["hits"]["hits"][-1]["sort"]
+        next_state["offset"] = offset + len(page)
+
+        if len(page) < page_size or (mode != "lexical" and next_state["offset"] >= MAX_KNN_K):
+            return page, None
+        return page, next_state
+
+    def search_page(
+        self,
+        mode: str,
+        query: str,
+        query_vector: Optional[List[float]],
+        page_size: int = 10,
+        cursor: Optional[str] = None,
+        filters: Optional[Dict] = None,
+        weights: Tuple[float, float] = (1.0, 1.0),
+        fields: Optional[Sequence[str]] = None,
+    ) -> Tuple[List[Dict], Optional[str]]:
+        if self.search_engine_flavor != "elasticsearch" or self.dedup:
+            # OpenSearch's PIT API differs, and dedup kNN spans two indices;
+            # fall back to re-running the search
+            return super().search_page(mode, query, query_vector, page_size, cursor, filters, weights, fields)
+
+        state = decode_cursor(cursor)
+        if "pit" not in state:
+            state["pit"] = self.es.open_point_in_time(index=self.index_name, keep_alive=PIT_KEEP_ALIVE)["id"]
+        bodies = self._page_bodies(mode, query, query_vector, page_size, state, filters, fields)
+        responses = self.es.msearch(searches=self._msearch_body(bodies, index=None))
+        page, next_state = self._page_result(mode, responses, page_size, state, weights, fields)
+        if next_state is None:
+            self.es.close_point_in_time(id=state["pit"])
+        return page, encode_cursor(next_state)
+
+    async def asearch_page(
+        self,
+        mode: str,
+        query: str,
+        query_vector: Optional[List[float]],
+        page_size: int = 10,
+        cursor: Optional[str] = None,
+        filters: Optional[Dict] = None,
+        weights: Tuple[float, float] = (1.0, 1.0),
+        fields: Optional[Sequence[str]] = None,
+    ) -> Tuple[List[Dict], Optional[str]]:
+        if self.search_engine_flavor != "elasticsearch" or self.dedup:
+            return await super().asearch_page(mode, query, query_vector, page_size, cursor, filters, weights, fields)
+
+        state = decode_cursor(cursor)
+        if "pit" not in state:
+            pit = await self.async_es.open_point_in_time(index=self.index_name, keep_alive=PIT_KEEP_ALIVE)
+            state["pit"] = pit["id"]
+        bodies = self._page_bodies(mode, query, query_vector, page_size, state, filters, fields)
+        responses = await self.async_es.msearch(searches=self._msearch_body(bodies, index=None))
+        page, next_state = self._page_result(mode, responses, page_size, state, weights, fields)
+        if next_state is None:
+            await self.async_es.close_point_in_time(id=state["pit"])
+        return page, encode_cursor(next_state)
+
+    async def aclose(self):
+        await self.async_es.close()
+
+    def storage_report(self) -> Dict:
+        """
+        Chunks, distinct contents (approximate, counted over chunks that have
+        a `content_hash`), primary store bytes per chunk of each index, and
+        `vector_memory_estimates` for every layout.
+        """
+        es = self.es
+        indices = [self.index_name, self.vector_index_name] if self.dedup else [self.index_name]
+        chunks = es.count(index=self.index_name)["count"]
+        results = es.search(
+            index=self.index_name,
+            size=0,
+            aggs={"contents": {"cardinality": {"field": "content_hash", "precision_threshold": 40_000}}},
+        )
+        contents = results["aggregations"]["contents"]["value"]
+        stats = es.indices.stats(index=",".join(indices), metric="docs,store")["indices"]
+        parts = {name: index["primaries"]["store"]["size_in_bytes"] for name, index in stats.items()}
+        total = sum(parts.values())
+        return {
+            "chunks": chunks,
+            "contents": contents,
+            "bytes": total,
+            "bytes_per_chunk": total / chunks if chunks else 0.0,
+            "parts": {name: size / chunks if chunks else 0.0 for name, size in parts.items()},
+            "layout": f"{'dedup' if self.dedup else 'inline'}/{VECTOR_QUANTIZATION}",
+            "memory_per_chunk": vector_memory_estimates(chunks, contents),
+        }
+
+    def prune_vectors(self, batch_size: int = 1000) -> int:
+        """
+        Delete the stored vectors of contents no chunk refers to any more
+        (dedup storage). Deleting chunks leaves their vectors behind, since
+        chunks of other files or repos may share them. Pause indexing while
+        this runs: a content written concurrently may lose its vector.
+
+        Returns:
+            int: Number of vectors deleted
+        """
+        from elasticsearch import helpers
+
+        es = self.es
+        pruned = 0
+        after = None
+        while True:
+            body = {"size": batch_size, "_source": False, "sort": [{"content_hash": "asc"}], "track_total_hits": False}
+            if after is not None:
+                body["search_after"] = after
+            hits = es.search(index=self.vector_index_name, body=body)["hits"]["hits"] # type: ignore
+            if not hits:
+                return pruned
+            keys = [hit["_id"] for hit in hits]
+            results = es.search(
+                index=self.index_name,
+                size=0,
+                query={"terms": {"content_hash": keys}},
+                aggs={"contents": {"terms": {"field": "content_hash", "size": len(keys)}}},
+            )
+            used = {bucket["key"] for bucket in results["aggregations"]["contents"]["buckets"]}
+            orphans = [key for key in keys if key not in used]
+            if orphans:
+                deletes = ({"_op_type": "delete", "_index": self.vector_index_name, "_id": key} for key in orphans)
+                helpers.bulk(es, deletes)
+                pruned += len(orphans)
+            after = hits[-1]["sort"]
+
+    # Generations. A build of the index is a set of physical indices named
+    # "<alias>-<generation>". Readers and incremental writers only use the
+    # aliases; a new generation is built next to the live one and becomes
+    # live when `swap_generation` moves every alias in one atomic request.
+
+    def _indices(self) -> List[Tuple[str, str, Dict]]:
+        """(alias, name, body) of each index of this backend's generation."""
+        storage = "dedup" if self.dedup else "inline"
+        indices = [
+            (INDEX_NAME, self.index_name, index_body(self.search_engine_flavor, storage)),
+            (STATE_INDEX_NAME, self.state_index_name, state_index_body()),
+        ]
+        if self.dedup:
+            indices.append((VECTOR_INDEX_NAME, self.vector_index_name, vector_index_body(self.search_engine_flavor)))
+        return indices
+
+    def generation_meta(self) -> Dict:
+        """What the vectors of a generation built now are: stored in the chunk index's `_meta`."""
+        from embedding_model import MODEL_NAME
+
+        return {
+            "embedding_model": MODEL_NAME,
+            "embedding_dims": EMBEDDING_DIMS,
+            "vector_storage": "dedup" if self.dedup else "inline",
+            "vector_quantization": VECTOR_QUANTIZATION,
+        }
+
+    def index_meta(self) -> Dict:
+        """`_meta` of the chunk index; empty for an index from before generations."""
+        (body,) = self.es.indices.get_mapping(index=self.index_name).values()
+        return body["mappings"].get("_meta", {})
+
+    def live_generation(self) -> Optional[str]:
+        """The generation the aliases point at; None for a concrete index from before generations."""
+        if not self.es.indices.exists_alias(name=INDEX_NAME):
+            return None
+        (name,) = self.es.indices.get_alias(name=INDEX_NAME)
+        return name[len(INDEX_NAME) + 1:]
+
+    def generations(self) -> List[Dict]:
+        """Every generation, newest first, with its `_meta` and whether it is live."""
+        live = self.live_generation()
+        generations = [
+            {
+                "generation": name[len(INDEX_NAME) + 1:],
+                "created": int(body["settings"]["index"]["creation_date"]),
+                "live": name[len(INDEX_NAME) + 1:] == live,
+                "meta": body["mappings"].get("_meta", {}),
+            }
+            for name, body in self.es.indices.get(index=f"{INDEX_NAME}-*").items()
+        ]
+        return sorted(generations, key=lambda generation: generation["created"], reverse=True)
+
+    def create_generation(self, bulk: bool = True) -> "ElasticsearchBackend":
+        """
+        Create the empty indices of a new generation, with the current
+        mapping and `generation_meta`, and return a backend writing to them.
+        With `bulk` they start without refresh and replicas, until
+        `publish_generation`.
+        """
+        # Sortable by time; the random suffix keeps builds started in the same instant apart
+        generation = f"{datetime.now(timezone.utc):%Y%m%d%H%M%S%f}-{uuid.uuid4().hex[:8]}"
+        storage = "dedup" if self.dedup else "inline"
+        builder = ElasticsearchBackend(self.search_engine_flavor, self.es, self.async_es, storage, generation)
+        for alias, name, body in builder._indices():
+            if alias == INDEX_NAME:
+                body["mappings"]["_meta"] = {
+                    **builder.generation_meta(),
+                    "generation": generation,
+                    "created_at": datetime.now(timezone.utc).isoformat(),
+                }
+            if bulk:
+                body.setdefault("settings", {}).setdefault("index", {}).update(BULK_SETTINGS)
+            self.es.indices.create(index=name, body=body) # type: ignore
+        return builder
+
+    def swap_generation(self, builder: "ElasticsearchBackend") -> Optional[str]:
+        """
+        Point every alias at `builder`'s generation in one request, so
+        readers switch from one complete generation to the other. Returns
+        the generation that was live before.
+        """
+        es = self.es
+        previous = self.live_generation()
+        actions = []
+        for alias in (INDEX_NAME, STATE_INDEX_NAME, VECTOR_INDEX_NAME):
+            if es.indices.exists_alias(name=alias):
+                actions.extend({"remove": {"index": name, "alias": alias}} for name in es.indices.get_alias(name=alias))
+            elif es.indices.exists(index=alias):
+                # A concrete index from before generations; removing it frees its name for the alias
+                actions.append({"remove_index": {"index": alias}})
+            if alias != VECTOR_INDEX_NAME or builder.dedup:
+                actions.append({"add": {"index": f"{alias}-{builder.generation}", "alias": alias}})
+        es.indices.update_aliases(actions=actions)
+        return previous
+
+    def publish_generation(self, builder: "ElasticsearchBackend", keep: int = INDEX_GENERATIONS_KEPT) -> List[str]:
+        """
+        Make a finished build live: force-merge it to one segment per shard,
+        give it the live generation's refresh interval and replica count,
+        wait for the replicas, swap the aliases and drop old generations
+        (see `collect_generations`). Until the swap, queries keep reading the
+        live generation, whose caches and segments the build never touches.
+
+        Returns:
+            List[str]: The generations deleted
+        """
+        es = self.es.options(request_timeout=ES_MAINTENANCE_TIMEOUT)
+        names = ",".join(name for _, name, _ in builder._indices())
+        es.indices.forcemerge(index=names, max_num_segments=1)
+
+        # A None value resets the setting to the cluster default
+        settings = {"refresh_interval": None, "number_of_replicas": None}
+        if es.indices.exists(index=INDEX_NAME):
+            (live,) = es.indices.get_settings(index=INDEX_NAME).values()
+            settings = {key: live["settings"]["index"].get(key) for key in settings}
+        es.indices.put_settings(index=names, settings={"index": settings})
+        es.cluster.health(
+            index=names, wait_for_no_initializing_shards=True, timeout=f"{int(ES_MAINTENANCE_TIMEOUT)}s"
+        )
+        es.indices.refresh(index=names)
+
+        meta = builder.index_meta()
+        es.indices.put_mapping(
+            index=builder.index_name, meta={**meta, "published_at": datetime.now(timezone.utc).isoformat()}
+        )
+        previous = self.swap_generation(builder)
+        return self.collect_generations(keep, previous)
+
+    def collect_generations(self, keep: int = INDEX_GENERATIONS_KEPT, previous: Optional[str] = None) -> List[str]:
+        """
+        Delete the generations older than the live one, except the `keep`
+        newest that were live once (`previous`, or published). Generations
+        created after the live one are builds in progress and left alone.
+
+        Returns:
+            List[str]: The generations deleted
+        """
+        generations = self.generations()
+        live = next((generation for generation in generations if generation["live"]), None)
+        if live is None:
+            return []
+        doomed = []
+        for generation in generations:
+            if generation["created"] >= live["created"]:
+                continue
+            if keep and (generation["generation"] == previous or "published_at" in generation["meta"]):
+                keep -= 1
+                continue
+            doomed.append(generation["generation"])
+        for generation in doomed:
+            names = ",".join(f"{alias}-{generation}" for alias in (INDEX_NAME, STATE_INDEX_NAME, VECTOR_INDEX_NAME))
+            self.es.indices.delete(index=names, ignore_unavailable=True)
+        return doomed
+
+    def indexed_repos(self) -> List[str]:
+        """Repos with a recorded commit."""
+        from elasticsearch import NotFoundError
+
+        try:
+            results = self.es.search(index=self.state_index_name, body={"size": 10_000, "_source": ["repo"]}) # type: ignore
+        except NotFoundError:
+            return []
+        return sorted(hit["_source"]["repo"] for hit in results["hits"]["hits"])
+
+    def migrate_index(self) -> str:
+        """
+        Copy the live generation onto the current mapping (e.g. from the old
+        brute-force `dense_vector` to an HNSW-indexed one) as a new
+        generation and publish it. The vector storage must not have changed;
+        rebuild from the repos for that. Pause indexing while this runs;
+        writes to the live generation during the copy are lost.
+
+        Returns:
+            str: The new generation
+        """
+        es = self.es.options(request_timeout=ES_MAINTENANCE_TIMEOUT)
+        builder = self.create_generation()
+        for alias, name, _ in builder._indices():
+            if es.indices.exists(index=alias):
+                es.reindex(source={"index": alias}, dest={"index": name}, wait_for_completion=True, slices="auto")
+        self.publish_generation(builder)
+        return builder.generation
+
+
+# Module-level API, served by the backend selected with SEARCH_ENGINE_FLAVOR.
+# The indexing functions take another `backend` to write elsewhere, e.g. a
+# generation that is not live yet.
+
+def ensure_index(backend: Optional[SearchBackend] = None):
+    (backend or get_backend()).ensure_index()
+
+def index_chunks(chunks: Iterable[Dict], backend: Optional[SearchBackend] = None) -> int:
+    written = (backend or get_backend()).index_chunks(chunks)
+    query_cache.bump_generation()
+    return written
+
+def bulk_load(backend: Optional[SearchBackend] = None):
+    return (backend or get_backend()).bulk_load()
+
+def delete_file_chunks(repo_name: str, file_paths: Iterable[str], backend: Optional[SearchBackend] = None):
+    (backend or get_backend()).delete_file_chunks(repo_name, file_paths)
+    query_cache.bump_generation()
+
+def delete_repo_chunks(repo_name: str, backend: Optional[SearchBackend] = None):
+    (backend or get_backend()).delete_repo_chunks(repo_name)
+    query_cache.bump_generation()
+
+def get_indexed_commit(repo_name: str, backend: Optional[SearchBackend] = None) -> Optional[str]:
+    return (backend or get_backend()).get_indexed_commit(repo_name)
+
+def set_indexed_commit(repo_name: str, commit: str, backend: Optional[SearchBackend] = None):
+    (backend or get_backend()).set_indexed_commit(repo_name, commit)
+
+def get_file_blobs(repo_name: str, backend: Optional[SearchBackend] = None) -> Dict[str, Optional[str]]:
+    return (backend or get_backend()).get_file_blobs(repo_name)
+
+def storage_report() -> Dict:
+    return get_backend().storage_report()
+
+def prune_vectors() -> int:
+    backend = get_backend()
+    if not isinstance(backend, ElasticsearchBackend) or not backend.dedup:
+        raise ValueError("prune_vectors only applies to VECTOR_STORAGE=dedup on Elasticsearch/OpenSearch")
+    pruned = backend.prune_vectors()
+    query_cache.bump_generation()
+    return pruned
+
+def _generations_backend(operation: str) -> "ElasticsearchBackend":
+    backend = get_backend()
+    if not isinstance(backend, ElasticsearchBackend):
+        raise ValueError(f"{operation} only applies to Elasticsearch/OpenSearch indices")
+    return backend
+
+def migrate_index() -> str:
+    generation = _generations_backend("migrate_index").migrate_index()
+    query_cache.bump_generation()
+    return generation
+
+def create_generation() -> "ElasticsearchBackend":
+    return _generations_backend("create_generation").create_generation()
+
+def publish_generation(builder: "ElasticsearchBackend", keep: int = INDEX_GENERATIONS_KEPT) -> List[str]:
+    deleted = _generations_backend("publish_generation").publish_generation(builder, keep)
+    query_cache.bump_generation()
+    return deleted
+
+def index_generations() -> List[Dict]:
+    return _generations_backend("index_generations").generations()
+
+def _search_options(mode: Optional[str], weights: Optional[Tuple[float, float]]) -> Tuple[str, Tuple[float, float]]:
+    """Apply the configured defaults to a search's mode and hybrid weights."""
+    mode = mode or SEARCH_MODE
+    if mode not in SEARCH_MODES:
+        raise ValueError(f"Unsupported search mode: {mode}")
+    return mode, weights or (HYBRID_LEXICAL_WEIGHT, HYBRID_VECTOR_WEIGHT)
+
+def _search_variant(
+    query: str,
+    mode: str,
+    weights: Tuple[float, float],
+    fields: Optional[Sequence[str]],
+) -> Optional[Dict]:
+    """Cache-key part for non-default searches; None keeps plain vector searches' keys."""
+    variant = {}
+    if mode != "vector":
+        variant.update({"mode": mode, "query": query, "weights": list(weights)})
+    if fields is not None:
+        variant["fields"] = list(fields)
+    return variant or None
+
+def get_embedding_client() -> EmbeddingClient:
+    global embedding_client
+    if embedding_client is None:
+        embedding_client = EmbeddingClient(EMBEDDING_SERVICE_URL, timeout=EMBEDDING_TIMEOUT)
+    return embedding_client
+
+def get_async_embedding_client() -> AsyncEmbeddingClient:
+    global async_embedding_client
+    if async_embedding_client is None:
+        async_embedding_client = AsyncEmbeddingClient(EMBEDDING_SERVICE_URL, timeout=EMBEDDING_TIMEOUT)
+    return async_embedding_client
+
+def _query_vector(query: str) -> List[float]:
+    query_vector = query_cache.get_vector(query)
+    if query_vector is None:
+        # Get the embedding vector from the embedding service
+        query_vector = get_embedding_client().get_embeddings(query)[0].tolist()  # [0] because we're only encoding one query
+        query_cache.set_vector(query, query_vector)
+    return query_vector
+
+async def _aquery_vector(query: str) -> List[float]:
+    query_vector = await query_cache.aget_vector(query)
+    if query_vector is None:
+        query_vector = (await get_async_embedding_client().get_embeddings(query))[0].tolist()
+        await query_cache.aset_vector(query, query_vector)
+    return query_vector
+
+def search_by_text(
+    query: str,
+    top_k: int = 5,
+    filters: Optional[Dict] = None,
+    mode: Optional[str] = None,
+    weights: Optional[Tuple[float, float]] = None,
+    fields: Optional[Sequence[str]] = None,
+):
+    """
+    Search chunks for `query`. Both the query vector and the hits are
+    served from `query_cache` when possible; treat the returned hits as
+    read-only, since they may be shared with other callers.
+
+    Args:
+        query (str): The search text
+        top_k (int): Number of hits to return
+        filters (dict): Optional pre-filters on FILTER_FIELDS
+        mode (str): One of SEARCH_MODES, defaults to SEARCH_MODE
+        weights (tuple): (lexical, vector) fusion weights for "hybrid"
+        fields (list): Fields to return; defaults to all but `embedding`
+    """
+    start = time.perf_counter()
+    mode, weights = _search_options(mode, weights)
+    variant = _search_variant(query, mode, weights, fields)
+    # Lexical searches never need the embedding service
+    query_vector = None
+    if mode != "lexical":
+        with search_stage_seconds.time(stage="embed", mode=mode):
+            query_vector = _query_vector(query)
+
+    # Read once: hits fetched across an index write stay under the old generation
+    generation = query_cache.generation()
+    hits = query_cache.get_results(query_vector, top_k, filters, generation, variant)
+    cache = "hit"
+    if hits is None:
+        cache = "miss"
+        with search_stage_seconds.time(stage="backend", mode=mode):
+            hits = get_backend().run_search(mode, query, query_vector, top_k, filters, weights, fields)
+        query_cache.set_results(query_vector, top_k, filters, hits, generation, variant)
+    search_seconds.observe(time.perf_counter() - start, mode=mode, cache=cache)
+    return hits
+
+async def async_search_by_text(
+    query: str,
+    top_k: int = 5,
+    filters: Optional[Dict] = None,
+    mode: Optional[str] = None,
+    weights: Optional[Tuple[float, float]] = None,
+    fields: Optional[Sequence[str]] = None,
+):
+    """Non-blocking `search_by_text` for use on the event loop."""
+    start = time.perf_counter()
+    mode, weights = _search_options(mode, weights)
+    variant = _search_variant(query, mode, weights, fields)
+    query_vector = None
+    if mode != "lexical":
+        with search_stage_seconds.time(stage="embed", mode=mode):
+            query_vector = await _aquery_vector(query)
+
+    generation = await query_cache.ageneration()
+    hits = await query_cache.aget_results(query_vector, top_k, filters, generation, variant)
+    cache = "hit"
+    if hits is None:
+        cache = "miss"
+        with search_stage_seconds.time(stage="backend", mode=mode):
+            hits = await get_backend().arun_search(mode, query, query_vector, top_k, filters, weights, fields)
+        await query_cache.aset_results(query_vector, top_k, filters, hits, generation, variant)
+    search_seconds.observe(time.perf_counter() - start, mode=mode, cache=cache)
+    return hits
+
+def browse_chunks(
+    page_size: int = 100,
+    cursor: Optional[str] = None,
+    filters: Optional[Dict] = None,
+    fields: Optional[Sequence[str]] = None,
+) -> Tuple[List[Dict], Optional[str]]:
+    """
+    Page through stored chunks in (repo, file_path, start_line) order,
+    without a query or an embedding call.
+
+    Returns:
+        tuple: (chunks, cursor of the next page or None after the last page)
+    """
+    return get_backend().browse(page_size, cursor, filters, fields)
+
+async def async_browse_chunks(
+    page_size: int = 100,
+    cursor: Optional[str] = None,
+    filters: Optional[Dict] = None,
+    fields: Optional[Sequence[str]] = None,
+) -> Tuple[List[Dict], Optional[str]]:
+    """Non-blocking `browse_chunks` for use on the event loop."""
+    return await get_backend().abrowse(page_size, cursor, filters, fields)
+
+def search_page_by_text(
+    query: str,
+    page_size: int = 10,
+    cursor: Optional[str] = None,
+    filters: Optional[Dict] = None,
+    mode: Optional[str] = None,
+    weights: Optional[Tuple[float, float]] = None,
+    fields: Optional[Sequence[str]] = None,
+) -> Tuple[List[Dict], Optional[str]]:
+    """
+    Page through the hits of `query`, for large result sets and "load more".
+    Pages are not cached.
+
+    Returns:
+        tuple: (hits, cursor of the next page or None after the last page)
+    """
+    mode, weights = _search_options(mode, weights)
+    query_vector = None if mode == "lexical" else _query_vector(query)
+    return get_backend().search_page(mode, query, query_vector, page_size, cursor, filters, weights, fields)
 
-def search_by_text(query: str, top_k: int = 5):
-    # Get the embedding vector from the embedding service
-    query_vector = embedding_client.get_embeddings(query)[0]  # [0] because we're only encoding one query
+async def async_search_page_by_text(
+    query: str,
+    page_size: int = 10,
+    cursor: Optional[str] = None,
+    filters: Optional[Dict] = None,
+    mode: Optional[str] = None,
+    weights: Optional[Tuple[float, float]] = None,
+    fields: Optional[Sequence[str]] = None,
+) -> Tuple[List[Dict], Optional[str]]:
+    """Non-blocking `search_page_by_text` for use on the event loop."""
+    mode, weights = _search_options(mode, weights)
+    query_vector = None if mode == "lexical" else await _aquery_vector(query)
+    return await get_backend().asearch_page(mode, query, query_vector, page_size, cursor, filters, weights, fields)
 
-    search_engine_flavor = os.getenv("SEARCH_ENGINE_FLAVOR", "elasticsearch")
-    results = es.search(index=INDEX_NAME, body=dsl_query(query_vector, top_k, search_engine_flavor)) # type: ignore
-    return [hit["_source"] for hit in results["hits"]["hits"]]
+async def aclose():
+    """Close the async clients; call on application shutdown."""
+    await close_backend()
+    if async_embedding_client is not None:
+        await async_embedding_client.aclose()
@@ -0,0 +1,381 @@
+import os
+import shutil
+import tempfile
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from git import BadName, GitCommandError, Repo
+
+from checkpoint import CHECKPOINT_DIR, CheckpointJournal
+from es_utils import (
+    ElasticsearchBackend,
+    bulk_load,
+    create_generation,
+    delete_file_chunks,
+    delete_repo_chunks,
+    ensure_index,
+    get_file_blobs,
+    get_indexed_commit,
+    index_chunks,
+    publish_generation,
+    set_indexed_commit,
+)
+from pipeline import IndexingPipeline, PipelineConfig, PipelineStats, stage_seconds
+from search_backend import SearchBackend, get_backend
+
+# Checkouts are kept between runs so re-indexing only needs a fetch
+REPO_CACHE_DIR = Path(os.getenv("REPO_CACHE_DIR", "/tmp"))
+
+# "worktree": full clone kept under REPO_CACHE_DIR, changes found by diffing
+# commits. "blobs": shallow bare clone into a temporary directory, `.py`
+# blobs read straight from the object database and changes found by blob
+# SHA; nothing is checked out and nothing is left behind.
+REPO_FETCH_MODES = ("worktree", "blobs")
+REPO_FETCH_MODE = os.getenv("REPO_FETCH_MODE", "worktree")
+# Partial-clone filter for "blobs" mode, e.g. "blob:limit=1m" to leave large
+# (usually non-Python) blobs on the server; a `.py` blob left out is fetched
+# on demand, one request each
+REPO_BLOB_FILTER = os.getenv("REPO_BLOB_FILTER", "")
+
+# progress(phase, files_total, stats): called on entering each phase
+# ("checkout", "indexing"); `stats` is updated live by the pipeline
+ProgressCallback = Callable[[str, int, PipelineStats], None]
+
+
+@dataclass
+class IndexResult:
+    repo_name: str
+    commit: str
+    incremental: bool
+    deleted_files: List[str] = field(default_factory=list)
+    stats: PipelineStats = field(default_factory=PipelineStats)
+
+
+def repo_name_from_url(github_url: str) -> str:
+    return github_url.rstrip("/").split("/")[-1].removesuffix(".git")
+
+
+def checkout(github_url: str, repo_dir: Path) -> Repo:
+    """
+    Bring `repo_dir` up to date with the remote's default branch, cloning
+    only when there is no usable checkout yet.
+    """
+    if (repo_dir / ".git").exists():
+        repo = Repo(repo_dir)
+        if github_url in repo.remotes.origin.urls:
+            repo.remotes.origin.fetch()
+            repo.git.reset("--hard", "origin/HEAD")
+            repo.git.clean("-fdx")
+            return repo
+
+    if repo_dir.exists():
+        shutil.rmtree(repo_dir)
+    return Repo.clone_from(github_url, repo_dir)
+
+
+def shallow_clone(github_url: str, repo_dir: Path) -> Repo:
+    """Bare, depth-1 clone of the default branch: one commit's trees and blobs."""
+    if repo_dir.exists():
+        shutil.rmtree(repo_dir)
+    options = ["--bare", "--depth=1", "--single-branch"]
+    if REPO_BLOB_FILTER:
+        options.append(f"--filter={REPO_BLOB_FILTER}")
+    return Repo.clone_from(github_url, repo_dir, multi_options=options)
+
+
+def python_blobs(repo: Repo, commit: str = "HEAD") -> Dict[str, str]:
+    """`.py` path -> blob SHA for every file in `commit`'s tree (`git ls-tree`)."""
+    blobs = {}
+    for entry in repo.git.ls_tree("-r", "-z", "--full-tree", commit).split("\0"):
+        if not entry:
+            continue
+        meta, path = entry.split("\t", 1)
+        mode, kind, sha = meta.split()
+        # Symlinks are blobs too, holding only the link target
+        if kind == "blob" and mode != "120000" and path.endswith(".py"):
+            blobs[path] = sha
+    return blobs
+
+
+def read_blobs(repo: Repo, blobs: Dict[str, str]) -> Iterator[Tuple[str, bytes, str]]:
+    """
+    Yield (path, contents, blob SHA) in path order, read through one
+    long-running `git cat-file --batch` instead of a process per file.
+    """
+    for path in sorted(blobs):
+        _, _, _, data = repo.git.get_object_data(blobs[path])
+        yield path, data, blobs[path]
+
+
+def changed_python_files(repo: Repo, since: str) -> Tuple[Set[str], Set[str]]:
+    """
+    Diff `since` against HEAD.
+
+    Returns:
+        (to_index, to_delete): `.py` paths to (re)index and paths whose chunks
+        are stale. Modified and renamed files appear in both sets.
+    """
+    to_index, to_delete = set(), set()
+    for diff in repo.commit(since).diff(repo.head.commit):
+        if diff.a_path and diff.a_path.endswith(".py") and diff.change_type != "A":
+            to_delete.add(diff.a_path)
+        if diff.b_path and diff.b_path.endswith(".py") and diff.change_type != "D":
+            to_index.add(diff.b_path)
+    return to_index, to_delete
+
+
+def open_journal(result: IndexResult, directory: Path = CHECKPOINT_DIR) -> CheckpointJournal:
+    """
+    The checkpoint journal of this run, resuming an interrupted run to the
+    same commit. An interrupted run of another kind or to another commit
+    left chunks this run's diff knows nothing about, so the run turns into
+    a full rebuild.
+    """
+    journal = CheckpointJournal(result.repo_name, result.commit, full=not result.incremental, directory=directory)
+    if journal.interrupted and not journal.resumed and result.incremental:
+        print(f"Found an interrupted run for {result.repo_name}; rebuilding the index")
+        result.incremental = False
+        journal = CheckpointJournal(result.repo_name, result.commit, full=True, directory=directory)
+    if journal.resumed:
+        print(f"Resuming {result.repo_name} at {result.commit[:12]}: {len(journal.completed)} files already indexed")
+    return journal
+
+
+def resume_partial(journal: CheckpointJournal, backend: Optional[SearchBackend] = None):
+    """Drop the chunks of files a resumed run was killed in the middle of."""
+    if journal.partial:
+        with stage_seconds.time(stage="delete"):
+            delete_file_chunks(journal.header["repo"], journal.partial, backend)
+
+
+def index_repo(
+    github_url: str,
+    config: Optional[PipelineConfig] = None,
+    full: bool = False,
+    repo_dir: Optional[Path] = None,
+    progress: Optional[ProgressCallback] = None,
+    mode: str = REPO_FETCH_MODE,
+    checkpoint_dir: Path = CHECKPOINT_DIR,
+    backend: Optional[SearchBackend] = None,
+) -> IndexResult:
+    """
+    Index a repository, incrementally when possible.
+
+    The commit SHA of each successful run is recorded. The next run fetches,
+    diffs against that commit, deletes chunks of removed or changed files and
+    re-indexes only added or changed files. A full rebuild (which also drops
+    any existing chunks for the repo) happens on the first run, with
+    `full=True`, or when the recorded commit is no longer in the history.
+
+    Files are journaled as they are written (see `checkpoint`), so a run
+    that is killed picks up where it stopped when run again.
+
+    With `mode="blobs"` see `index_repo_blobs`; `repo_dir` is then the
+    (temporary) bare clone. `checkpoint_dir` keeps the journals of runs
+    into different indices apart, and `backend` writes to another one than
+    the process-wide backend.
+    """
+    if mode not in REPO_FETCH_MODES:
+        raise ValueError(f"Unknown REPO_FETCH_MODE {mode!r}; expected one of {', '.join(REPO_FETCH_MODES)}")
+    if mode == "blobs":
+        return index_repo_blobs(github_url, config, full, repo_dir, progress, checkpoint_dir, backend)
+
+    repo_name = repo_name_from_url(github_url)
+    repo_dir = repo_dir or REPO_CACHE_DIR / repo_name
+    progress = progress or (lambda phase, files_total, stats: None)
+
+    progress("checkout", 0, PipelineStats())
+    with stage_seconds.time(stage="checkout"):
+        repo = checkout(github_url, repo_dir)
+    head = repo.head.commit.hexsha
+
+    ensure_index(backend)
+
+    last_commit = None if full else get_indexed_commit(repo_name, backend)
+    result = IndexResult(repo_name=repo_name, commit=head, incremental=last_commit is not None)
+
+    if last_commit == head:
+        return result
+
+    files: List[Path]
+    if last_commit is not None:
+        try:
+            with stage_seconds.time(stage="diff"):
+                to_index, to_delete = changed_python_files(repo, last_commit)
+        except (BadName, GitCommandError, ValueError):
+            # History was rewritten; the recorded commit is gone
+            result.incremental = False
+
+    journal = open_journal(result, checkpoint_dir)
+    pipeline = IndexingPipeline(
+        lambda chunks: index_chunks(chunks, backend), config, on_file_start=journal.start, on_file_done=journal.mark
+    )
+    try:
+        if result.incremental:
+            result.deleted_files = sorted(to_delete)
+            # A resumed run did its deletes before it was interrupted
+            if journal.resumed:
+                resume_partial(journal, backend)
+            elif to_delete:
+                with stage_seconds.time(stage="delete"):
+                    delete_file_chunks(repo_name, result.deleted_files, backend)
+            journal.begin()
+            files = [
+                repo_dir / path for path in sorted(to_index - journal.completed) if (repo_dir / path).is_file()
+            ]
+            progress("indexing", len(files), pipeline.stats)
+            result.stats = pipeline.run(files, repo_dir, repo_name)
+        else:
+            if journal.resumed:
+                resume_partial(journal, backend)
+            else:
+                with stage_seconds.time(stage="delete"):
+                    delete_repo_chunks(repo_name, backend)
+            journal.begin()
+            files = [
+                path for path in repo_dir.rglob("*.py")
+                if str(path.relative_to(repo_dir)) not in journal.completed
+            ]
+            progress("indexing", len(files), pipeline.stats)
+            with bulk_load(backend):
+                result.stats = pipeline.run(files, repo_dir, repo_name)
+    except BaseException:
+        journal.close()
+        raise
+
+    # Killed in between, the next run redoes the diff, which is harmless:
+    # chunk IDs are deterministic
+    journal.finish()
+    set_indexed_commit(repo_name, head, backend)
+    return result
+
+
+def index_repo_blobs(
+    github_url: str,
+    config: Optional[PipelineConfig] = None,
+    full: bool = False,
+    repo_dir: Optional[Path] = None,
+    progress: Optional[ProgressCallback] = None,
+    checkpoint_dir: Path = CHECKPOINT_DIR,
+    backend: Optional[SearchBackend] = None,
+) -> IndexResult:
+    """
+    Index a repository from a shallow bare clone, without a working tree.
+
+    `.py` blobs are listed from the head commit's tree and streamed from the
+    object database into the pipeline. Chunks carry their file's blob SHA,
+    so an incremental run re-indexes exactly the files whose SHA differs
+    from the indexed one (and drops files that are gone) without needing
+    any history. The clone is removed afterwards.
+    """
+    repo_name = repo_name_from_url(github_url)
+    progress = progress or (lambda phase, files_total, stats: None)
+    if repo_dir is None:
+        REPO_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        repo_dir = Path(tempfile.mkdtemp(prefix=f"{repo_name}-", suffix=".git", dir=REPO_CACHE_DIR))
+
+    repo = None
+    try:
+        progress("checkout", 0, PipelineStats())
+        with stage_seconds.time(stage="checkout"):
+            repo = shallow_clone(github_url, repo_dir)
+        head = repo.head.commit.hexsha
+
+        ensure_index(backend)
+
+        last_commit = None if full else get_indexed_commit(repo_name, backend)
+        result = IndexResult(repo_name=repo_name, commit=head, incremental=last_commit is not None)
+        if last_commit == head:
+            return result
+
+        blobs = python_blobs(repo)
+        journal = open_journal(result, checkpoint_dir)
+        pipeline = IndexingPipeline(
+            lambda chunks: index_chunks(chunks, backend), config, on_file_start=journal.start, on_file_done=journal.mark
+        )
+        try:
+            if journal.resumed:
+                resume_partial(journal, backend)
+            if result.incremental:
+                # Resumed, the files already done now match by SHA
+                with stage_seconds.time(stage="diff"):
+                    indexed = get_file_blobs(repo_name, backend)
+                # Files indexed before blob SHAs were recorded (None) are re-indexed once
+                changed = {path: sha for path, sha in blobs.items() if indexed.get(path) != sha}
+                result.deleted_files = sorted(path for path in indexed if path not in blobs or path in changed)
+                if result.deleted_files:
+                    with stage_seconds.time(stage="delete"):
+                        delete_file_chunks(repo_name, result.deleted_files, backend)
+                journal.begin()
+                progress("indexing", len(changed), pipeline.stats)
+                result.stats = pipeline.run_blobs(read_blobs(repo, changed), repo_name)
+            else:
+                if not journal.resumed:
+                    with stage_seconds.time(stage="delete"):
+                        delete_repo_chunks(repo_name, backend)
+                journal.begin()
+                todo = {path: sha for path, sha in blobs.items() if path not in journal.completed}
+                progress("indexing", len(todo), pipeline.stats)
+                with bulk_load(backend):
+                    result.stats = pipeline.run_blobs(read_blobs(repo, todo), repo_name)
+        except BaseException:
+            journal.close()
+            raise
+
+        journal.finish()
+        set_indexed_commit(repo_name, head, backend)
+        return result
+    finally:
+        if repo is not None:
+            # Stops the persistent cat-file processes before their directory goes
+            repo.close()
+        shutil.rmtree(repo_dir, ignore_errors=True)
+
+
+def rebuild_index(
+    github_urls: List[str],
+    config: Optional[PipelineConfig] = None,
+    mode: str = REPO_FETCH_MODE,
+    generation: Optional[str] = None,
+    on_generation: Optional[Callable[[str], None]] = None,
+) -> Tuple[str, List[IndexResult]]:
+    """
+    Index `github_urls` from scratch into a new index generation (see
+    `ElasticsearchBackend.create_generation`), then publish it: the aliases
+    move to it in one step and old generations are dropped. Searches and
+    incremental runs keep using the live generation until then, and repos
+    not in `github_urls` are gone from the new one.
+
+    Pass the `generation` of a killed rebuild to resume it; `on_generation`
+    is told the generation before anything is indexed. The new generation
+    is written through its own backend, so the process-wide one keeps
+    serving the live generation to searches and other index jobs.
+
+    Returns:
+        (generation, results): The published generation and the result of each repo
+    """
+    live = get_backend()
+    if not isinstance(live, ElasticsearchBackend):
+        raise ValueError("rebuild_index only applies to Elasticsearch/OpenSearch indices")
+    if generation:
+        storage = "dedup" if live.dedup else "inline"
+        builder = ElasticsearchBackend(live.search_engine_flavor, live.es, live.async_es, storage, generation)
+    else:
+        builder = create_generation()
+    if on_generation:
+        on_generation(builder.generation)
+
+    checkpoint_dir = CHECKPOINT_DIR / builder.generation
+    # Repos the builder has already recorded are skipped, and a repo
+    # killed halfway resumes from its journal
+    results = [
+        index_repo(url, config, mode=mode, checkpoint_dir=checkpoint_dir, backend=builder) for url in github_urls
+    ]
+
+    dropped = sorted(set(live.indexed_repos()) - {result.repo_name for result in results})
+    if dropped:
+        print(f"Not in the new generation: {', '.join(dropped)}")
+    publish_generation(builder)
+    shutil.rmtree(checkpoint_dir, ignore_errors=True)
+    return builder.generation, results
@@ -0,0 +1,287 @@
+"""
+CPU inference backends for the sentence-transformers embedding model.
+
+`torch` runs the model through sentence-transformers. `onnx` runs an ONNX
+export of the same transformer under ONNX Runtime, and `onnx-int8` runs a
+dynamically int8-quantized copy of that export. The ONNX backends only need
+onnxruntime, tokenizers and numpy at serve time; torch is needed once, to
+export the model:
+
+    python inference_backends.py export --backend onnx-int8
+
+The export also stores the torch embeddings of VALIDATION_TEXTS, and every
+ONNX backend checks itself against them on load, so a bad export or an
+over-aggressive quantization fails at startup instead of silently degrading
+search quality.
+"""
+import argparse
+import json
+import os
+import time
+from pathlib import Path
+from typing import List, Sequence
+
+import numpy as np
+
+BACKENDS = ("torch", "onnx", "onnx-int8")
+# Which backend ModelCache loads
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+# Intra-op threads for inference (0: the runtime's default, usually all cores)
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", 0))
+# ONNX exports, their tokenizer and the reference embeddings live here
+EMBEDDING_EXPORT_DIR = Path(os.getenv("EMBEDDING_EXPORT_DIR", "./.cache/onnx"))
+# Tokens per text; longer texts are truncated (256 is all-MiniLM-L6-v2's limit)
+EMBEDDING_MAX_SEQ_LENGTH = int(os.getenv("EMBEDDING_MAX_SEQ_LENGTH", 256))
+# Export a missing ONNX model on load, which needs torch and transformers;
+# turn off where the export is built in, to fail fast instead
+EMBEDDING_AUTO_EXPORT = os.getenv("EMBEDDING_AUTO_EXPORT", "1").lower() in ("1", "true", "yes")
+# Skip the load-time comparison against the torch reference embeddings
+EMBEDDING_SKIP_VALIDATION = os.getenv("EMBEDDING_SKIP_VALIDATION", "").lower() in ("1", "true", "yes")
+
+# Lowest cosine similarity to the torch embedding accepted per validation text
+VALIDATION_TOLERANCE = {
+    "onnx": float(os.getenv("EMBEDDING_ONNX_MIN_COSINE", 0.999)),
+    "onnx-int8": float(os.getenv("EMBEDDING_INT8_MIN_COSINE", 0.98)),
+}
+
+# Code-like and prose texts of mixed lengths, embedded by every backend
+VALIDATION_TEXTS = [
+    "def add(a, b):\n    return a + b",
+    "class LRUCache:\n    def __init__(self, maxsize):\n        self.maxsize = maxsize\n        self.data = OrderedDict()",
+    "import numpy as np\n\ndef cosine(a, b):\n    return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))",
+    "async def fetch(session, url):\n    async with session.get(url) as response:\n        return await response.json()",
+    "parse the git diff and re-index changed python files",
+    "how do I stream a summary over server-sent events",
+    "x",
+    "for i in range(10):\n    print(i)\n" * 20,
+]
+
+
+def hub_name(model_name: str) -> str:
+    """sentence-transformers resolves bare names under the sentence-transformers org."""
+    return model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+
+
+def export_path(model_name: str, export_dir: Path = EMBEDDING_EXPORT_DIR) -> Path:
+    return Path(export_dir) / model_name.replace("/", "__")
+
+
+def length_buckets(lengths: Sequence[int], batch_size: int) -> List[np.ndarray]:
+    """
+    Split indices into batches of similar length: sorted by length, so each
+    batch is only padded to its own longest text rather than the longest
+    text of the whole request.
+    """
+    order = np.argsort(np.asarray(lengths), kind="stable")
+    return [order[i:i + batch_size] for i in range(0, len(order), max(1, batch_size))]
+
+
+class TorchBackend:
+    """The reference: sentence-transformers on PyTorch."""
+
+    name = "torch"
+
+    def __init__(self, model_name: str, threads: int = EMBEDDING_THREADS, cache_folder: str = "./.cache"):
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        if threads:
+            torch.set_num_threads(threads)
+        self.model = SentenceTransformer(model_name, cache_folder=cache_folder)
+        self.model.max_seq_length = EMBEDDING_MAX_SEQ_LENGTH
+        self.cache_name = model_name
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        # sentence-transformers sorts by length before batching, the same
+        # bucketing `length_buckets` does for the ONNX backends
+        return self.model.encode(texts, batch_size=batch_size, convert_to_numpy=True)
+
+
+class OnnxBackend:
+    """
+    The exported transformer under ONNX Runtime, with the mean pooling and
+    normalization sentence-transformers applies done in numpy.
+    """
+
+    def __init__(self, model_name: str, quantized: bool = False, threads: int = EMBEDDING_THREADS,
+                 export_dir: Path = EMBEDDING_EXPORT_DIR):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        self.name = "onnx-int8" if quantized else "onnx"
+        # int8 vectors differ slightly, so they get their own embedding cache entries
+        self.cache_name = f"{model_name}:int8" if quantized else model_name
+        target = export_path(model_name, export_dir)
+        model_path = target / ("model-int8.onnx" if quantized else "model.onnx")
+        if not model_path.exists():
+            if not EMBEDDING_AUTO_EXPORT:
+                raise FileNotFoundError(
+                    f"No ONNX export at {model_path}; run `python inference_backends.py export --backend {self.name}`"
+                )
+            export(model_name, export_dir, quantize=quantized)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(str(model_path), options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(str(target / "tokenizer.json"))
+        self.tokenizer.enable_truncation(EMBEDDING_MAX_SEQ_LENGTH)
+        self.tokenizer.no_padding()
+
+        if not EMBEDDING_SKIP_VALIDATION:
+            validate(self, np.load(target / "reference.npy"), VALIDATION_TOLERANCE[self.name])
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(list(texts))
+        embeddings = None
+        for batch in length_buckets([len(e.ids) for e in encodings], batch_size):
+            seq_len = max(len(encodings[i].ids) for i in batch)
+            input_ids = np.zeros((len(batch), seq_len), dtype=np.int64)
+            attention_mask = np.zeros((len(batch), seq_len), dtype=np.int64)
+            for row, i in enumerate(batch):
+                ids = encodings[i].ids
+                input_ids[row, :len(ids)] = ids
+                attention_mask[row, :len(ids)] = 1
+
+            feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+            if "token_type_ids" in self.input_names:
+                feeds["token_type_ids"] = np.zeros_like(input_ids)
+            hidden = self.session.run(["last_hidden_state"], feeds)[0]
+
+            mask = attention_mask[:, :, None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+            if embeddings is None:
+                embeddings = np.empty((len(texts), pooled.shape[1]), dtype=np.float32)
+            embeddings[batch] = pooled
+        return embeddings if embeddings is not None else np.empty((0, 0), dtype=np.float32)
+
+
+def load_backend(name: str = EMBEDDING_BACKEND, model_name: str = "all-MiniLM-L6-v2",
+                 threads: int = EMBEDDING_THREADS, cache_folder: str = "./.cache"):
+    if name == "torch":
+        return TorchBackend(model_name, threads, cache_folder)
+    if name in ("onnx", "onnx-int8"):
+        return OnnxBackend(model_name, quantized=name == "onnx-int8", threads=threads)
+    raise ValueError(f"Unknown EMBEDDING_BACKEND {name!r}; expected one of {', '.join(BACKENDS)}")
+
+
+def validate(backend, reference: np.ndarray, tolerance: float) -> float:
+    """
+    Embed VALIDATION_TEXTS and compare them with the torch `reference`.
+
+    Returns:
+        The lowest cosine similarity over the texts
+
+    Raises:
+        ValueError: if any text falls below `tolerance`
+    """
+    embeddings = backend.encode(VALIDATION_TEXTS, batch_size=4)
+    # Both sides are unit vectors
+    cosines = np.sum(embeddings * reference, axis=1)
+    worst = float(cosines.min())
+    if worst < tolerance:
+        raise ValueError(
+            f"{backend.name} embeddings drift from torch: min cosine {worst:.4f} < {tolerance} "
+            f"(text {int(cosines.argmin())}); re-export or use another EMBEDDING_BACKEND"
+        )
+    return worst
+
+
+def export(model_name: str, export_dir: Path = EMBEDDING_EXPORT_DIR, quantize: bool = False) -> Path:
+    """
+    One-time export of `model_name` to ONNX, plus its int8 copy when
+    `quantize`. Files already exported are kept. Needs torch and transformers.
+
+    Returns:
+        Path of the exported (or quantized) model
+    """
+    target = export_path(model_name, export_dir)
+    target.mkdir(parents=True, exist_ok=True)
+    model_path = target / "model.onnx"
+
+    if not model_path.exists():
+        import torch
+        from sentence_transformers import SentenceTransformer
+        from transformers import AutoModel, AutoTokenizer
+
+        tokenizer = AutoTokenizer.from_pretrained(hub_name(model_name))
+        model = AutoModel.from_pretrained(hub_name(model_name)).eval()
+        sample = tokenizer(["def add(a, b): return a + b"], return_tensors="pt")
+        names = [n for n in ("input_ids", "attention_mask", "token_type_ids") if n in sample]
+        axes = {n: {0: "batch", 1: "sequence"} for n in names}
+        axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+        tmp = target / "model.onnx.tmp"
+        with torch.no_grad():
+            torch.onnx.export(
+                model,
+                tuple(sample[n] for n in names),
+                str(tmp),
+                input_names=names,
+                output_names=["last_hidden_state"],
+                dynamic_axes=axes,
+                opset_version=14,
+            )
+        tokenizer.save_pretrained(str(target))
+
+        reference = TorchBackend(model_name, threads=EMBEDDING_THREADS).encode(VALIDATION_TEXTS, batch_size=4)
+        np.save(target / "reference.npy", reference.astype(np.float32))
+        (target / "export.json").write_text(json.dumps({
+            "model": model_name,
+            "max_seq_length": EMBEDDING_MAX_SEQ_LENGTH,
+            "exported_at": time.time(),
+        }))
+        os.replace(tmp, model_path)
+
+    if not quantize:
+        return model_path
+
+    quantized_path = target / "model-int8.onnx"
+    if not quantized_path.exists():
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        tmp = target / "model-int8.onnx.tmp"
+        quantize_dynamic(str(model_path), str(tmp), weight_type=QuantType.QInt8)
+        os.replace(tmp, quantized_path)
+    return quantized_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export and validate embedding inference backends")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_cmd = commands.add_parser("export", help="Export the model to ONNX (and int8) once")
+    export_cmd.add_argument("--model", default="all-MiniLM-L6-v2")
+    export_cmd.add_argument("--backend", choices=BACKENDS[1:], default="onnx-int8")
+
+    validate_cmd = commands.add_parser("validate", help="Compare backends with torch and time them")
+    validate_cmd.add_argument("--model", default="all-MiniLM-L6-v2")
+    validate_cmd.add_argument("--backend", choices=BACKENDS, action="append")
+    validate_cmd.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        path = export(args.model, quantize=args.backend == "onnx-int8")
+        print(f"Exported {args.model} to {path}")
+        return
+
+    export(args.model)
+    reference = np.load(export_path(args.model) / "reference.npy")
+    texts = VALIDATION_TEXTS * 16
+    for name in args.backend or BACKENDS:
+        backend = load_backend(name, args.model)
+        worst = validate(backend, reference, VALIDATION_TOLERANCE.get(name, 0.9999))
+        start = time.perf_counter()
+        backend.encode(texts, batch_size=args.batch_size)
+        seconds = time.perf_counter() - start
+        print(f"{name}: min cosine {worst:.5f}, {len(texts) / seconds:.1f} texts/s")
+
+
+if __name__ == "__main__":
+    main()
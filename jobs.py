@@ -0,0 +1,275 @@
+import fcntl
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Deque, Dict, Iterator, List, Optional, Set, Tuple
+
+from indexer import REPO_FETCH_MODE, index_repo, repo_name_from_url
+from pipeline import PipelineConfig, PipelineStats
+
+# Index jobs run at once
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+# Max jobs waiting to run; further submissions are rejected
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", 1000))
+# Jobs check out each repo into "<JOB_WORK_DIR>/<repo name>", kept between
+# jobs so re-indexing only needs a fetch ("<repo name>.blobs" is the scratch
+# clone in blobs mode). Apart from REPO_CACHE_DIR, so `cli index-repo` never
+# works on a job's checkout
+JOB_WORK_DIR = Path(os.getenv("JOB_WORK_DIR", "/tmp/index-jobs"))
+# Finished jobs kept for the progress API
+JOB_HISTORY = int(os.getenv("JOB_HISTORY", 500))
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+@contextmanager
+def repo_lock(path: Path) -> Iterator[None]:
+    """Exclusive `flock` on `path`, blocking until other processes release it."""
+    with open(path, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class JobQueueFull(RuntimeError):
+    """Raised by `JobScheduler.submit` when JOB_QUEUE_SIZE jobs are already waiting."""
+
+
+@dataclass
+class Job:
+    id: str
+    github_url: str
+    repo_name: str
+    full: bool = False
+    state: str = QUEUED
+    phase: Optional[str] = None
+    files_total: int = 0
+    # Live pipeline counters while running, the final ones afterwards
+    stats: PipelineStats = field(default_factory=PipelineStats)
+    commit: Optional[str] = None
+    incremental: Optional[bool] = None
+    error: Optional[str] = None
+    submitted_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    def to_dict(self) -> Dict:
+        end = self.finished_at or time.time()
+        return {
+            "id": self.id,
+            "github_url": self.github_url,
+            "repo": self.repo_name,
+            "full": self.full,
+            "state": self.state,
+            "commit": self.commit,
+            "incremental": self.incremental,
+            "error": self.error,
+            "progress": {
+                "phase": self.phase,
+                "files_done": self.stats.files,
+                "files_total": self.files_total,
+                "chunks": self.stats.chunks,
+            },
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "seconds": end - self.started_at if self.started_at else None,
+        }
+
+
+class JobScheduler:
+    """
+    Queue of index jobs served by a bounded pool of worker threads.
+
+    Submitting a repo that already has a queued job returns that job instead
+    of queueing another. A repo is never indexed by two workers at once; a
+    job submitted while its repo is running waits for that run to finish.
+    Each repo has one checkout under `work_dir`, kept between jobs. Jobs
+    hold `<work_dir>/<repo>.lock` while they run, so schedulers in other
+    processes (e.g. other uvicorn workers) sharing `work_dir` never work on
+    the same checkout at once either.
+
+    Workers start on the first submission.
+    """
+
+    def __init__(
+        self,
+        workers: int = JOB_WORKERS,
+        max_queue: int = JOB_QUEUE_SIZE,
+        config: Optional[PipelineConfig] = None,
+        work_dir: Path = JOB_WORK_DIR,
+        history: int = JOB_HISTORY,
+    ):
+        self.workers = max(1, workers)
+        self.max_queue = max_queue
+        # Concurrent jobs share the CPUs between their extraction pools
+        self.config = config or PipelineConfig(extract_workers=max(1, (os.cpu_count() or 1) // self.workers))
+        self.work_dir = Path(work_dir)
+        self.history = history
+
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._pending: Deque[Job] = deque()
+        self._running: Dict[str, Job] = {}
+        self._cond = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self._stopping = False
+        self._started_at: Optional[float] = None
+
+        self.completed = 0
+        self.failed = 0
+        self.files_indexed = 0
+        self.chunks_indexed = 0
+
+    def start(self):
+        with self._cond:
+            if self._threads:
+                return
+            self._stopping = False
+            self._started_at = time.time()
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"index-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def shutdown(self, wait: bool = False):
+        """Stop taking jobs off the queue; running jobs are not interrupted."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+            threads, self._threads = self._threads, []
+        if wait:
+            for thread in threads:
+                thread.join()
+
+    def submit(self, github_url: str, full: bool = False) -> Tuple[Job, bool]:
+        """
+        Queue an index job for `github_url`.
+
+        Returns:
+            (job, created): `created` is False if the repo was already queued,
+            in which case the queued job is returned (and made full if `full`)
+
+        Raises:
+            JobQueueFull: if `max_queue` jobs are already waiting
+        """
+        repo_name = repo_name_from_url(github_url)
+        with self._cond:
+            for job in self._pending:
+                if job.repo_name == repo_name:
+                    job.full = job.full or full
+                    return job, False
+            if len(self._pending) >= self.max_queue:
+                raise JobQueueFull(f"{len(self._pending)} jobs already queued")
+
+            job = Job(id=uuid.uuid4().hex, github_url=github_url, repo_name=repo_name, full=full)
+            self._jobs[job.id] = job
+            self._pending.append(job)
+            self._trim_history()
+            self._cond.notify_all()
+        self.start()
+        return job, True
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def list(self, state: Optional[str] = None) -> List[Job]:
+        with self._cond:
+            return [job for job in self._jobs.values() if state is None or job.state == state]
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """Wait until no job is queued or running; returns False on timeout."""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending and not self._running, timeout)
+
+    def stats(self) -> Dict:
+        with self._cond:
+            running = list(self._running.values())
+            uptime = time.time() - self._started_at if self._started_at else 0.0
+            chunks = self.chunks_indexed + sum(job.stats.chunks for job in running)
+            return {
+                "workers": self.workers,
+                "queue_depth": len(self._pending),
+                "running": len(running),
+                "completed": self.completed,
+                "failed": self.failed,
+                "files_indexed": self.files_indexed + sum(job.stats.files for job in running),
+                "chunks_indexed": chunks,
+                "uptime_seconds": uptime,
+                "jobs_per_minute": (self.completed + self.failed) / uptime * 60 if uptime else 0.0,
+                "chunks_per_second": chunks / uptime if uptime else 0.0,
+            }
+
+    def _trim_history(self):
+        """Forget the oldest finished jobs beyond `history`; called with the lock held."""
+        finished = [job_id for job_id, job in self._jobs.items() if job.state in (SUCCEEDED, FAILED)]
+        for job_id in finished[:max(0, len(finished) - self.history)]:
+            del self._jobs[job_id]
+
+    def _next_job(self) -> Optional[Job]:
+        """First queued job whose repo isn't being indexed; called with the lock held."""
+        for job in self._pending:
+            if job.repo_name not in self._running:
+                self._pending.remove(job)
+                return job
+        return None
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._stopping:
+                        return
+                    job = self._next_job()
+                    if job is not None:
+                        break
+                    self._cond.wait()
+                job.state = RUNNING
+                job.started_at = time.time()
+                self._running[job.repo_name] = job
+
+            self._run(job)
+
+            with self._cond:
+                del self._running[job.repo_name]
+                if job.state == SUCCEEDED:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+                self.files_indexed += job.stats.files
+                self.chunks_indexed += job.stats.chunks
+                self._trim_history()
+                self._cond.notify_all()
+
+    def _run(self, job: Job):
+        def progress(phase: str, files_total: int, stats: PipelineStats):
+            job.phase = phase
+            job.files_total = files_total
+            job.stats = stats
+
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+        repo_dir = self.work_dir / (f"{job.repo_name}.blobs" if REPO_FETCH_MODE == "blobs" else job.repo_name)
+        try:
+            progress("waiting", 0, job.stats)
+            with repo_lock(self.work_dir / f"{job.repo_name}.lock"):
+                result = index_repo(job.github_url, self.config, full=job.full, repo_dir=repo_dir, progress=progress)
+            job.commit = result.commit
+            job.incremental = result.incremental
+            job.stats = result.stats
+            job.state = SUCCEEDED
+        except Exception as e:
+            job.error = f"{type(e).__name__}: {e}"
+            job.state = FAILED
+        finally:
+            job.phase = None
+            job.finished_at = time.time()
@@ -0,0 +1,627 @@
+import base64
+import json
+import os
+import re
+import shutil
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from search_backend import SearchBackend, chunk_id, content_hash, decode_cursor, encode_cursor
+
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", "./.index")
+# Storage type of the vector matrix; float16 halves memory at no real cost in recall
+LOCAL_INDEX_DTYPE = os.getenv("LOCAL_INDEX_DTYPE", "float16")
+# Number of IVF lists scanned per query once `build_ivf` has been run
+LOCAL_INDEX_NPROBE = int(os.getenv("LOCAL_INDEX_NPROBE", 8))
+
+# Rows scored per matrix multiply, to bound the float32 working set
+_BLOCK_ROWS = 65536
+
+# String columns are dictionary-encoded as int32 codes
+DICT_FIELDS = ("repo", "file_path", "name", "type", "parent_id", "blob_sha")
+# Dictionary columns returned as None when empty: top-level chunks have no
+# `parent_id`, and rows written before a column existed have neither
+OPTIONAL_FIELDS = ("parent_id", "blob_sha")
+INT_FIELDS = ("start_line", "end_line")
+# Variable-length fields, each concatenated into one blob with an ends column;
+# `ast` holds the raw compressed bytes of the chunk's base64 `ast` string
+BLOB_FIELDS = ("code", "ast")
+# Fields of a returned document by default, in order
+DOC_FIELDS = DICT_FIELDS + INT_FIELDS + ("code",)
+
+# Identifier-ish query terms for lexical search
+_TERM_RE = re.compile(r"\w+")
+# Score added when the query is exactly a chunk's name
+LEXICAL_NAME_BOOST = float(os.getenv("LEXICAL_NAME_BOOST", 3.0))
+
+
+class _Dictionary:
+    """Append-only string dictionary, persisted as one JSON string per line."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.values: List[str] = []
+        self.codes: Dict[str, int] = {}
+        self._offset = 0
+        self._pending: List[str] = []
+
+    def refresh(self):
+        """Pick up values appended by other processes."""
+        if not self.path.exists():
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            self._add(json.loads(line))
+        self._offset += end
+
+    def _add(self, value: str) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self.values.append(value)
+            self.codes[value] = code
+        return code
+
+    def encode(self, value: str) -> int:
+        if value not in self.codes:
+            self._pending.append(value)
+        return self._add(value)
+
+    def flush(self):
+        if not self._pending:
+            return
+        data = "".join(json.dumps(value) + "\n" for value in self._pending).encode("utf-8")
+        with open(self.path, "ab") as f:
+            f.write(data)
+        self._offset += len(data)
+        self._pending = []
+
+
+class LocalBackend(SearchBackend):
+    """
+    In-process vector search over a directory of flat files.
+
+    Vectors live in a memory-mapped float16/float32 matrix (normalized at
+    insert time, so cosine similarity is a dot product). Chunk metadata is
+    kept column by column next to it: dictionary-encoded int32 columns for
+    repo/file_path/name/type, int32 line numbers, an alive bitmap for
+    deletes and upserts, and all code (and compressed ASTs) concatenated in
+    one blob per field with an offsets column. Search is a blocked matrix-vector product plus
+    `argpartition` top-k; after `build_ivf` only the rows in the closest
+    `LOCAL_INDEX_NPROBE` clusters are scored.
+
+    Data files belong to a segment directory named in `meta.json`; writers
+    append to it and then bump the generation in `meta.json`, and readers in
+    other processes (e.g. the web server) remap when the generation changes.
+    `compact` writes a new segment without the deleted rows. Only one
+    process should write at a time.
+    """
+
+    def __init__(self, path: str = LOCAL_INDEX_DIR, dtype: str = LOCAL_INDEX_DTYPE):
+        self.path = Path(path)
+        self.dtype = np.dtype(dtype)
+        self._lock = threading.RLock()
+        self._dicts = {field: _Dictionary(self.path / f"dict_{field}.jsonl") for field in DICT_FIELDS}
+        self._meta: Dict = {}
+        self._generation = None
+        self._arrays: Dict[str, np.ndarray] = {}
+        self._centroids: Optional[np.ndarray] = None
+        self._ids: Optional[Dict[bytes, int]] = None
+
+    # Files and metadata
+
+    def _segment(self, meta: Optional[Dict] = None) -> Path:
+        return self.path / (meta or self._meta)["segment"]
+
+    def _read_meta(self) -> Dict:
+        meta_path = self.path / "meta.json"
+        if not meta_path.exists():
+            return {"segment": "seg-0", "count": 0, "dims": None, "dtype": self.dtype.name, "generation": 0, "ivf_lists": 0}
+        with open(meta_path) as f:
+            return json.load(f)
+
+    def _write_meta(self, meta: Dict):
+        tmp = self.path / "meta.json.tmp"
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, self.path / "meta.json")
+
+    def _column_specs(self, meta: Dict) -> Dict[str, tuple]:
+        """File name -> (dtype, row shape) of every per-row column."""
+        specs = {field: ("<i4", ()) for field in DICT_FIELDS + INT_FIELDS}
+        specs["alive"] = ("u1", ())
+        specs["ids"] = ("S20", ())
+        for field in BLOB_FIELDS:
+            specs[f"{field}_ends"] = ("<i8", ())
+        if meta["dims"]:
+            specs["vectors"] = (meta["dtype"], (meta["dims"],))
+        if meta.get("ivf_lists"):
+            specs["ivf_assign"] = ("<i4", ())
+        return specs
+
+    def _map(self, name: str, dtype, shape, count: int, mode: str = "r") -> np.ndarray:
+        path = self._segment() / f"{name}.bin"
+        if count == 0 or not path.exists():
+            return np.zeros((0,) + shape, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode=mode, shape=(count,) + shape)
+
+    def _refresh(self):
+        """Remap data files if another writer (or process) changed them."""
+        meta = self._read_meta()
+        for dictionary in self._dicts.values():
+            dictionary.refresh()
+        if meta["generation"] == self._generation:
+            return
+        self._meta = meta
+        self._generation = meta["generation"]
+        count = meta["count"]
+        self._arrays = {
+            name: self._map(name, dtype, shape, count)
+            for name, (dtype, shape) in self._column_specs(meta).items()
+        }
+        for field in BLOB_FIELDS:
+            ends = self._arrays[f"{field}_ends"]
+            size = int(ends[-1]) if len(ends) else 0
+            self._arrays[field] = (
+                np.memmap(self._segment() / f"{field}.bin", dtype="u1", mode="r", shape=(size,))
+                if size else np.zeros(0, dtype="u1")
+            )
+        centroids_path = self._segment() / "ivf_centroids.npy"
+        self._centroids = np.load(centroids_path) if meta.get("ivf_lists") and centroids_path.exists() else None
+        self._ids = None
+
+    def _prepare_write(self):
+        """
+        Backfill columns that older segments lack, truncate anything a
+        crashed writer appended past `count` and build the chunk ID -> row
+        map used for upserts.
+        """
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._segment().mkdir(parents=True, exist_ok=True)
+        count = self._meta["count"]
+        for field in BLOB_FIELDS:
+            ends_path = self._segment() / f"{field}_ends.bin"
+            if count and not ends_path.exists():
+                # Segment written before this field existed: its rows get empty values
+                np.zeros(count, dtype="<i8").tofile(ends_path)
+                self._arrays[f"{field}_ends"] = self._map(f"{field}_ends", "<i8", (), count)
+        for field in DICT_FIELDS:
+            path = self._segment() / f"{field}.bin"
+            if count and not path.exists():
+                np.full(count, self._dicts[field].encode(""), dtype="<i4").tofile(path)
+                self._arrays[field] = self._map(field, "<i4", (), count)
+        if self._ids is not None:
+            return
+        for name, (dtype, shape) in self._column_specs(self._meta).items():
+            path = self._segment() / f"{name}.bin"
+            if path.exists():
+                with open(path, "r+b") as f:
+                    f.truncate(count * np.dtype(dtype).itemsize * int(np.prod(shape, dtype=np.int64)))
+        for field in BLOB_FIELDS:
+            blob_path = self._segment() / f"{field}.bin"
+            if blob_path.exists():
+                with open(blob_path, "r+b") as f:
+                    f.truncate(len(self._arrays[field]))
+        # numpy drops trailing NUL bytes from "S" values, so keys are compared stripped
+        self._ids = {row_id: row for row, row_id in enumerate(self._arrays["ids"].tolist())}
+
+    def _append(self, name: str, data: np.ndarray):
+        with open(self._segment() / f"{name}.bin", "ab") as f:
+            f.write(np.ascontiguousarray(data).tobytes())
+
+    def _commit(self, meta: Dict):
+        for dictionary in self._dicts.values():
+            dictionary.flush()
+        meta["generation"] += 1
+        self._write_meta(meta)
+        # Our own write doesn't invalidate the upsert map
+        ids = self._ids
+        self._refresh()
+        self._ids = ids
+
+    def _mark_dead(self, rows):
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows) == 0:
+            return
+        alive = np.memmap(self._segment() / "alive.bin", dtype="u1", mode="r+", shape=(self._meta["count"],))
+        alive[rows] = 0
+        alive.flush()
+
+    # SearchBackend
+
+    def ensure_index(self):
+        self.path.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            self._refresh()
+
+    def index_chunks(self, chunks: Iterable[Dict]) -> int:
+        chunks = list(chunks)
+        if not chunks:
+            return 0
+
+        vectors = np.asarray([chunk["embedding"] for chunk in chunks], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.where(norms == 0, 1, norms)
+
+        with self._lock:
+            self._refresh()
+            self._prepare_write()
+            meta = dict(self._meta)
+            if meta["dims"] is None:
+                meta["dims"] = vectors.shape[1]
+            elif meta["dims"] != vectors.shape[1]:
+                raise ValueError(f"Expected {meta['dims']}-dim vectors, got {vectors.shape[1]}")
+
+            start = meta["count"]
+            dead = []
+            ids = []
+            for offset, chunk in enumerate(chunks):
+                row_id = bytes.fromhex(chunk_id(chunk)).rstrip(b"\0")
+                previous = self._ids.get(row_id)
+                if previous is not None:
+                    dead.append(previous)
+                self._ids[row_id] = start + offset
+                ids.append(row_id)
+
+            blobs = {
+                "code": [chunk.get("code", "").encode("utf-8") for chunk in chunks],
+                "ast": [base64.b64decode(chunk["ast"]) if chunk.get("ast") else b"" for chunk in chunks],
+            }
+
+            self._append("vectors", vectors.astype(meta["dtype"]))
+            self._append("ids", np.array(ids, dtype="S20"))
+            for field in DICT_FIELDS:
+                codes = [self._dicts[field].encode(str(chunk.get(field) or "")) for chunk in chunks]
+                self._append(field, np.array(codes, dtype="<i4"))
+            for field in INT_FIELDS:
+                self._append(field, np.array([chunk.get(field, 0) for chunk in chunks], dtype="<i4"))
+            self._append("alive", np.ones(len(chunks), dtype="u1"))
+            for field, values in blobs.items():
+                base = len(self._arrays[field])
+                self._append(f"{field}_ends", base + np.cumsum([len(value) for value in values], dtype="<i8"))
+                with open(self._segment() / f"{field}.bin", "ab") as f:
+                    f.write(b"".join(values))
+            if self._centroids is not None:
+                self._append("ivf_assign", np.argmax(vectors @ self._centroids.T, axis=1).astype("<i4"))
+
+            meta["count"] = start + len(chunks)
+            self._meta = meta
+            self._mark_dead(dead)
+            self._commit(meta)
+        return len(chunks)
+
+    def _delete_where(self, filters: Dict):
+        with self._lock:
+            self._refresh()
+            count = self._meta["count"]
+            if count == 0:
+                return
+            mask = self._filter_mask(filters, slice(0, count))
+            if mask is None or not mask.any():
+                return
+            self._prepare_write()
+            self._mark_dead(np.flatnonzero(mask))
+            self._commit(dict(self._meta))
+
+    def delete_file_chunks(self, repo_name: str, file_paths: Iterable[str]):
+        self._delete_where({"repo": repo_name, "file_path": list(file_paths)})
+
+    def delete_repo_chunks(self, repo_name: str):
+        self._delete_where({"repo": repo_name})
+
+    def _read_state(self) -> Dict:
+        state_path = self.path / "state.json"
+        if not state_path.exists():
+            return {}
+        with open(state_path) as f:
+            return json.load(f)
+
+    def get_indexed_commit(self, repo_name: str) -> Optional[str]:
+        return self._read_state().get(repo_name, {}).get("commit")
+
+    def set_indexed_commit(self, repo_name: str, commit: str):
+        with self._lock:
+            self.path.mkdir(parents=True, exist_ok=True)
+            state = self._read_state()
+            state[repo_name] = {"commit": commit, "indexed_at": datetime.now(timezone.utc).isoformat()}
+            tmp = self.path / "state.json.tmp"
+            with open(tmp, "w") as f:
+                json.dump(state, f)
+            os.replace(tmp, self.path / "state.json")
+
+    # Search
+
+    def _filter_mask(self, filters: Optional[Dict], rows) -> Optional[np.ndarray]:
+        """
+        Boolean mask of alive rows matching `filters` for `rows` (a slice or
+        an index array), or None if a filter value was never indexed.
+        """
+        mask = self._arrays["alive"][rows] == 1
+        for field, value in (filters or {}).items():
+            if value is None:
+                continue
+            if field not in DICT_FIELDS:
+                raise ValueError(f"Unsupported filter field: {field}")
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            codes = [self._dicts[field].codes[v] for v in values if v in self._dicts[field].codes]
+            if not codes or len(self._arrays[field]) < len(self._arrays["alive"]):
+                # Never indexed, or a column older segments lack
+                return None
+            mask &= np.isin(self._arrays[field][rows], codes)
+        return mask
+
+    def _candidate_rows(self, query: np.ndarray) -> Optional[np.ndarray]:
+        """Rows in the closest IVF lists, or None to scan everything."""
+        if self._centroids is None:
+            return None
+        nprobe = min(LOCAL_INDEX_NPROBE, len(self._centroids))
+        lists = np.argpartition(-(self._centroids @ query), nprobe - 1)[:nprobe]
+        return np.flatnonzero(np.isin(self._arrays["ivf_assign"], lists))
+
+    def _blob(self, field: str, row: int) -> bytes:
+        ends = self._arrays[f"{field}_ends"]
+        if row >= len(ends):
+            # Segment written before this field existed
+            return b""
+        start = int(ends[row - 1]) if row else 0
+        return self._arrays[field][start:int(ends[row])].tobytes()
+
+    def _doc(self, row: int, fields: Optional[Sequence[str]] = None) -> Dict:
+        """Read back one row; only the columns in `fields` are touched."""
+        doc = {}
+        for field in DOC_FIELDS if fields is None else fields:
+            if field in OPTIONAL_FIELDS:
+                column = self._arrays[field]
+                doc[field] = (self._dicts[field].values[column[row]] or None) if row < len(column) else None
+            elif field in DICT_FIELDS:
+                doc[field] = self._dicts[field].values[self._arrays[field][row]]
+            elif field in INT_FIELDS:
+                doc[field] = int(self._arrays[field][row])
+            elif field == "code":
+                doc["code"] = self._blob("code", row).decode("utf-8")
+            elif field == "ast":
+                data = self._blob("ast", row)
+                doc["ast"] = base64.b64encode(data).decode("ascii") if data else None
+        return doc
+
+    def search(
+        self,
+        query_vector: List[float],
+        top_k: int = 5,
+        filters: Optional[Dict] = None,
+        fields: Optional[Sequence[str]] = None,
+    ) -> List[Dict]:
+        query = np.asarray(query_vector, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1
+
+        with self._lock:
+            self._refresh()
+            count = self._meta["count"]
+            if count == 0 or top_k <= 0:
+                return []
+            vectors = self._arrays["vectors"]
+            candidates = self._candidate_rows(query)
+            total = count if candidates is None else len(candidates)
+
+            best_rows = np.zeros(0, dtype=np.int64)
+            best_scores = np.zeros(0, dtype=np.float32)
+            for block_start in range(0, total, _BLOCK_ROWS):
+                block_end = min(block_start + _BLOCK_ROWS, total)
+                if candidates is None:
+                    rows = slice(block_start, block_end)
+                    row_ids = np.arange(block_start, block_end)
+                else:
+                    rows = row_ids = candidates[block_start:block_end]
+                mask = self._filter_mask(filters, rows)
+                if mask is None:
+                    return []
+                if not mask.any():
+                    continue
+                scores = (np.asarray(vectors[rows], dtype=np.float32) @ query)[mask]
+                row_ids = row_ids[mask]
+
+                best_rows = np.concatenate([best_rows, row_ids])
+                best_scores = np.concatenate([best_scores, scores])
+                if len(best_scores) > top_k:
+                    keep = np.argpartition(-best_scores, top_k - 1)[:top_k]
+                    best_rows, best_scores = best_rows[keep], best_scores[keep]
+
+            order = np.argsort(-best_scores)
+            return [self._doc(int(row), fields) for row in best_rows[order]]
+
+    def lexical_search(
+        self,
+        query: str,
+        top_k: int = 5,
+        filters: Optional[Dict] = None,
+        fields: Optional[Sequence[str]] = None,
+    ) -> List[Dict]:
+        """
+        Keyword fallback for lexical and hybrid search: a linear scan scoring
+        sum(log(1 + tf) * idf) of the query terms among the words of each
+        chunk's code, plus LEXICAL_NAME_BOOST when the query is the chunk's
+        name. There is no inverted index, so cost grows with the total code
+        size.
+        """
+        terms = list(dict.fromkeys(term.lower() for term in _TERM_RE.findall(query)))
+        if not terms or top_k <= 0:
+            return []
+
+        with self._lock:
+            self._refresh()
+            count = self._meta["count"]
+            if count == 0:
+                return []
+            mask = self._filter_mask(filters, slice(0, count))
+            if mask is None:
+                return []
+            rows = np.flatnonzero(mask)
+            tf = np.zeros((len(rows), len(terms)), dtype=np.float32)
+            for i, row in enumerate(rows):
+                counts = Counter(_TERM_RE.findall(self._blob("code", int(row)).decode("utf-8").lower()))
+                tf[i] = [counts[term] for term in terms]
+
+            df = (tf > 0).sum(axis=0)
+            idf = np.log1p((len(rows) - df + 0.5) / (df + 0.5))
+            scores = (np.log1p(tf) * idf).sum(axis=1)
+            name_code = self._dicts["name"].codes.get(query.strip())
+            if name_code is not None:
+                scores += LEXICAL_NAME_BOOST * (self._arrays["name"][rows] == name_code)
+
+            matched = np.flatnonzero(scores > 0)
+            if len(matched) > top_k:
+                matched = matched[np.argpartition(-scores[matched], top_k - 1)[:top_k]]
+            order = matched[np.argsort(-scores[matched])]
+            return [self._doc(int(rows[i]), fields) for i in order]
+
+    def browse(
+        self,
+        page_size: int = 100,
+        cursor: Optional[str] = None,
+        filters: Optional[Dict] = None,
+        fields: Optional[Sequence[str]] = None,
+    ) -> Tuple[List[Dict], Optional[str]]:
+        """Alive chunks in storage order; the cursor is the next row to scan."""
+        start = decode_cursor(cursor).get("row", 0)
+        with self._lock:
+            self._refresh()
+            count = self._meta["count"]
+            page: List[Dict] = []
+            row = start
+            while row < count and len(page) < page_size:
+                block = slice(row, min(row + _BLOCK_ROWS, count))
+                mask = self._filter_mask(filters, block)
+                if mask is None:
+                    return [], None
+                for match in np.flatnonzero(mask)[:page_size - len(page)]:
+                    page.append(self._doc(row + int(match), fields))
+                    last = row + int(match)
+                row = last + 1 if len(page) == page_size else block.stop
+            next_state = {"row": row} if len(page) == page_size and row < count else None
+            return page, encode_cursor(next_state)
+
+    # Maintenance
+
+    def build_ivf(self, n_lists: Optional[int] = None, iterations: int = 10, sample_size: int = 100_000, seed: int = 0) -> int:
+        """
+        Cluster the vectors with spherical k-means and assign every row to its
+        nearest centroid, so searches only scan the closest lists. Rows added
+        later are assigned on insert; rebuild after large changes.
+
+        Returns:
+            int: Number of lists
+        """
+        with self._lock:
+            self._refresh()
+            self._prepare_write()
+            count = self._meta["count"]
+            if count == 0:
+                return 0
+            vectors = self._arrays["vectors"]
+            n_lists = n_lists or max(1, int(np.sqrt(count)))
+            rng = np.random.default_rng(seed)
+
+            sample_rows = np.sort(rng.choice(count, size=min(count, sample_size), replace=False))
+            sample = np.asarray(vectors[sample_rows], dtype=np.float32)
+            n_lists = min(n_lists, len(sample))
+            centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)]
+            for _ in range(iterations):
+                assign = np.argmax(sample @ centroids.T, axis=1)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, assign, sample)
+                norms = np.linalg.norm(sums, axis=1, keepdims=True)
+                centroids = np.where(norms > 0, sums / np.where(norms == 0, 1, norms), centroids)
+
+            assign = np.concatenate([
+                np.argmax(np.asarray(vectors[i:i + _BLOCK_ROWS], dtype=np.float32) @ centroids.T, axis=1)
+                for i in range(0, count, _BLOCK_ROWS)
+            ]).astype("<i4")
+            assign.tofile(self._segment() / "ivf_assign.bin")
+            np.save(self._segment() / "ivf_centroids.npy", centroids)
+
+            meta = dict(self._meta)
+            meta["ivf_lists"] = n_lists
+            self._commit(meta)
+            return n_lists
+
+    def compact(self) -> int:
+        """
+        Rewrite the index into a new segment without deleted rows.
+
+        Returns:
+            int: Number of rows kept
+        """
+        with self._lock:
+            self._refresh()
+            old_meta = dict(self._meta)
+            keep = np.flatnonzero(self._arrays["alive"] == 1)
+            segment = f"seg-{int(old_meta['segment'].split('-')[1]) + 1}"
+            new_dir = self.path / segment
+            new_dir.mkdir(parents=True, exist_ok=True)
+
+            blob_ends = {f"{field}_ends" for field in BLOB_FIELDS}
+            for name, (dtype, shape) in self._column_specs(old_meta).items():
+                if name in blob_ends:
+                    continue
+                column = self._arrays[name]
+                if name in DICT_FIELDS and len(column) < old_meta["count"]:
+                    # Never written in this segment
+                    column = np.full(old_meta["count"], self._dicts[name].encode(""), dtype="<i4")
+                np.ascontiguousarray(column[keep]).tofile(new_dir / f"{name}.bin")
+            for field in BLOB_FIELDS:
+                ends = self._arrays[f"{field}_ends"]
+                if len(ends) < old_meta["count"]:
+                    # Never written in this segment
+                    ends = np.zeros(old_meta["count"], dtype="<i8")
+                starts = np.concatenate([[0], ends[:-1]]) if len(ends) else ends
+                blob = self._arrays[field]
+                with open(new_dir / f"{field}.bin", "wb") as f:
+                    for row in keep:
+                        f.write(blob[starts[row]:ends[row]].tobytes())
+                np.cumsum(ends[keep] - starts[keep], dtype="<i8").tofile(new_dir / f"{field}_ends.bin")
+            if self._centroids is not None:
+                np.save(new_dir / "ivf_centroids.npy", self._centroids)
+
+            meta = dict(old_meta)
+            meta["segment"] = segment
+            meta["count"] = len(keep)
+            self._commit(meta)
+            self._ids = None
+            # Readers still holding the old maps keep the files alive until they remap
+            shutil.rmtree(self.path / old_meta["segment"], ignore_errors=True)
+            return len(keep)
+
+    def storage_report(self) -> Dict:
+        """
+        Live chunks, distinct contents and file bytes per live chunk: the
+        vector matrix, code and ASTs, the other columns and the string
+        dictionaries. Deleted rows take space until `compact`.
+        """
+        with self._lock:
+            self._refresh()
+            rows = np.flatnonzero(self._arrays["alive"] == 1) if self._meta["count"] else []
+            chunks = len(rows)
+            contents = len({content_hash(self._blob("code", int(row)).decode("utf-8")) for row in rows})
+            parts = {"vectors": 0, "code": 0, "ast": 0, "columns": 0, "dictionaries": 0}
+            segment = self._segment()
+            for path in segment.iterdir() if segment.exists() else []:
+                part = path.name.split(".")[0].removesuffix("_ends")
+                parts[part if part in parts else "columns"] += path.stat().st_size
+            parts["dictionaries"] = sum(path.stat().st_size for path in self.path.glob("dict_*.jsonl"))
+        total = sum(parts.values())
+        return {
+            "chunks": chunks,
+            "contents": contents,
+            "bytes": total,
+            "bytes_per_chunk": total / chunks if chunks else 0.0,
+            "parts": {part: size / chunks if chunks else 0.0 for part, size in parts.items()},
+            "layout": f"inline/{self._meta['dtype']}",
+        }
@@ -1,16 +1,43 @@
 from fastapi import FastAPI, Query, WebSocket, WebSocketDisconnect, Request
-from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from es_utils import search_by_text
-from summarizer import summarize_code, summarize_code_stream
+import es_utils
+from es_utils import async_browse_chunks, async_search_by_text, async_search_page_by_text
+from jobs import JobQueueFull, JobScheduler
+import metrics
+from processor import decompress_ast
+from pydantic import BaseModel
+from search_backend import get_backend
+from summarizer import asummarize_code, get_async_client, summarize_code_stream, summary_cache
 from datetime import datetime
 import markdown  # Added for markdown to HTML conversion
-import ast
+import asyncio
 import json
+import os
+import time
+from typing import List, Literal, Optional
+
+# Run warm_up() in the background at startup, so the first requests don't
+# pay for creating clients; /ready reports 503 until it has finished
+WARM_UP_ON_STARTUP = os.getenv("WARM_UP_ON_STARTUP", "true").lower() in ("1", "true", "yes")
 
 app = FastAPI()
-templates = Jinja2Templates(directory="templates")
+_templates = None
+_warm_up_seconds: Optional[float] = None
+_warm_up_task: Optional[asyncio.Task] = None
+
+warm_up_seconds = metrics.Histogram("warm_up_seconds", "Time taken by the startup warm-up")
+
+def get_templates():
+    """The Jinja templates, loaded on first use."""
+    global _templates
+    if _templates is None:
+        from fastapi.templating import Jinja2Templates
+        _templates = Jinja2Templates(directory="templates")
+    return _templates
+
+# Request timings and X-Trace-Id propagation to the embedding service
+app.add_middleware(metrics.MetricsMiddleware)
 
 # Mount static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -32,6 +59,43 @@ class ConnectionManager:
 
 manager = ConnectionManager()
 
+# Background index jobs, served by JOB_WORKERS threads in this process
+scheduler = JobScheduler()
+
+async def warm_up():
+    """
+    Create the lazily-initialized resources (templates, search backend,
+    embedding and LLM clients) and check that the backend and the embedding
+    service answer. Failures are reported, not raised: /ready stays 503 and
+    the resources are created again on first use.
+    """
+    global _warm_up_seconds
+    start = time.perf_counter()
+    try:
+        # Imports and client construction block, so keep them off the event loop
+        await asyncio.to_thread(get_templates)
+        backend = await asyncio.to_thread(get_backend)
+        await asyncio.to_thread(get_async_client)
+        await backend.aping()
+        await es_utils.get_async_embedding_client().ready_check()
+    except Exception as e:
+        print(f"Warm-up failed: {e}")
+        return
+    _warm_up_seconds = time.perf_counter() - start
+    warm_up_seconds.observe(_warm_up_seconds)
+    print(f"Warmed up in {_warm_up_seconds:.2f}s")
+
+@app.on_event("startup")
+async def start_warm_up():
+    global _warm_up_task
+    if WARM_UP_ON_STARTUP:
+        _warm_up_task = asyncio.create_task(warm_up())
+
+@app.on_event("shutdown")
+async def close_clients():
+    scheduler.shutdown()
+    await es_utils.aclose()
+
 @app.websocket("/ws/summarizer")
 async def websocket_summarizer(websocket: WebSocket):
     await manager.connect(websocket)
@@ -46,8 +110,7 @@ async def websocket_summarizer(websocket: WebSocket):
                 k = message.get("k", 3)
 
                 # Get search results
-                results = search_by_text(query, top_k=k)
-                formatted_results = [{k: v for k, v in result.items() if k != "embedding"} for result in results]
+                formatted_results = await async_search_by_text(query, top_k=k)
 
                 # Send initial status
                 await websocket.send_text(json.dumps({
@@ -73,43 +136,112 @@ async def websocket_summarizer(websocket: WebSocket):
 
 @app.get("/health")
 async def health():
+    """Liveness: the process serves requests. Never touches a dependency."""
     return {"status": "ok"}
 
+@app.get("/ready")
+async def ready():
+    """Readiness: warmed up, and the search backend and embedding service answer."""
+    checks = {"warm": _warm_up_seconds is not None or not WARM_UP_ON_STARTUP}
+    try:
+        checks["search_backend"] = await get_backend().aping()
+    except Exception:
+        checks["search_backend"] = False
+    checks["embedding_service"] = await es_utils.get_async_embedding_client().ready_check()
+    ok = all(checks.values())
+    body = {"status": "ready" if ok else "not ready", "checks": checks, "warm_up_seconds": _warm_up_seconds}
+    return JSONResponse(body, status_code=200 if ok else 503)
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return {**es_utils.query_cache.stats(), "summaries": summary_cache.stats()}
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+def search_filters(repo: Optional[str] = None, chunk_type: Optional[str] = None, file_path: Optional[str] = None):
+    return {"repo": repo, "type": chunk_type, "file_path": file_path}
 
 @app.get("/search")
-async def search(q: str = Query(..., min_length=3), k: int = 3):
-    # Get search results
-    results = search_by_text(q, top_k=k)
-    formatted_results = [{k: v for k, v in result.items() if k != "embedding"} for result in results]
-
-    return templates.TemplateResponse(
-        "search_results.html",
-        {"request": {}, "query": q, "results": formatted_results}
+async def search(
+    request: Request,
+    q: str = Query(..., min_length=3),
+    k: int = 3,
+    repo: Optional[str] = None,
+    chunk_type: Optional[str] = Query(None, alias="type"),
+    file_path: Optional[str] = None,
+    mode: Optional[Literal["vector", "lexical", "hybrid"]] = None,
+):
+    # Get search results; hits come back without the `embedding` field
+    formatted_results = await async_search_by_text(q, top_k=k, filters=search_filters(repo, chunk_type, file_path), mode=mode)
+
+    return get_templates().TemplateResponse(
+        request, "search_results.html", {"query": q, "results": formatted_results}
     )
 
+@app.get("/search/page")
+async def search_page(
+    q: str = Query(..., min_length=3),
+    size: int = Query(10, ge=1, le=500),
+    cursor: Optional[str] = None,
+    repo: Optional[str] = None,
+    chunk_type: Optional[str] = Query(None, alias="type"),
+    file_path: Optional[str] = None,
+    mode: Optional[Literal["vector", "lexical", "hybrid"]] = None,
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return"),
+):
+    """One page of hits as JSON; pass `next_cursor` back as `cursor` to load more."""
+    try:
+        results, next_cursor = await async_search_page_by_text(
+            q,
+            page_size=size,
+            cursor=cursor,
+            filters=search_filters(repo, chunk_type, file_path),
+            mode=mode,
+            fields=fields.split(",") if fields else None,
+        )
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+    return {"query": q, "results": results, "next_cursor": next_cursor}
+
 @app.get("/summarizer")
-async def summarizer(q: str = Query(..., min_length=3), k: int = 3):
-    # Get search results
-    results = search_by_text(q, top_k=k)
-    formatted_results = [{k: v for k, v in result.items() if k != "embedding"} for result in results]
+async def summarizer(
+    request: Request,
+    q: str = Query(..., min_length=3),
+    k: int = 3,
+    repo: Optional[str] = None,
+    chunk_type: Optional[str] = Query(None, alias="type"),
+    file_path: Optional[str] = None,
+    mode: Optional[Literal["vector", "lexical", "hybrid"]] = None,
+):
+    # Get search results; hits come back without the `embedding` field
+    formatted_results = await async_search_by_text(q, top_k=k, filters=search_filters(repo, chunk_type, file_path), mode=mode)
 
     # Get summary of top 3 results
-    summary = summarize_code(formatted_results, q)
+    summary = await asummarize_code(formatted_results, q)
     summary_html = markdown.markdown(summary, extensions=['fenced_code', 'codehilite']) if summary else ""  # Convert markdown to HTML with extensions
 
-    return templates.TemplateResponse(
-        "search_results.html",
-        {"request": {}, "query": q, "results": formatted_results, "summary": summary_html}
+    return get_templates().TemplateResponse(
+        request, "search_results.html", {"query": q, "results": formatted_results, "summary": summary_html}
     )
 
 @app.get("/summarizer/stream")
-async def summarizer_stream(q: str = Query(..., min_length=3), k: int = 3):
+async def summarizer_stream(
+    q: str = Query(..., min_length=3),
+    k: int = 3,
+    repo: Optional[str] = None,
+    chunk_type: Optional[str] = Query(None, alias="type"),
+    file_path: Optional[str] = None,
+    mode: Optional[Literal["vector", "lexical", "hybrid"]] = None,
+):
     """Stream the summarization process using Server-Sent Events."""
 
     async def generate_summary():
-        # Get search results
-        results = search_by_text(q, top_k=k)
-        formatted_results = [{k: v for k, v in result.items() if k != "embedding"} for result in results]
+        # Get search results; hits come back without the `embedding` field
+        formatted_results = await async_search_by_text(q, top_k=k, filters=search_filters(repo, chunk_type, file_path), mode=mode)
 
         # Send initial data
         yield f"data: {json.dumps({'type': 'start', 'query': q, 'results_count': len(formatted_results)})}\n\n"
@@ -132,87 +264,108 @@ async def summarizer_stream(q: str = Query(..., min_length=3), k: int = 3):
     )
 
 @app.get("/summarizer/streaming-ui")
-async def summarizer_streaming_ui(q: str = Query(..., min_length=3), k: int = 3):
+async def summarizer_streaming_ui(request: Request, q: str = Query(..., min_length=3), k: int = 3):
     """Serve the streaming UI template."""
     # Get search results for display
-    results = search_by_text(q, top_k=k)
-    formatted_results = [{k: v for k, v in result.items() if k != "embedding"} for result in results]
+    formatted_results = await async_search_by_text(q, top_k=k)
 
-    return templates.TemplateResponse(
-        "search_results_streaming.html",
-        {"request": {}, "query": q, "results": formatted_results}
+    return get_templates().TemplateResponse(
+        request, "search_results_streaming.html", {"query": q, "results": formatted_results}
     )
 
 @app.get("/summarizer/websocket-ui")
-async def summarizer_websocket_ui(q: str = Query("", min_length=0), k: int = 3):
+async def summarizer_websocket_ui(request: Request, q: str = Query("", min_length=0), k: int = 3):
     """Serve the WebSocket streaming UI template."""
     # Get search results for display if query is provided
-    results = []
+    formatted_results = []
     if q:
-        results = search_by_text(q, top_k=k)
-    formatted_results = [{k: v for k, v in result.items() if k != "embedding"} for result in results]
+        formatted_results = await async_search_by_text(q, top_k=k)
 
-    return templates.TemplateResponse(
-        "search_results_websocket.html",
-        {"request": {}, "query": q, "results": formatted_results}
+    return get_templates().TemplateResponse(
+        request, "search_results_websocket.html", {"query": q, "results": formatted_results}
     )
 
 @app.get("/")
 async def root(request: Request):
-    return templates.TemplateResponse("index.html", {"request": request})
+    return get_templates().TemplateResponse(request, "index.html")
+
 
+# Fields the AST endpoint reads; `ast` is the tree precomputed at index time
+AST_FIELDS = ["ast", "file_path", "start_line", "end_line", "type"]
 
 @app.get("/ast")
-async def get_ast():
+async def get_ast(
+    repo: Optional[str] = None,
+    file_path: Optional[str] = None,
+    size: int = Query(15, ge=1, le=500),
+    cursor: Optional[str] = None,
+):
+    """
+    Stream the stored ASTs of one page of chunks as a JSON array. The cursor
+    of the next page is returned in the X-Next-Cursor header.
+    """
     try:
-        # Query Elasticsearch for all code chunks using search_by_text
-        results = search_by_text("", top_k=15)  # Empty query for match_all
-
-        # Process each chunk and create AST
-        ast_trees = []
-        for hit in results:
-            try:
-                # Parse the code chunk into AST
-                tree = ast.parse(hit["code"])
-
-                # Convert AST to JSON
-                def ast_to_dict(node):
-                    if isinstance(node, ast.AST):
-                        result = {"type": node.__class__.__name__}
-                        for field in node._fields:
-                            value = getattr(node, field)
-                            if isinstance(value, (list, tuple)):
-                                result[field] = [ast_to_dict(x) for x in value]
-                            elif isinstance(value, ast.AST):
-                                result[field] = ast_to_dict(value)
-                            elif isinstance(value, str):
-                                result[field] = value
-                            elif isinstance(value, (int, float, bool)):
-                                result[field] = str(value)
-                            else:
-                                result[field] = str(value)
-                        return result
-                    return str(node)
-
-                # Add metadata to AST tree
-                ast_json = ast_to_dict(tree)
-                ast_json["metadata"] = {
-                    "file_path": hit["file_path"],
-                    "start_line": hit["start_line"],
-                    "end_line": hit["end_line"],
-                    "type": hit["type"]
-                }
-                ast_trees.append(ast_json)
-            except SyntaxError:
-                continue  # Skip invalid code chunks
-
-        return JSONResponse(ast_trees)
-
+        chunks, next_cursor = await async_browse_chunks(
+            size, cursor, filters={"repo": repo, "file_path": file_path}, fields=AST_FIELDS
+        )
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
 
+    def generate():
+        # A plain generator, so Starlette decompresses off the event loop
+        yield "["
+        separator = ""
+        for chunk in chunks:
+            if not chunk.get("ast"):
+                continue  # Indexed before ASTs were stored; re-index to fill in
+            ast_json = decompress_ast(chunk["ast"])
+            ast_json["metadata"] = {
+                "file_path": chunk["file_path"],
+                "start_line": chunk["start_line"],
+                "end_line": chunk["end_line"],
+                "type": chunk["type"]
+            }
+            yield separator + json.dumps(ast_json)
+            separator = ","
+        yield "]"
+
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    return StreamingResponse(generate(), media_type="application/json", headers=headers)
+
+
+class IndexJobRequest(BaseModel):
+    github_urls: List[str]
+    full: bool = False
+
+@app.post("/jobs", status_code=202)
+async def submit_jobs(request: IndexJobRequest):
+    """Queue index jobs; a repo that is already queued keeps its existing job."""
+    submitted = []
+    for github_url in request.github_urls:
+        try:
+            job, created = scheduler.submit(github_url, full=request.full)
+        except JobQueueFull as e:
+            return JSONResponse({"error": str(e), "submitted": submitted}, status_code=429)
+        submitted.append({**job.to_dict(), "created": created})
+    return {"submitted": submitted}
+
+@app.get("/jobs")
+async def list_jobs(state: Optional[Literal["queued", "running", "succeeded", "failed"]] = None):
+    return {"jobs": [job.to_dict() for job in scheduler.list(state)]}
+
+@app.get("/jobs/stats")
+async def job_stats():
+    return scheduler.stats()
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = scheduler.get(job_id)
+    if job is None:
+        return JSONResponse({"error": f"Unknown job: {job_id}"}, status_code=404)
+    return job.to_dict()
+
 
 @app.get("/ast-visualizer")
-async def ast_visualizer():
+async def ast_visualizer(request: Request):
     """Serve the AST visualizer interface."""
-    return templates.TemplateResponse("ast_visualizer.html", {"request": {}})
+    return get_templates().TemplateResponse(request, "ast_visualizer.html")
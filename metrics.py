@@ -0,0 +1,186 @@
+"""
+In-process metrics in the Prometheus text format, and trace IDs shared
+between the web server and the embedding service.
+
+Histograms and counters are module-level objects registered on creation;
+`render()` returns every one of them for a `/metrics` endpoint.
+`MetricsMiddleware` times each HTTP request and binds its trace ID (taken
+from the X-Trace-Id request header, or generated) to `trace_id`, so
+outgoing calls such as `EmbeddingClient.get_embeddings` can forward it and
+slow requests can be matched up across both services' logs.
+"""
+import contextvars
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+TRACE_HEADER = "X-Trace-Id"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Requests slower than this are printed with their trace ID (0 disables)
+SLOW_REQUEST_SECONDS = float(os.getenv("METRICS_SLOW_REQUEST_SECONDS", 0))
+
+# Seconds; from cache hits to slow LLM generations
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Texts or chunks per batch
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+
+# Trace ID of the request being handled, if any
+trace_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("trace_id", default=None)
+
+_registry: List["_Metric"] = []
+_registry_lock = threading.Lock()
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_str(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(names, values)) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in pairs) + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def _samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def _samples(self) -> Iterator[str]:
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_label_str(self.label_names, key)} {value}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [count per bucket (non-cumulative, last is +Inf), sum]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the seconds spent in the `with` block, even if it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self) -> Iterator[str]:
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                yield f"{self.name}_bucket{_label_str(self.label_names, key, ('le', le))} {cumulative}"
+            yield f"{self.name}_sum{_label_str(self.label_names, key)} {total}"
+            yield f"{self.name}_count{_label_str(self.label_names, key)} {cumulative}"
+
+
+def render() -> str:
+    """Every registered metric, in the Prometheus text exposition format."""
+    with _registry_lock:
+        metrics = list(_registry)
+    return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+def trace_headers() -> Dict[str, str]:
+    """Headers that forward the current trace ID to another service."""
+    current = trace_id.get()
+    return {TRACE_HEADER: current} if current else {}
+
+
+http_request_seconds = Histogram(
+    "http_request_seconds", "HTTP requests, until the last body byte is sent", ["method", "route", "status"]
+)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing every HTTP request (streamed bodies included)
+    into `http_request_seconds`, labelled by route template rather than raw
+    path. It binds the request's trace ID and returns it in X-Trace-Id.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        header = TRACE_HEADER.lower().encode("latin-1")
+        incoming = next((value.decode("latin-1") for name, value in scope.get("headers", []) if name == header), None)
+        current = incoming or uuid.uuid4().hex
+        token = trace_id.set(current)
+        status = 500
+        start = time.perf_counter()
+
+        async def send_with_trace(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message = {**message, "headers": [*message.get("headers", []), (header, current.encode("latin-1"))]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_trace)
+        finally:
+            seconds = time.perf_counter() - start
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            http_request_seconds.observe(seconds, method=scope["method"], route=route, status=status)
+            if SLOW_REQUEST_SECONDS and seconds >= SLOW_REQUEST_SECONDS:
+                print(f"Slow request {scope['method']} {scope['path']} ({status}): {seconds:.3f}s, trace {current}")
+            trace_id.reset(token)
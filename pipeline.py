@@ -0,0 +1,258 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from metrics import SIZE_BUCKETS, Counter, Histogram
+from processor import ChunkRecord, decode_source, embed_records, extract_chunks_from_source, git_blob_sha, link_chunks
+
+# Marks the end of a stage's output on a queue
+_DONE = object()
+
+# Per-item work of each stage: one file for "extract", one batch for "embed"
+# and "write"; the indexer adds once-per-run stages ("checkout", "diff", "delete")
+stage_seconds = Histogram("indexing_stage_seconds", "Work done by an indexing stage per item", ["stage"])
+batch_chunks = Histogram("indexing_batch_chunks", "Chunks per embedding batch", buckets=SIZE_BUCKETS)
+indexed_files = Counter("indexing_files_total", "Files parsed by the indexing pipeline")
+indexed_chunks = Counter("indexing_chunks_total", "Chunks written by the indexing pipeline")
+
+
+@dataclass
+class PipelineConfig:
+    """Sizing knobs for the indexing pipeline."""
+    extract_workers: int = os.cpu_count() or 1
+    batch_size: int = 64
+    writer_workers: int = 2
+    queue_size: int = 8
+
+
+@dataclass
+class PipelineStats:
+    files: int = 0
+    chunks: int = 0
+    batches: int = 0
+    seconds: float = 0.0
+
+
+def _records(data: bytes, rel_path: str, repo_name: str, blob_sha: str) -> List[ChunkRecord]:
+    chunks = link_chunks(extract_chunks_from_source(decode_source(data)), rel_path, repo_name, blob_sha)
+    return [ChunkRecord.from_chunk(chunk) for chunk in chunks]
+
+
+def _extract(path: str, rel_path: str, repo_name: str) -> Tuple[str, List[ChunkRecord], float]:
+    """
+    Process pool entry point: parse one file into linked chunk records. The
+    parse time is returned because metrics recorded in a worker process are
+    never scraped.
+    """
+    start = time.perf_counter()
+    data = Path(path).read_bytes()
+    records = _records(data, rel_path, repo_name, git_blob_sha(data))
+    return rel_path, records, time.perf_counter() - start
+
+
+def _extract_blob(rel_path: str, data: bytes, blob_sha: str, repo_name: str) -> Tuple[str, List[ChunkRecord], float]:
+    """Process pool entry point: parse the contents of one git blob into linked chunk records."""
+    start = time.perf_counter()
+    return rel_path, _records(data, rel_path, repo_name, blob_sha), time.perf_counter() - start
+
+
+def _put(q: queue.Queue, item, stop: threading.Event):
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            continue
+
+
+def _get(q: queue.Queue, stop: threading.Event):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _DONE
+
+
+class IndexingPipeline:
+    """
+    Staged indexing pipeline:
+
+        extract (process pool) -> batch + embed (thread) -> bulk write (threads)
+
+    Stages are connected by bounded queues, so a slow stage applies
+    backpressure to the ones before it instead of buffering the whole repo:
+    at most 2 * extract_workers files are being parsed, queue_size parsed
+    files wait for embedding and queue_size batches wait for a writer,
+    whatever the size of the repo. Chunks travel as `ChunkRecord`s and only
+    become dicts for the batch being written. Embedding batches are filled
+    across file boundaries so the model always sees `batch_size` chunks
+    (except for the final batch).
+
+    `on_file_start(path)` is called before any chunk of a file can be
+    written and `on_file_done(path)` once all of them are (e.g.
+    `CheckpointJournal.start` and `.mark`).
+    """
+
+    def __init__(
+        self,
+        write: Callable[[List[Dict]], None],
+        config: PipelineConfig = None,
+        on_file_start: Optional[Callable[[str], None]] = None,
+        on_file_done: Optional[Callable[[str], None]] = None,
+    ):
+        self.write = write
+        self.config = config or PipelineConfig()
+        self.on_file_start = on_file_start or (lambda path: None)
+        self.on_file_done = on_file_done or (lambda path: None)
+        self.stats = PipelineStats()
+        # Chunks of each file still on their way to the index
+        self._unwritten: Dict[str, int] = {}
+        self._stats_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._errors: List[BaseException] = []
+
+    def run(self, files: Iterable[Path], root: Path, repo_name: str) -> PipelineStats:
+        """
+        Index `files` (paths under `root`) for `repo_name`.
+
+        Raises the first error raised by any stage, after all stages have stopped.
+        """
+        tasks = ((_extract, (str(path), str(path.relative_to(root)), repo_name)) for path in files)
+        return self._run(tasks, repo_name)
+
+    def run_blobs(self, blobs: Iterable[Tuple[str, bytes, str]], repo_name: str) -> PipelineStats:
+        """
+        Index (path, contents, blob SHA) triples for `repo_name`, e.g. read
+        straight from a git object database. `blobs` is consumed lazily, only
+        as fast as the extraction workers take files.
+        """
+        tasks = ((_extract_blob, (*blob, repo_name)) for blob in blobs)
+        return self._run(tasks, repo_name)
+
+    def _run(self, tasks: Iterator[Tuple[Callable, Tuple]], repo_name: str) -> PipelineStats:
+        config = self.config
+        chunk_queue: queue.Queue = queue.Queue(maxsize=config.queue_size)
+        write_queue: queue.Queue = queue.Queue(maxsize=config.queue_size)
+
+        start = time.perf_counter()
+        embedder = threading.Thread(
+            target=self._guard, args=(self._batch_stage, chunk_queue, write_queue), daemon=True
+        )
+        writers = [
+            threading.Thread(target=self._guard, args=(self._write_stage, write_queue), daemon=True)
+            for _ in range(max(1, config.writer_workers))
+        ]
+        embedder.start()
+        for writer in writers:
+            writer.start()
+
+        try:
+            self._extract_stage(tasks, repo_name, chunk_queue)
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            _put(chunk_queue, _DONE, self._stop)
+            embedder.join()
+            for _ in writers:
+                _put(write_queue, _DONE, self._stop)
+            for writer in writers:
+                writer.join()
+
+        self.stats.seconds = time.perf_counter() - start
+        if self._errors:
+            raise self._errors[0]
+        return self.stats
+
+    def _fail(self, error: BaseException):
+        self._errors.append(error)
+        self._stop.set()
+
+    def _guard(self, stage, *args):
+        try:
+            stage(*args)
+        except BaseException as e:
+            self._fail(e)
+
+    def _extract_stage(self, tasks: Iterator[Tuple[Callable, Tuple]], repo_name: str, out: queue.Queue):
+        # Cap in-flight futures so a huge repo doesn't queue every file up front
+        max_pending = max(1, self.config.extract_workers) * 2
+        with ProcessPoolExecutor(max_workers=self.config.extract_workers) as pool:
+            pending = set()
+
+            def drain(return_when):
+                nonlocal pending
+                done, pending = wait(pending, return_when=return_when)
+                for future in done:
+                    rel_path, records, seconds = future.result()
+                    stage_seconds.observe(seconds, stage="extract")
+                    with self._stats_lock:
+                        self.stats.files += 1
+                        if records:
+                            self._unwritten[rel_path] = len(records)
+                    indexed_files.inc()
+                    if records:
+                        self.on_file_start(rel_path)
+                        _put(out, records, self._stop)
+                    else:
+                        self.on_file_done(rel_path)
+
+            for fn, args in tasks:
+                if self._stop.is_set():
+                    break
+                pending.add(pool.submit(fn, *args))
+                if len(pending) >= max_pending:
+                    drain(FIRST_COMPLETED)
+
+            if pending and not self._stop.is_set():
+                drain(ALL_COMPLETED)
+
+            if self._stop.is_set():
+                for future in pending:
+                    future.cancel()
+
+    def _batch_stage(self, inp: queue.Queue, out: queue.Queue):
+        batch_size = max(1, self.config.batch_size)
+        buffer: List[ChunkRecord] = []
+        while True:
+            item = _get(inp, self._stop)
+            if item is _DONE:
+                break
+            buffer.extend(item)
+            while len(buffer) >= batch_size:
+                batch, buffer = buffer[:batch_size], buffer[batch_size:]
+                _put(out, self._embed(batch), self._stop)
+
+        if buffer and not self._stop.is_set():
+            _put(out, self._embed(buffer), self._stop)
+
+    @staticmethod
+    def _embed(batch: List[ChunkRecord]) -> List[ChunkRecord]:
+        batch_chunks.observe(len(batch))
+        with stage_seconds.time(stage="embed"):
+            return embed_records(batch)
+
+    def _write_stage(self, inp: queue.Queue):
+        while True:
+            batch = _get(inp, self._stop)
+            if batch is _DONE:
+                break
+            with stage_seconds.time(stage="write"):
+                self.write([record.to_source() for record in batch])
+            finished = []
+            with self._stats_lock:
+                self.stats.chunks += len(batch)
+                self.stats.batches += 1
+                for record in batch:
+                    self._unwritten[record.file_path] -= 1
+                    if not self._unwritten[record.file_path]:
+                        del self._unwritten[record.file_path]
+                        finished.append(record.file_path)
+            indexed_chunks.inc(len(batch))
+            for path in finished:
+                self.on_file_done(path)
@@ -1,47 +1,318 @@
 import ast
+import base64
+import copy
+import hashlib
+import json
 import os
+import zlib
 from pathlib import Path
-from typing import List, Dict
-from sentence_transformers import SentenceTransformer
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
-model = SentenceTransformer("all-MiniLM-L6-v2")
+import numpy as np
 
-def extract_chunks_from_file(file_path: Path) -> List[Dict]:
-    with open(file_path, "r", encoding="utf-8") as f:
-        source = f.read()
+from search_backend import chunk_id
+
+_model = None
+
+def get_model():
+    """Load the shared embedding model (and its embedding cache) on first use."""
+    global _model
+    if _model is None:
+        from embedding_model import ModelCache
+        _model = ModelCache()
+    return _model
+
+# Token budget of one chunk: all-MiniLM-L6-v2 reads 256 tokens, two of which are [CLS] and [SEP]
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", 254))
+# Lines a window repeats from the end of the one before, for context
+CHUNK_OVERLAP_LINES = int(os.getenv("CHUNK_OVERLAP_LINES", 2))
+# Tokenizer the budget is counted with; should match the embedding model
+CHUNK_TOKENIZER = os.getenv("CHUNK_TOKENIZER", "sentence-transformers/all-MiniLM-L6-v2")
+
+_tokenizer = None
+
+def get_tokenizer():
+    """
+    The model's tokenizer (`tokenizers` only, no torch), loaded once per
+    process, or False if it can't be loaded.
+    """
+    global _tokenizer
+    if _tokenizer is None:
+        try:
+            from tokenizers import Tokenizer
+            _tokenizer = Tokenizer.from_pretrained(CHUNK_TOKENIZER)
+            _tokenizer.no_truncation()
+            _tokenizer.no_padding()
+        except Exception as e:
+            print(f"Counting chunk tokens approximately, tokenizer unavailable: {e}")
+            _tokenizer = False
+    return _tokenizer
+
+def count_tokens(lines: List[str]) -> List[int]:
+    """Model tokens of each line, without special tokens."""
+    tokenizer = get_tokenizer()
+    if tokenizer:
+        return [len(encoding.ids) for encoding in tokenizer.encode_batch(lines, add_special_tokens=False)]
+    # WordPiece averages roughly three characters of code per token
+    return [-(-len("".join(line.split())) // 3) for line in lines]
+
+def ast_to_dict(node):
+    """Convert an AST node into JSON-serializable dicts, as used by the AST visualizer."""
+    if isinstance(node, ast.AST):
+        result = {"type": node.__class__.__name__}
+        for field in node._fields:
+            value = getattr(node, field)
+            if isinstance(value, (list, tuple)):
+                result[field] = [ast_to_dict(x) for x in value]
+            elif isinstance(value, ast.AST):
+                result[field] = ast_to_dict(value)
+            elif isinstance(value, str):
+                result[field] = value
+            else:
+                result[field] = str(value)
+        return result
+    return str(node)
+
+def compress_ast(node: ast.AST) -> str:
+    """
+    The visualizer JSON of a chunk's node, wrapped in a Module as if the
+    chunk's code had been parsed on its own, zlib-compressed and base64
+    encoded (the form of an Elasticsearch `binary` field).
+    """
+    tree = ast_to_dict(ast.Module(body=[node], type_ignores=[]))
+    data = json.dumps(tree, separators=(",", ":")).encode("utf-8")
+    return base64.b64encode(zlib.compress(data)).decode("ascii")
+
+def decompress_ast(data: str) -> Dict:
+    return json.loads(zlib.decompress(base64.b64decode(data)))
 
+def _node_lines(lines: List[bytes], node: ast.AST, first: Optional[int] = None) -> List[Tuple[int, str]]:
+    """(line number, text) of `node`'s source from line `first` (default: its own first line)."""
+    first = first or node.lineno
+    span = lines[first - 1:node.end_lineno]
+    span[-1] = span[-1][:node.end_col_offset]
+    return [(first + i, line.decode("utf-8")) for i, line in enumerate(span)]
+
+def _header_lines(lines: List[bytes], node: ast.AST) -> List[Tuple[int, str]]:
+    """A definition's decorators and signature, up to the line its body starts on."""
+    first = node.decorator_list[0].lineno if node.decorator_list else node.lineno
+    last = max(node.body[0].lineno - 1, node.lineno)
+    return [(no, lines[no - 1].decode("utf-8")) for no in range(first, last + 1)]
+
+def _docstring_node(node: ast.AST) -> Optional[ast.Expr]:
+    body = getattr(node, "body", None)
+    if body and isinstance(body[0], ast.Expr) and isinstance(body[0].value, ast.Constant) \
+            and isinstance(body[0].value.value, str):
+        return body[0]
+    return None
+
+def class_skeleton(lines: List[bytes], node: ast.ClassDef) -> List[Tuple[int, str]]:
+    """
+    The outline of a class: its signature, docstring, class-level
+    assignments and the signature of every method and nested class, each
+    followed by `...`. Method bodies are embedded as chunks of their own.
+    """
+    skeleton = _header_lines(lines, node)
+    docstring = _docstring_node(node)
+    if docstring is not None and docstring.lineno > skeleton[-1][0]:
+        skeleton += _node_lines(lines, docstring)
+    for stmt in node.body:
+        if isinstance(stmt, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            header = _header_lines(lines, stmt)
+            indent = " " * stmt.body[0].col_offset if stmt.body[0].lineno > stmt.lineno else ""
+            skeleton += header + ([(header[-1][0], indent + "...")] if indent else [])
+        elif isinstance(stmt, (ast.Assign, ast.AnnAssign)):
+            skeleton += _node_lines(lines, stmt)
+    return skeleton
+
+def _stub_body(node: ast.AST) -> ast.AST:
+    """A copy of a definition whose body is just `...`."""
+    first = node.body[0]
+    stub = copy.copy(node)
+    stub.body = [ast.copy_location(ast.Expr(value=ast.copy_location(ast.Constant(value=...), first)), first)]
+    return stub
+
+def skeleton_ast(node: ast.ClassDef) -> ast.ClassDef:
+    """
+    The AST of `class_skeleton`: a copy of the class keeping its docstring
+    and class-level assignments, with every method and nested class reduced
+    to its signature and `...`.
+    """
+    skeleton = copy.copy(node)
+    docstring = _docstring_node(node)
+    skeleton.body = [docstring] if docstring is not None else []
+    for stmt in node.body:
+        if isinstance(stmt, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            skeleton.body.append(_stub_body(stmt))
+        elif isinstance(stmt, (ast.Assign, ast.AnnAssign)):
+            skeleton.body.append(stmt)
+    return skeleton if skeleton.body else _stub_body(node)
+
+def windows(line_tokens: List[int], max_tokens: int = CHUNK_MAX_TOKENS, overlap: int = CHUNK_OVERLAP_LINES) -> List[Tuple[int, int]]:
+    """
+    Split lines with the given token counts into [start, end) windows of at
+    most `max_tokens` tokens (a single longer line is a window on its own),
+    each repeating the last `overlap` lines of the one before.
+    """
+    spans = []
+    start = 0
+    while start < len(line_tokens):
+        end, tokens = start, 0
+        while end < len(line_tokens) and (end == start or tokens + line_tokens[end] <= max_tokens):
+            tokens += line_tokens[end]
+            end += 1
+        spans.append((start, end))
+        if end == len(line_tokens):
+            break
+        start = max(end - overlap, start + 1)
+    return spans
+
+def extract_chunks_from_source(source: str) -> Iterator[Dict]:
+    """
+    Yield the chunks of `source`, so that each line is embedded about once:
+
+    - a function or method becomes one chunk with its full code; functions
+      nested in it are part of that code, not chunks of their own
+    - a class becomes a skeleton chunk (see `class_skeleton`), and each of
+      its methods and nested classes a chunk of their own
+    - a chunk longer than CHUNK_MAX_TOKENS model tokens is split into
+      windows on line boundaries. The first window keeps the definition's
+      name and start line; later windows point at it through `parent`.
+
+    `parent` is the (name, start_line) of the enclosing chunk, or None at the
+    top level; `link_chunks` turns it into a `parent_id` once the chunk's
+    file and repo are known. Chunks carry their definition's compressed AST
+    (see `compress_ast`) on their first window, so nothing has to be
+    re-parsed at query time; a class's is that of its skeleton (see
+    `skeleton_ast`).
+    """
     try:
         tree = ast.parse(source)
-    except SyntaxError:
-        return []
-
-    chunks = []
-
-    for node in ast.walk(tree):
-        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
-            start_line = node.lineno - 1
-            end_line = max(
-                [child.lineno for child in ast.walk(node) if hasattr(child, "lineno")],
-                default=start_line
-            )
-            code = "\n".join(source.splitlines()[start_line:end_line])
-            chunks.append({
-                "name": getattr(node, "name", "<unknown>"),
+    except (SyntaxError, ValueError):
+        return
+
+    lines = source.encode("utf-8").split(b"\n")
+
+    def chunks(node, code_lines, parent, tree):
+        spans = windows(count_tokens([text for _, text in code_lines]))
+        for i, (start, end) in enumerate(spans):
+            window = code_lines[start:end]
+            yield {
+                "name": node.name,
                 "type": type(node).__name__,
-                "code": code,
-                "start_line": start_line + 1,
-                "end_line": end_line
-            })
+                "code": "\n".join(text for _, text in window),
+                "start_line": node.lineno if i == 0 else window[0][0],
+                "end_line": node.end_lineno if len(spans) == 1 else window[-1][0],
+                "parent": parent if i == 0 else (node.name, node.lineno),
+                **({"ast": compress_ast(tree)} if i == 0 else {}),
+            }
 
-    return chunks
+    def visit(nodes, parent):
+        for node in nodes:
+            if isinstance(node, ast.ClassDef):
+                yield from chunks(node, class_skeleton(lines, node), parent, skeleton_ast(node))
+                yield from visit(node.body, (node.name, node.lineno))
+            elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                yield from chunks(node, _node_lines(lines, node), parent, node)
+            elif isinstance(node, ast.stmt) or isinstance(node, getattr(ast, "match_case", ())) \
+                    or isinstance(node, ast.excepthandler):
+                # Definitions under if/try/with/... blocks
+                yield from visit(ast.iter_child_nodes(node), parent)
+
+    yield from visit(tree.body, None)
+
+def extract_chunks_from_file(file_path: Path) -> Iterator[Dict]:
+    with open(file_path, "r", encoding="utf-8") as f:
+        source = f.read()
+
+    yield from extract_chunks_from_source(source)
+
+def decode_source(data: bytes) -> str:
+    """Decode file bytes the way `open(..., "r", encoding="utf-8")` reads them."""
+    return data.decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
+
+def git_blob_sha(data: bytes) -> str:
+    """The SHA git gives a file with these contents, so worktree and blob reads agree."""
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+def embed_batch(chunks: List[Dict]) -> List[Dict]:
+    """
+    Embed a batch of chunks in place. The batch may span several files, so
+    each chunk is expected to already carry its `file_path` and `repo`.
+    """
+    if not chunks:
+        return chunks
 
-def embed_chunks(chunks: List[Dict], file_path: str, repo_name: str) -> List[Dict]:
     texts = [chunk["code"] for chunk in chunks]
-    embeddings = model.encode(texts).tolist()
+    # Rows stay float32 arrays; the index client serializes them (a list of
+    # Python floats would take ~10x the memory)
+    embeddings = np.asarray(get_model().encode(texts, batch_size=len(texts)), dtype=np.float32)
+
+    for chunk, embedding in zip(chunks, embeddings):
+        chunk["embedding"] = embedding
+
+    return chunks
 
-    for i, chunk in enumerate(chunks):
-        chunk["embedding"] = embeddings[i]
+def link_chunks(chunks: Iterable[Dict], file_path: str, repo_name: str, blob_sha: Optional[str] = None) -> List[Dict]:
+    """
+    Set the file, repo and source blob SHA of freshly extracted chunks, and
+    replace their `parent` reference with the `parent_id` (see `chunk_id`)
+    of the chunk it names.
+    """
+    chunks = list(chunks)
+    for chunk in chunks:
         chunk["file_path"] = file_path
         chunk["repo"] = repo_name
-
+        chunk["blob_sha"] = blob_sha
+        parent = chunk.pop("parent", None)
+        chunk["parent_id"] = chunk_id(
+            {"repo": repo_name, "file_path": file_path, "name": parent[0], "start_line": parent[1]}
+        ) if parent else None
     return chunks
+
+def embed_chunks(chunks: Iterable[Dict], file_path: str, repo_name: str) -> List[Dict]:
+    return embed_batch(link_chunks(chunks, file_path, repo_name))
+
+class ChunkRecord:
+    """
+    Compact form of a linked chunk while it moves through the indexing
+    pipeline: slots instead of a dict per chunk, pickled between processes
+    as a bare tuple of values, and with its embedding kept as a float32 row
+    until `to_source` hands it to the index.
+    """
+
+    __slots__ = (
+        "name", "type", "code", "start_line", "end_line", "parent_id", "ast", "file_path", "repo", "blob_sha",
+        "embedding",
+    )
+
+    def __init__(self, *values):
+        for field, value in zip(self.__slots__, values):
+            setattr(self, field, value)
+        for field in self.__slots__[len(values):]:
+            setattr(self, field, None)
+
+    @classmethod
+    def from_chunk(cls, chunk: Dict) -> "ChunkRecord":
+        """From a chunk dict, as returned by `link_chunks`."""
+        return cls(*(chunk.get(field) for field in cls.__slots__))
+
+    def __reduce__(self):
+        return ChunkRecord, tuple(getattr(self, field) for field in self.__slots__)
+
+    def to_source(self) -> Dict:
+        """The chunk as an index document; `ast` is left out when absent, as before."""
+        source = {field: getattr(self, field) for field in self.__slots__}
+        if source["ast"] is None:
+            del source["ast"]
+        return source
+
+def embed_records(records: List[ChunkRecord]) -> List[ChunkRecord]:
+    """`embed_batch` for `ChunkRecord`s."""
+    if not records:
+        return records
+
+    embeddings = get_model().encode([record.code for record in records], batch_size=len(records))
+    for record, embedding in zip(records, np.asarray(embeddings, dtype=np.float32)):
+        record.embedding = embedding
+    return records
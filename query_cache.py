@@ -0,0 +1,257 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", 1024))
+QUERY_RESULT_CACHE_SIZE = int(os.getenv("QUERY_RESULT_CACHE_SIZE", 4096))
+# Seconds a cached result set stays valid, even if no write is seen
+QUERY_RESULT_TTL = float(os.getenv("QUERY_RESULT_TTL", 60))
+# Optional shared store (redis://...) so several uvicorn workers share one cache
+QUERY_CACHE_URL = os.getenv("QUERY_CACHE_URL", "")
+
+
+class LRUCache:
+    """Thread-safe LRU map with an optional per-entry TTL and hit/miss counters."""
+
+    def __init__(self, maxsize: int, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and (entry[0] is None or entry[0] > time.monotonic()):
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def set(self, key: str, value):
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+class RedisStore:
+    """Shared second level for `QueryCache`, backed by Redis."""
+
+    def __init__(self, url: str, prefix: str = "repo-indexer:query-cache:"):
+        import redis  # optional dependency
+
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.client.get(self.prefix + key)
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None):
+        self.client.set(self.prefix + key, value, px=int(ttl * 1000) if ttl else None)
+
+    def generation(self) -> int:
+        return int(self.client.get(self.prefix + "generation") or 0)
+
+    def bump_generation(self) -> int:
+        return int(self.client.incr(self.prefix + "generation"))
+
+
+class QueryCache:
+    """
+    Two-tier cache in front of `search_by_text`.
+
+    Tier one maps normalized query text to its query vector (LRU), so a
+    repeated question skips the embedding service. Tier two maps (vector, k,
+    filters, index generation) to the hits (LRU with a TTL), so a repeated
+    search skips the backend too; lexical and hybrid searches add their mode,
+    text and weights to the key as `variant`. `bump_generation` is called on every index
+    write, which makes all cached result sets unreachable. A search reads
+    the generation once, before querying the backend, and passes it to both
+    `get_results` and `set_results`, so hits read before a write are never
+    stored under the generation after it.
+
+    Without a shared store the generation is a counter in this process:
+    writes made by another process (e.g. the indexer CLI) are only seen
+    once the cached results expire after `result_ttl`. With a shared store
+    configured, both tiers fall back to it on a local miss and the
+    generation lives there, so writes from the indexer process invalidate
+    every web worker's results.
+    """
+
+    def __init__(
+        self,
+        vector_cache_size: int = QUERY_CACHE_SIZE,
+        result_cache_size: int = QUERY_RESULT_CACHE_SIZE,
+        result_ttl: float = QUERY_RESULT_TTL,
+        shared_url: str = QUERY_CACHE_URL,
+    ):
+        self.vectors = LRUCache(vector_cache_size)
+        self.results = LRUCache(result_cache_size, ttl=result_ttl)
+        self.result_ttl = result_ttl
+        self.shared = RedisStore(shared_url) if shared_url else None
+        self._generation = 0
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        # The embedding model lowercases its input, so case doesn't change the vector
+        return " ".join(query.lower().split())
+
+    def generation(self) -> int:
+        return self.shared.generation() if self.shared else self._generation
+
+    async def ageneration(self) -> int:
+        if not self.shared:
+            return self._generation
+        return await asyncio.get_running_loop().run_in_executor(None, self.generation)
+
+    def bump_generation(self):
+        self._generation += 1
+        self.results.clear()
+        if self.shared:
+            self.shared.bump_generation()
+
+    def _vector_key(self, query: str) -> str:
+        return "v:" + hashlib.sha1(self.normalize(query).encode("utf-8")).hexdigest()
+
+    def _result_key(
+        self,
+        query_vector: Optional[List[float]],
+        top_k: int,
+        filters: Optional[Dict],
+        generation: int,
+        variant: Optional[Dict] = None,
+    ) -> str:
+        digest = hashlib.sha1()
+        if query_vector is not None:
+            digest.update(np.asarray(query_vector, dtype=np.float32).tobytes())
+        key_parts = [top_k, filters or {}, generation]
+        if variant:
+            key_parts.append(variant)
+        digest.update(json.dumps(key_parts, sort_keys=True, default=list).encode("utf-8"))
+        return "r:" + digest.hexdigest()
+
+    # Sync API
+
+    def get_vector(self, query: str) -> Optional[List[float]]:
+        key = self._vector_key(query)
+        vector = self.vectors.get(key)
+        if vector is None and self.shared:
+            raw = self.shared.get(key)
+            if raw is not None:
+                vector = np.frombuffer(raw, dtype="<f4").tolist()
+                self.vectors.set(key, vector)
+        return vector
+
+    def set_vector(self, query: str, vector: List[float]):
+        key = self._vector_key(query)
+        self.vectors.set(key, vector)
+        if self.shared:
+            self.shared.set(key, np.asarray(vector, dtype="<f4").tobytes())
+
+    def get_results(
+        self,
+        query_vector: Optional[List[float]],
+        top_k: int,
+        filters: Optional[Dict],
+        generation: int,
+        variant: Optional[Dict] = None,
+    ) -> Optional[List[Dict]]:
+        key = self._result_key(query_vector, top_k, filters, generation, variant)
+        hits = self.results.get(key)
+        if hits is None and self.shared:
+            raw = self.shared.get(key)
+            if raw is not None:
+                hits = json.loads(raw)
+                self.results.set(key, hits)
+        return hits
+
+    def set_results(
+        self,
+        query_vector: Optional[List[float]],
+        top_k: int,
+        filters: Optional[Dict],
+        hits: List[Dict],
+        generation: int,
+        variant: Optional[Dict] = None,
+    ):
+        key = self._result_key(query_vector, top_k, filters, generation, variant)
+        self.results.set(key, hits)
+        if self.shared:
+            self.shared.set(key, json.dumps(hits).encode("utf-8"), self.result_ttl)
+
+    # Async API: the local tier is checked inline, the shared store off the event loop
+
+    async def aget_vector(self, query: str) -> Optional[List[float]]:
+        if not self.shared:
+            return self.get_vector(query)
+        return await asyncio.get_running_loop().run_in_executor(None, self.get_vector, query)
+
+    async def aset_vector(self, query: str, vector: List[float]):
+        if not self.shared:
+            return self.set_vector(query, vector)
+        await asyncio.get_running_loop().run_in_executor(None, self.set_vector, query, vector)
+
+    async def aget_results(
+        self,
+        query_vector: Optional[List[float]],
+        top_k: int,
+        filters: Optional[Dict],
+        generation: int,
+        variant: Optional[Dict] = None,
+    ) -> Optional[List[Dict]]:
+        if not self.shared:
+            return self.get_results(query_vector, top_k, filters, generation, variant)
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.get_results, query_vector, top_k, filters, generation, variant
+        )
+
+    async def aset_results(
+        self,
+        query_vector: Optional[List[float]],
+        top_k: int,
+        filters: Optional[Dict],
+        hits: List[Dict],
+        generation: int,
+        variant: Optional[Dict] = None,
+    ):
+        if not self.shared:
+            return self.set_results(query_vector, top_k, filters, hits, generation, variant)
+        await asyncio.get_running_loop().run_in_executor(
+            None, self.set_results, query_vector, top_k, filters, hits, generation, variant
+        )
+
+    def stats(self) -> Dict:
+        return {
+            "query_vectors": self.vectors.stats(),
+            "search_results": self.results.stats(),
+            "generation": self._generation,
+            "shared": self.shared is not None,
+        }
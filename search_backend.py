@@ -0,0 +1,366 @@
+import asyncio
+import base64
+import hashlib
+import importlib
+import json
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# SEARCH_ENGINE_FLAVOR -> "module:class" of the backend serving it
+BACKENDS = {
+    "elasticsearch": "es_utils:ElasticsearchBackend",
+    "opensearch": "es_utils:ElasticsearchBackend",
+    "local": "local_index:LocalBackend",
+}
+
+# Rank constant of reciprocal rank fusion; larger values flatten the rank curve
+RRF_K = int(os.getenv("RRF_K", 60))
+# Hits fetched from each ranking before fusing them
+RRF_RANK_WINDOW = int(os.getenv("RRF_RANK_WINDOW", 50))
+
+# Fields `chunk_id` is computed from; searches that fuse or page results need them
+CHUNK_ID_FIELDS = ("repo", "file_path", "name", "start_line")
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def chunk_id(chunk: Dict) -> str:
+    """
+    Deterministic document ID for a chunk, so re-indexing the same chunk
+    overwrites it instead of adding a duplicate.
+    """
+    key = "\x1f".join(str(chunk.get(field, "")) for field in CHUNK_ID_FIELDS)
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def content_hash(code: str) -> str:
+    """
+    Key of a chunk's content: chunks with the same code get the same
+    embedding wherever they occur, so they can share one stored vector.
+    """
+    return hashlib.sha1(code.encode("utf-8")).hexdigest()
+
+
+def reciprocal_rank_fusion(
+    rankings: Sequence[List[Dict]],
+    weights: Sequence[float],
+    top_k: int,
+    k: int = RRF_K,
+) -> List[Dict]:
+    """
+    Fuse ranked hit lists: each hit scores sum(weight / (k + rank)) over the
+    rankings it appears in, and hits are matched by `chunk_id`.
+    """
+    scores: Dict[str, float] = {}
+    docs: Dict[str, Dict] = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, doc in enumerate(ranking, 1):
+            key = chunk_id(doc)
+            scores[key] = scores.get(key, 0.0) + weight / (k + rank)
+            docs.setdefault(key, doc)
+    ranked = sorted(scores, key=scores.__getitem__, reverse=True)[:top_k]
+    return [docs[key] for key in ranked]
+
+
+def with_id_fields(fields: Optional[Sequence[str]]) -> Optional[List[str]]:
+    """`fields` plus CHUNK_ID_FIELDS, or None (all fields) if `fields` is None."""
+    if fields is None:
+        return None
+    return list(dict.fromkeys([*fields, *CHUNK_ID_FIELDS]))
+
+
+def project(docs: List[Dict], fields: Optional[Sequence[str]]) -> List[Dict]:
+    """Drop everything but `fields` from each doc; no-op if `fields` is None."""
+    if fields is None:
+        return docs
+    return [{field: doc[field] for field in fields if field in doc} for doc in docs]
+
+
+def encode_cursor(state: Optional[Dict]) -> Optional[str]:
+    """Opaque, URL-safe page cursor for `SearchBackend.search_page`."""
+    if state is None:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(state, separators=(",", ":")).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: Optional[str]) -> Dict:
+    if not cursor:
+        return {}
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except ValueError:
+        raise ValueError("Invalid page cursor")
+
+
+class SearchBackend:
+    """
+    Storage and vector search for code chunks.
+
+    `es_utils.ensure_index`, `index_chunks`, `search_by_text` and friends
+    delegate to the backend selected by SEARCH_ENGINE_FLAVOR.
+    """
+
+    def ensure_index(self):
+        raise NotImplementedError
+
+    def index_chunks(self, chunks: Iterable[Dict]) -> int:
+        """Upsert chunks (keyed by `chunk_id`); returns the number written."""
+        raise NotImplementedError
+
+    def delete_file_chunks(self, repo_name: str, file_paths: Iterable[str]):
+        raise NotImplementedError
+
+    def delete_repo_chunks(self, repo_name: str):
+        raise NotImplementedError
+
+    def get_indexed_commit(self, repo_name: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def set_indexed_commit(self, repo_name: str, commit: str):
+        raise NotImplementedError
+
+    def get_file_blobs(self, repo_name: str) -> Dict[str, Optional[str]]:
+        """
+        Map each indexed file of a repo to the git blob SHA its chunks were
+        extracted from (None if unknown, or if its chunks disagree).
+        """
+        blobs: Dict[str, Optional[str]] = {}
+        cursor = None
+        while True:
+            page, cursor = self.browse(1000, cursor, {"repo": repo_name}, ["file_path", "blob_sha"])
+            for doc in page:
+                path, sha = doc["file_path"], doc.get("blob_sha")
+                blobs[path] = sha if blobs.get(path, sha) == sha else None
+            if cursor is None:
+                return blobs
+
+    def storage_report(self) -> Dict:
+        """
+        Stored chunks, distinct chunk contents and bytes per chunk, overall
+        and by part (see the backends for the exact keys).
+        """
+        raise NotImplementedError
+
+    # Searches return source documents, best first. `fields` limits the
+    # returned fields; by default everything but `embedding` and `ast` is
+    # returned.
+
+    def search(
+        self,
+        query_vector: List[float],
+        top_k: int = 5,
+        filters: Optional[Dict] = None,
+        fields: Optional[Sequence[str]] = None,
+    ) -> List[Dict]:
+        """Nearest chunks to `query_vector`."""
+        raise NotImplementedError
+
+    async def asearch(
+        self,
+        query_vector: List[float],
+        top_k: int = 5,
+        filters: Optional[Dict] = None,
+        fields: Optional[Sequence[str]] = None,
+    ) -> List[Dict]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.search, query_vector, top_k, filters, fields)
+
+    def lexical_search(
+        self,
+        query: str,
+        top_k: int = 5,
+        filters: Optional[Dict] = None,
+        fields: Optional[Sequence[str]] = None,
+    ) -> List[Dict]:
+        """Best keyword matches of `query` on chunk code and names."""
+        raise NotImplementedError
+
+    async def alexical_search(
+        self,
+        query: str,
+        top_k: int = 5,
+        filters: Optional[Dict] = None,
+        fields: Optional[Sequence[str]] = None,
+    ) -> List[Dict]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.lexical_search, query, top_k, filters, fields)
+
+    def hybrid_search(
+        self,
+        query: str,
+        query_vector: List[float],
+        top_k: int = 5,
+        filters: Optional[Dict] = None,
+        weights: Tuple[float, float] = (1.0, 1.0),
+        fields: Optional[Sequence[str]] = None,
+    ) -> List[Dict]:
+        """
+        Lexical and vector rankings fused with `reciprocal_rank_fusion`;
+        `weights` are (lexical, vector).
+        """
+        window = max(top_k, RRF_RANK_WINDOW)
+        id_fields = with_id_fields(fields)
+        rankings = [
+            self.lexical_search(query, window, filters, id_fields),
+            self.search(query_vector, window, filters, id_fields),
+        ]
+        return project(reciprocal_rank_fusion(rankings, weights, top_k), fields)
+
+    async def ahybrid_search(
+        self,
+        query: str,
+        query_vector: List[float],
+        top_k: int = 5,
+        filters: Optional[Dict] = None,
+        weights: Tuple[float, float] = (1.0, 1.0),
+        fields: Optional[Sequence[str]] = None,
+    ) -> List[Dict]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, self.hybrid_search, query, query_vector, top_k, filters, weights, fields
+        )
+
+    def run_search(
+        self,
+        mode: str,
+        query: str,
+        query_vector: Optional[List[float]],
+        top_k: int = 5,
+        filters: Optional[Dict] = None,
+        weights: Tuple[float, float] = (1.0, 1.0),
+        fields: Optional[Sequence[str]] = None,
+    ) -> List[Dict]:
+        """Dispatch to the "vector", "lexical" or "hybrid" search."""
+        if mode == "vector":
+            return self.search(query_vector, top_k, filters, fields)
+        if mode == "lexical":
+            return self.lexical_search(query, top_k, filters, fields)
+        if mode == "hybrid":
+            return self.hybrid_search(query, query_vector, top_k, filters, weights, fields)
+        raise ValueError(f"Unsupported search mode: {mode}")
+
+    async def arun_search(
+        self,
+        mode: str,
+        query: str,
+        query_vector: Optional[List[float]],
+        top_k: int = 5,
+        filters: Optional[Dict] = None,
+        weights: Tuple[float, float] = (1.0, 1.0),
+        fields: Optional[Sequence[str]] = None,
+    ) -> List[Dict]:
+        if mode == "vector":
+            return await self.asearch(query_vector, top_k, filters, fields)
+        if mode == "lexical":
+            return await self.alexical_search(query, top_k, filters, fields)
+        if mode == "hybrid":
+            return await self.ahybrid_search(query, query_vector, top_k, filters, weights, fields)
+        raise ValueError(f"Unsupported search mode: {mode}")
+
+    def search_page(
+        self,
+        mode: str,
+        query: str,
+        query_vector: Optional[List[float]],
+        page_size: int = 10,
+        cursor: Optional[str] = None,
+        filters: Optional[Dict] = None,
+        weights: Tuple[float, float] = (1.0, 1.0),
+        fields: Optional[Sequence[str]] = None,
+    ) -> Tuple[List[Dict], Optional[str]]:
+        """
+        One page of results and the cursor of the next page (None after the
+        last one). Pass the returned cursor back with the same query to
+        continue.
+
+        This default re-runs the search for offset + page_size hits and
+        slices; backends with a cheaper way to resume override it.
+        """
+        offset = decode_cursor(cursor).get("offset", 0)
+        page = self.run_search(mode, query, query_vector, offset + page_size, filters, weights, fields)[offset:]
+        next_state = {"offset": offset + len(page)} if len(page) == page_size else None
+        return page, encode_cursor(next_state)
+
+    async def asearch_page(
+        self,
+        mode: str,
+        query: str,
+        query_vector: Optional[List[float]],
+        page_size: int = 10,
+        cursor: Optional[str] = None,
+        filters: Optional[Dict] = None,
+        weights: Tuple[float, float] = (1.0, 1.0),
+        fields: Optional[Sequence[str]] = None,
+    ) -> Tuple[List[Dict], Optional[str]]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, self.search_page, mode, query, query_vector, page_size, cursor, filters, weights, fields
+        )
+
+    def browse(
+        self,
+        page_size: int = 100,
+        cursor: Optional[str] = None,
+        filters: Optional[Dict] = None,
+        fields: Optional[Sequence[str]] = None,
+    ) -> Tuple[List[Dict], Optional[str]]:
+        """
+        Stored chunks in a stable, unranked order, one page at a time, and
+        the cursor of the next page (None after the last one).
+        """
+        raise NotImplementedError
+
+    async def abrowse(
+        self,
+        page_size: int = 100,
+        cursor: Optional[str] = None,
+        filters: Optional[Dict] = None,
+        fields: Optional[Sequence[str]] = None,
+    ) -> Tuple[List[Dict], Optional[str]]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.browse, page_size, cursor, filters, fields)
+
+    @contextmanager
+    def bulk_load(self):
+        """Tune the store for a large load for the duration of the block."""
+        yield
+
+    def ping(self) -> bool:
+        """Whether the store is reachable; in-process stores always are."""
+        return True
+
+    async def aping(self) -> bool:
+        return self.ping()
+
+    async def aclose(self):
+        pass
+
+
+def get_backend() -> SearchBackend:
+    """Return the process-wide backend, creating it on first use."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                flavor = os.getenv("SEARCH_ENGINE_FLAVOR", "elasticsearch")
+                if flavor not in BACKENDS:
+                    raise ValueError(f"Unsupported search engine flavor: {flavor}")
+                module_name, class_name = BACKENDS[flavor].split(":")
+                _backend = getattr(importlib.import_module(module_name), class_name)()
+    return _backend
+
+
+def set_backend(backend: Optional[SearchBackend]):
+    """Replace the process-wide backend (None: create it again on next use)."""
+    global _backend
+    with _backend_lock:
+        _backend = backend
+
+
+async def close_backend():
+    """Close the backend if one was created."""
+    if _backend is not None:
+        await _backend.aclose()
@@ -4,6 +4,10 @@ document.addEventListener('DOMContentLoaded', function() {
     // State
     let astData = [];
     let currentTreeIndex = 0;
+    // Cursor of the next page of ASTs, null once everything is loaded
+    let nextCursor = null;
+    // repo / file_path filters are taken from the page URL
+    const pageParams = new URLSearchParams(window.location.search);
     
     // DOM elements
     const loadingEl = document.getElementById('loading');
@@ -56,13 +60,24 @@ document.addEventListener('DOMContentLoaded', function() {
     loadAstData();
 
     // Functions
+    async function fetchAstPage(cursor) {
+        const params = new URLSearchParams();
+        for (const key of ['repo', 'file_path', 'size']) {
+            if (pageParams.get(key)) params.set(key, pageParams.get(key));
+        }
+        if (cursor) params.set('cursor', cursor);
+
+        const response = await fetch(`/ast?${params}`);
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        nextCursor = response.headers.get('X-Next-Cursor');
+        return response.json();
+    }
+
     async function loadAstData() {
         try {
-            const response = await fetch('/ast');
-            if (!response.ok) {
-                throw new Error(`HTTP error! status: ${response.status}`);
-            }
-            astData = await response.json();
+            astData = await fetchAstPage(null);
             
             if (!astData || astData.length === 0) {
                 throw new Error('No AST data available');
@@ -93,7 +108,16 @@ document.addEventListener('DOMContentLoaded', function() {
         visualizeTree(currentTreeIndex);
     }
 
-    function showNextTree() {
+    async function showNextTree() {
+        if (currentTreeIndex === astData.length - 1 && nextCursor) {
+            // Load the next page before moving past the last loaded tree
+            nextBtn.disabled = true;
+            try {
+                astData = astData.concat(await fetchAstPage(nextCursor));
+            } catch (error) {
+                showError(`Failed to load more AST data: ${error.message}`);
+            }
+        }
         if (astData.length <= 1) return;
         currentTreeIndex = (currentTreeIndex + 1) % astData.length;
         visualizeTree(currentTreeIndex);
@@ -106,17 +130,17 @@ document.addEventListener('DOMContentLoaded', function() {
         nodeTypeEl.textContent = metadata.type || '-';
         
         // Update tree counter
-        treeCounterEl.textContent = `${currentTreeIndex + 1} of ${astData.length}`;
+        treeCounterEl.textContent = `${currentTreeIndex + 1} of ${astData.length}${nextCursor ? '+' : ''}`;
         
         // Update button states
         prevBtn.disabled = astData.length <= 1;
-        nextBtn.disabled = astData.length <= 1;
+        nextBtn.disabled = astData.length <= 1 && !nextCursor;
     }
 
     function visualizeTree(index) {
         if (index < 0 || index >= astData.length) return;
         
-        const treeItem = astData;
+        const treeItem = astData[index];
         
         // Update metadata
         if (treeItem.metadata) {
@@ -1,16 +1,40 @@
 import os
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 from dotenv import load_dotenv
-from openai import OpenAI
 import asyncio
+import time
+
+from metrics import Counter, Histogram
+from summary_cache import SummaryCache
 
 load_dotenv()
 
 INFERENCE_MODEL = os.getenv("OPENAI_MODEL", "openhermes-2.5-mistral-7b")
-client = OpenAI(
-    base_url=os.getenv("OPENAI_HOST", "http://localhost:1234/v1"),
-    api_key=os.getenv("OPENAI_API_KEY", "lmstudio")
+# Seconds to wait on the LLM before giving up on a request
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", 60))
+# OpenAI clients, created on first use by get_client()/get_async_client();
+# importing openai alone takes about half a second
+client = None
+async_client = None
+
+# Finished summaries, and generations in flight shared by identical requests
+summary_cache = SummaryCache()
+
+summarize_seconds = Histogram(
+    "summarize_seconds", "Summaries from request to last chunk, cache hits included", ["entry"]
+)
+summarize_first_chunk_seconds = Histogram(
+    "summarize_first_chunk_seconds", "Time until a streamed summary yields its first chunk", ["entry"]
 )
+llm_seconds = Histogram("llm_seconds", "LLM completions, until the last token", ["call"])
+llm_first_token_seconds = Histogram("llm_first_token_seconds", "Time to the first token of a streamed LLM completion")
+llm_stream_chunks = Counter("llm_stream_chunks_total", "Content chunks received from streamed LLM completions")
+
+PROMPT_TEMPLATE = """Please analyze the following code snippets.
+    Provide a single summary that captures the essence of the code snippets.
+    Brief is better than long.
+    Code snippets:
+    """
 
 def summarize_code(results, query):
     """
@@ -26,35 +50,28 @@ def summarize_code(results, query):
     if not results:
         return "No results found for the search query."
 
-    # Take top 3 results
-    top_results = results[:3]
-
-    # Create a prompt for summarization
-    prompt_1 = f"""You are a helpful code assistant. Please analyze the following code snippets
-    and provide a concise summary of their key functionality and relevance to the query: "{query}".
+    with summarize_seconds.time(entry="sync"):
+        return _summarize_code(results, query)
 
-    Provide a single summary that captures the essence of the code snippets.
 
-    Code snippets:
-    """
-    prompt_2 = """Please analyze the following code snippets.
-    Provide a single summary that captures the essence of the code snippets, and a code example if you can.
-    Code snippets:
-    """
-    prompt_3 = """Please analyze the following code snippets.
-    Provide a single summary that captures the essence of the code snippets.
-    Brief is better than long.
-    Code snippets:
-    """
-    prompt = prompt_3
+def _summarize_code(results, query):
+    # Take top 3 results
+    top_results = results[:3]
 
-    for idx, result in enumerate(top_results, 1):
-        prompt += f"\n\n## Code Snippet {idx}\n\nFile: {result.get('file_path', 'Unknown')} Type: {result.get('type', 'Unknown')} \n{result.get('code', '')}"
+    prompt = build_prompt(top_results)
+    # Keyed like the async paths, so all of them share entries
+    cache_key = summary_cache.key(INFERENCE_MODEL, PROMPT_TEMPLATE, top_results)
+    cached = summary_cache.get(cache_key)
+    if cached is not None:
+        return cached
 
     try:
-        response = query_model(prompt)
+        with llm_seconds.time(call="sync"):
+            response = query_model(prompt)
 
-        return response.choices[0].message.content
+        summary = response.choices[0].message.content
+        summary_cache.set(cache_key, summary)
+        return summary
 
     except Exception as e:
         return f"Error generating summary: {str(e)}"
@@ -75,31 +92,85 @@ async def summarize_code_stream(results, query):
         yield "No results found for the search query."
         return
 
-    # Take top 3 results
+    # Take top 3 results and build the prompt
+    start = time.perf_counter()
     top_results = results[:3]
+    prompt = build_prompt(top_results)
+    cache_key = summary_cache.key(INFERENCE_MODEL, PROMPT_TEMPLATE, top_results)
 
-    # Create a prompt for summarization
-    prompt_3 = """Please analyze the following code snippets.
-    Provide a single summary that captures the essence of the code snippets.
-    Brief is better than long.
-    Code snippets:
+    first = True
+    try:
+        # Served from the cache, or shared with identical requests in flight
+        async for chunk in summary_cache.stream(cache_key, lambda: query_model_stream(prompt)):
+            if first:
+                summarize_first_chunk_seconds.observe(time.perf_counter() - start, entry="stream")
+                first = False
+            yield chunk
+
+    except Exception as e:
+        yield f"Error generating summary: {str(e)}"
+    finally:
+        summarize_seconds.observe(time.perf_counter() - start, entry="stream")
+
+
+async def asummarize_code(results, query):
     """
-    prompt = prompt_3
+    Async version of `summarize_code`, for use on the event loop.
 
-    for idx, result in enumerate(top_results, 1):
-        prompt += f"\n\n## Code Snippet {idx}\n\nFile: {result.get('file_path', 'Unknown')} Type: {result.get('type', 'Unknown')} \n{result.get('code', '')}"
+    Args:
+        results (list): List of search results
+        query (str): The original search query
+
+    Returns:
+        str: Summary of the top results
+    """
+    if not results:
+        return "No results found for the search query."
+
+    top_results = results[:3]
+    prompt = build_prompt(top_results)
+    cache_key = summary_cache.key(INFERENCE_MODEL, PROMPT_TEMPLATE, top_results)
 
     try:
-        async for chunk in query_model_stream(prompt):
-            yield chunk
+        # Shares the generation with streaming requests for the same results
+        with summarize_seconds.time(entry="async"):
+            return await summary_cache.get_or_generate(cache_key, lambda: query_model_stream(prompt))
 
     except Exception as e:
-        yield f"Error generating summary: {str(e)}"
+        return f"Error generating summary: {str(e)}"
 
 
 ### helpers
+def get_client():
+    global client
+    if client is None:
+        from openai import OpenAI
+        client = OpenAI(
+            base_url=os.getenv("OPENAI_HOST", "http://localhost:1234/v1"),
+            api_key=os.getenv("OPENAI_API_KEY", "lmstudio"),
+            timeout=OPENAI_TIMEOUT,
+        )
+    return client
+
+def get_async_client():
+    global async_client
+    if async_client is None:
+        from openai import AsyncOpenAI
+        async_client = AsyncOpenAI(
+            base_url=os.getenv("OPENAI_HOST", "http://localhost:1234/v1"),
+            api_key=os.getenv("OPENAI_API_KEY", "lmstudio"),
+            timeout=OPENAI_TIMEOUT,
+        )
+    return async_client
+
+def build_prompt(top_results):
+    prompt = PROMPT_TEMPLATE
+    for idx, result in enumerate(top_results, 1):
+        prompt += f"\n\n## Code Snippet {idx}\n\nFile: {result.get('file_path', 'Unknown')} Type: {result.get('type', 'Unknown')} \n{result.get('code', '')}"
+    return prompt
+
 def query_model(prompt):
-    return client.chat.completions.create(
+    return get_client().chat.completions.create(
             model=INFERENCE_MODEL,
             messages=[
                 {"role": "system", "content": "You are a helpful code assistant."},
@@ -110,9 +181,14 @@ def query_model(prompt):
         )
 
 async def query_model_stream(prompt):
-    """Stream the model response chunk by chunk."""
+    """
+    Stream the model response chunk by chunk. Errors are raised rather than
+    yielded, so a failed generation is never cached as a summary.
+    """
+    start = time.perf_counter()
+    first = True
     try:
-        stream = client.chat.completions.create(
+        stream = await get_async_client().chat.completions.create(
             model=INFERENCE_MODEL,
             messages=[
                 {"role": "system", "content": "You are a helpful code assistant."},
@@ -123,12 +199,15 @@ async def query_model_stream(prompt):
             stream=True
         )
 
-        for chunk in stream:
-            if chunk.choices[0].delta.content is not None:
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content is not None:
+                if first:
+                    llm_first_token_seconds.observe(time.perf_counter() - start)
+                    first = False
+                llm_stream_chunks.inc()
                 yield chunk.choices[0].delta.content
-
-    except Exception as e:
-        yield f"Error in streaming: {str(e)}"
+    finally:
+        llm_seconds.observe(time.perf_counter() - start, call="stream")
 
 def get_content(response):
     return response.choices[0].message.content
\ No newline at end of file
@@ -0,0 +1,137 @@
+import asyncio
+import hashlib
+import os
+from typing import AsyncIterator, Callable, Dict, List, Optional
+
+from query_cache import LRUCache
+from search_backend import chunk_id
+
+SUMMARY_CACHE_SIZE = int(os.getenv("SUMMARY_CACHE_SIZE", 512))
+# Seconds a summary is reused before it is generated again
+SUMMARY_CACHE_TTL = float(os.getenv("SUMMARY_CACHE_TTL", 600))
+
+
+class Broadcast:
+    """
+    One upstream token stream fanned out to any number of subscribers.
+
+    Every token is buffered, so a subscriber that joins late first replays
+    what was already generated and then follows the live stream. The
+    upstream keeps running when subscribers disconnect, so its result can
+    still be cached.
+    """
+
+    def __init__(self, source: AsyncIterator[str]):
+        self.tokens: List[str] = []
+        self.done = False
+        # The upstream ran to its end; only then is `tokens` the whole summary
+        self.completed = False
+        self.error: Optional[BaseException] = None
+        self._changed = asyncio.Condition()
+        self.task = asyncio.get_running_loop().create_task(self._pump(source))
+
+    async def _pump(self, source: AsyncIterator[str]):
+        try:
+            async for token in source:
+                self.tokens.append(token)
+                async with self._changed:
+                    self._changed.notify_all()
+            self.completed = True
+        except Exception as e:
+            self.error = e
+        except BaseException as e:
+            # Cancelled: subscribers must not mistake the tokens so far for the summary
+            self.error = RuntimeError("Summary generation was cancelled")
+            self.error.__cause__ = e
+            raise
+        finally:
+            self.done = True
+            async with self._changed:
+                self._changed.notify_all()
+
+    async def subscribe(self) -> AsyncIterator[str]:
+        position = 0
+        while True:
+            while position < len(self.tokens):
+                yield self.tokens[position]
+                position += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            async with self._changed:
+                await self._changed.wait_for(lambda: position < len(self.tokens) or self.done)
+
+
+class SummaryCache:
+    """
+    Summaries keyed by (model, prompt template, results), with in-flight
+    deduplication.
+
+    Finished summaries live in an LRU bounded by size and TTL. While a
+    summary is being generated, identical requests subscribe to the same
+    `Broadcast` instead of starting another generation. Failed generations
+    and generations cut short are not cached.
+    """
+
+    def __init__(self, maxsize: int = SUMMARY_CACHE_SIZE, ttl: float = SUMMARY_CACHE_TTL):
+        self.summaries = LRUCache(maxsize, ttl=ttl)
+        self.joined = 0
+        self._inflight: Dict[str, Broadcast] = {}
+
+    @staticmethod
+    def key(model: str, template: str, results: List[Dict]) -> str:
+        """
+        Hash of the model, the template and the IDs of the results. The code of
+        each result is hashed too, so a re-indexed chunk that kept its ID but
+        changed its code gets a new summary.
+        """
+        digest = hashlib.sha1(f"{model}\x1f{template}".encode("utf-8"))
+        for result in results:
+            digest.update(f"\x1e{chunk_id(result)}\x1f".encode("utf-8"))
+            digest.update(hashlib.sha1(result.get("code", "").encode("utf-8")).digest())
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        return self.summaries.get(key)
+
+    def set(self, key: str, summary: str):
+        self.summaries.set(key, summary)
+
+    async def stream(self, key: str, generate: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        """
+        Yield the summary for `key`: all at once if cached, otherwise token by
+        token from the generation in flight, starting one with `generate()`
+        if there is none. Raises whatever the generation raised.
+        """
+        cached = self.get(key)
+        if cached is not None:
+            yield cached
+            return
+
+        broadcast = self._inflight.get(key)
+        if broadcast is None:
+            broadcast = Broadcast(generate())
+            self._inflight[key] = broadcast
+            broadcast.task.add_done_callback(lambda _: self._finish(key, broadcast))
+        else:
+            self.joined += 1
+
+        async for token in broadcast.subscribe():
+            yield token
+
+    async def get_or_generate(self, key: str, generate: Callable[[], AsyncIterator[str]]) -> str:
+        return "".join([token async for token in self.stream(key, generate)])
+
+    def _finish(self, key: str, broadcast: Broadcast):
+        if self._inflight.get(key) is broadcast:
+            del self._inflight[key]
+        if broadcast.completed:
+            self.set(key, "".join(broadcast.tokens))
+
+    def stats(self) -> Dict:
+        return {
+            **self.summaries.stats(),
+            "in_flight": len(self._inflight),
+            "joined_in_flight": self.joined,
+        }
@@ -0,0 +1,76 @@
+from checkpoint import CheckpointJournal
+
+
+def interrupted_run(directory, repo="repo", commit="c1", full=True):
+    """A run that finished a.py, was killed while writing b.py and never got to c.py."""
+    journal = CheckpointJournal(repo, commit, full=full, directory=directory)
+    journal.begin()
+    journal.start("a.py")
+    journal.mark("a.py")
+    journal.start("b.py")
+    journal.close()
+    return journal
+
+
+def test_fresh_run_has_nothing_to_resume(tmp_path):
+    journal = CheckpointJournal("repo", "c1", full=True, directory=tmp_path)
+    assert not journal.interrupted and not journal.resumed
+    assert journal.completed == set() and journal.partial == []
+    # Nothing is written until begin()
+    assert not journal.path.exists()
+
+
+def test_same_run_resumes(tmp_path):
+    interrupted_run(tmp_path)
+    journal = CheckpointJournal("repo", "c1", full=True, directory=tmp_path)
+    assert journal.interrupted and journal.resumed
+    assert journal.completed == {"a.py"}
+    assert journal.partial == ["b.py"]
+
+
+def test_resumed_run_keeps_the_earlier_entries(tmp_path):
+    interrupted_run(tmp_path)
+    journal = CheckpointJournal("repo", "c1", full=True, directory=tmp_path)
+    journal.begin()
+    journal.start("b.py")
+    journal.mark("b.py")
+    journal.close()
+    again = CheckpointJournal("repo", "c1", full=True, directory=tmp_path)
+    assert again.completed == {"a.py", "b.py"}
+    assert again.partial == []
+
+
+def test_run_to_another_commit_or_kind_does_not_resume(tmp_path):
+    interrupted_run(tmp_path)
+    for commit, full in [("c2", True), ("c1", False)]:
+        journal = CheckpointJournal("repo", commit, full=full, directory=tmp_path)
+        assert journal.interrupted and not journal.resumed
+        assert journal.completed == set()
+    # Its begin() replaces the stale journal
+    journal.begin()
+    journal.close()
+    assert not CheckpointJournal("repo", "c1", full=True, directory=tmp_path).resumed
+
+
+def test_entry_cut_short_by_a_kill_is_ignored(tmp_path):
+    journal = interrupted_run(tmp_path)
+    with open(journal.path, "a", encoding="utf-8") as f:
+        f.write('["done", "b.p')
+    resumed = CheckpointJournal("repo", "c1", full=True, directory=tmp_path)
+    assert resumed.completed == {"a.py"}
+    assert resumed.partial == ["b.py"]
+
+
+def test_finish_drops_the_journal(tmp_path):
+    journal = CheckpointJournal("owner/repo", "c1", full=True, directory=tmp_path)
+    journal.begin()
+    journal.start("a.py")
+    journal.mark("a.py")
+    journal.finish()
+    assert not journal.path.exists()
+    assert not CheckpointJournal("owner/repo", "c1", full=True, directory=tmp_path).interrupted
+
+
+def test_journals_are_per_repo(tmp_path):
+    interrupted_run(tmp_path, repo="one")
+    assert not CheckpointJournal("two", "c1", full=True, directory=tmp_path).interrupted
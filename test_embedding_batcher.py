@@ -0,0 +1,80 @@
+import asyncio
+from typing import List
+
+import numpy as np
+import pytest
+
+from embedding_batcher import MicroBatcher
+
+
+class RecordingEncoder:
+    """Encodes each text as [batch number, position in batch], recording the batches."""
+
+    def __init__(self):
+        self.batches: List[List[str]] = []
+
+    def __call__(self, texts: List[str]) -> np.ndarray:
+        self.batches.append(list(texts))
+        return np.array([[len(self.batches), i] for i in range(len(texts))], dtype=np.float32)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_concurrent_requests_share_one_batch():
+    encoder = RecordingEncoder()
+
+    async def main():
+        batcher = MicroBatcher(encoder, max_batch_size=64, max_wait_ms=50)
+        await batcher.start()
+        try:
+            return await asyncio.gather(batcher.encode(["a", "b"]), batcher.encode(["c"]), batcher.encode(["d", "e"]))
+        finally:
+            await batcher.stop()
+
+    first, second, third = run(main())
+    assert encoder.batches == [["a", "b", "c", "d", "e"]]
+    # Every caller gets back only the rows of its own texts
+    assert first.tolist() == [[1, 0], [1, 1]]
+    assert second.tolist() == [[1, 2]]
+    assert third.tolist() == [[1, 3], [1, 4]]
+
+
+def test_batch_closes_at_max_batch_size():
+    encoder = RecordingEncoder()
+
+    async def main():
+        batcher = MicroBatcher(encoder, max_batch_size=2, max_wait_ms=50)
+        await batcher.start()
+        try:
+            return await asyncio.gather(*(batcher.encode([text]) for text in "abcde"))
+        finally:
+            await batcher.stop()
+
+    results = run(main())
+    assert [len(batch) for batch in encoder.batches] == [2, 2, 1]
+    assert sum(encoder.batches, []) == list("abcde")
+    assert [result.shape for result in results] == [(1, 2)] * 5
+
+
+def test_encode_error_reaches_every_caller_in_the_batch():
+    def fail(texts):
+        raise ValueError("model failed")
+
+    async def main():
+        batcher = MicroBatcher(fail, max_wait_ms=20)
+        await batcher.start()
+        try:
+            return await asyncio.gather(batcher.encode(["a"]), batcher.encode(["b"]), return_exceptions=True)
+        finally:
+            await batcher.stop()
+
+    results = run(main())
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+def test_encode_requires_start():
+    batcher = MicroBatcher(RecordingEncoder())
+    with pytest.raises(RuntimeError):
+        run(batcher.encode(["a"]))
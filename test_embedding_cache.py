@@ -0,0 +1,63 @@
+import itertools
+from typing import List
+
+import numpy as np
+
+import embedding_cache
+from embedding_cache import EmbeddingCache
+
+
+class CountingEncoder:
+    def __init__(self):
+        self.calls: List[List[str]] = []
+
+    def __call__(self, texts: List[str]) -> np.ndarray:
+        self.calls.append(list(texts))
+        return np.array([[len(text), 1.0] for text in texts], dtype=np.float32)
+
+
+def test_encode_only_embeds_missing_texts(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite3"))
+    encoder = CountingEncoder()
+
+    first = cache.encode("model", ["a", "bb"], encoder)
+    second = cache.encode("model", ["bb", "ccc", "a"], encoder)
+
+    assert encoder.calls == [["a", "bb"], ["ccc"]]
+    assert first.tolist() == [[1, 1], [2, 1]]
+    assert second.tolist() == [[2, 1], [3, 1], [1, 1]]
+    assert second.dtype == np.float32
+    assert cache.stats()["hits"] == 2
+
+
+def test_entries_are_per_model(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite3"))
+    cache.put_many("model-a", ["text"], np.ones((1, 2)))
+    assert cache.get_many("model-b", ["text"]) == [None]
+    assert cache.get_many("model-a", ["text"])[0].tolist() == [1, 1]
+
+
+def test_cache_persists_across_instances(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    EmbeddingCache(path).put_many("model", ["text"], np.full((1, 3), 0.5))
+    assert EmbeddingCache(path).get_many("model", ["text"])[0].tolist() == [0.5, 0.5, 0.5]
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, monkeypatch):
+    clock = itertools.count()
+    monkeypatch.setattr(embedding_cache.time, "time", lambda: float(next(clock)))
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite3"), max_entries=10)
+    texts = [f"text {i}" for i in range(10)]
+    cache.put_many("model", texts, np.zeros((10, 2)))
+    # Touch the first text so it is the most recently used
+    cache.get_many("model", texts[:1])
+    cache.put_many("model", ["new"], np.zeros((1, 2)))
+
+    cached = cache.get_many("model", texts + ["new"])
+    assert sum(vector is not None for vector in cached) == 9
+    assert cached[0] is not None and cached[-1] is not None
+
+
+def test_empty_input(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite3"))
+    assert cache.encode("model", [], CountingEncoder()).shape == (0, 0)
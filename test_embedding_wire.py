@@ -0,0 +1,69 @@
+import json
+
+import numpy as np
+import pytest
+
+import embedding_wire
+from embedding_wire import FLOAT16, FLOAT32, JSON, MSGPACK, SHAPE_HEADER, decode, encode, negotiate
+
+EMBEDDINGS = np.arange(12, dtype=np.float32).reshape(3, 4) / 7
+
+
+@pytest.mark.parametrize("media_type", [FLOAT32, FLOAT16])
+def test_raw_round_trip(media_type):
+    body, headers = encode(EMBEDDINGS, media_type)
+    assert headers == {SHAPE_HEADER: "3,4"}
+    decoded = decode(body, media_type, headers)
+    assert decoded.shape == (3, 4)
+    tolerance = 1e-3 if media_type == FLOAT16 else 0
+    np.testing.assert_allclose(decoded, EMBEDDINGS, atol=tolerance)
+
+
+def test_float32_round_trip_is_exact():
+    body, headers = encode(EMBEDDINGS, FLOAT32)
+    assert len(body) == EMBEDDINGS.nbytes
+    assert np.array_equal(decode(body, f"{FLOAT32}; charset=binary", headers), EMBEDDINGS)
+
+
+def test_single_vector_is_one_row():
+    body, headers = encode(EMBEDDINGS[0], FLOAT32)
+    assert decode(body, FLOAT32, headers).shape == (1, 4)
+
+
+def test_msgpack_round_trip():
+    pytest.importorskip("msgpack")
+    body, headers = encode(EMBEDDINGS, MSGPACK)
+    assert headers == {}
+    assert np.array_equal(decode(body, MSGPACK, headers), EMBEDDINGS)
+
+
+def test_json_fallback():
+    body = json.dumps({"embeddings": EMBEDDINGS.tolist()}).encode("utf-8")
+    np.testing.assert_allclose(decode(body, JSON, {}), EMBEDDINGS)
+    np.testing.assert_allclose(decode(body, None, {}), EMBEDDINGS)
+
+
+def test_encode_rejects_json():
+    with pytest.raises(ValueError):
+        encode(EMBEDDINGS, JSON)
+
+
+@pytest.mark.parametrize(
+    "accept, expected",
+    [
+        (None, JSON),
+        ("", JSON),
+        ("application/json", JSON),
+        ("text/html, application/x-float16;q=0.9", FLOAT16),
+        ("Application/X-Float32", FLOAT32),
+        ("application/x-float32, application/x-float16", FLOAT32),
+    ],
+)
+def test_negotiate(accept, expected):
+    assert negotiate(accept) == expected
+
+
+def test_negotiate_skips_msgpack_when_not_installed(monkeypatch):
+    monkeypatch.setattr(embedding_wire, "msgpack", None)
+    assert negotiate("application/msgpack, application/x-float32") == FLOAT32
+    assert negotiate("application/msgpack") == JSON
@@ -0,0 +1,148 @@
+import numpy as np
+import pytest
+
+import local_index
+from local_index import LocalBackend
+
+DIMS = 8
+
+
+def chunk(name, vector, repo="repo", file_path="module.py", code=None, **extra):
+    return {
+        "repo": repo,
+        "file_path": file_path,
+        "name": name,
+        "type": "FunctionDef",
+        "start_line": 1,
+        "end_line": 2,
+        "code": code if code is not None else f"def {name}():\n    pass",
+        "embedding": list(vector),
+        **extra,
+    }
+
+
+def axis(i, dims=DIMS):
+    vector = np.zeros(dims, dtype=np.float32)
+    vector[i] = 1.0
+    return vector
+
+
+def names(docs):
+    return [doc["name"] for doc in docs]
+
+
+@pytest.fixture
+def backend(tmp_path):
+    backend = LocalBackend(str(tmp_path / "index"), dtype="float32")
+    backend.ensure_index()
+    return backend
+
+
+def test_search_ranks_by_cosine_similarity(backend):
+    backend.index_chunks([chunk(f"f{i}", axis(i) * (i + 1)) for i in range(4)])
+    query = axis(2) + 0.5 * axis(3)
+    assert names(backend.search(query.tolist(), top_k=2)) == ["f2", "f3"]
+    assert backend.search(query.tolist(), top_k=0) == []
+
+
+def test_documents_round_trip(backend):
+    ast = "eJzLSM3JyQcABiwCFQ=="
+    backend.index_chunks([chunk("f", axis(0), parent_id="abc", ast=ast)])
+    (doc,) = backend.search(axis(0).tolist(), top_k=1, fields=["name", "code", "start_line", "parent_id", "ast"])
+    assert doc == {"name": "f", "code": "def f():\n    pass", "start_line": 1, "parent_id": "abc", "ast": ast}
+
+
+def test_reindexing_a_chunk_replaces_it(backend):
+    backend.index_chunks([chunk("f", axis(0), code="old")])
+    backend.index_chunks([chunk("f", axis(1), code="new")])
+    hits = backend.search(axis(0).tolist(), top_k=5, fields=["code"])
+    assert hits == [{"code": "new"}]
+
+
+def test_filters_and_deletes(backend):
+    backend.index_chunks([
+        chunk("a", axis(0), repo="one", file_path="a.py"),
+        chunk("b", axis(0), repo="one", file_path="b.py"),
+        chunk("c", axis(0), repo="two", file_path="a.py"),
+    ])
+    query = axis(0).tolist()
+    assert sorted(names(backend.search(query, 5, {"repo": "one"}))) == ["a", "b"]
+    assert sorted(names(backend.search(query, 5, {"file_path": ["a.py"]}))) == ["a", "c"]
+    assert backend.search(query, 5, {"repo": "never indexed"}) == []
+    with pytest.raises(ValueError):
+        backend.search(query, 5, {"code": "pass"})
+
+    backend.delete_file_chunks("one", ["a.py"])
+    assert sorted(names(backend.search(query, 5))) == ["b", "c"]
+    backend.delete_repo_chunks("two")
+    assert names(backend.search(query, 5)) == ["b"]
+
+
+def test_rejects_vectors_of_another_size(backend):
+    backend.index_chunks([chunk("a", axis(0))])
+    with pytest.raises(ValueError):
+        backend.index_chunks([chunk("b", axis(0, dims=4))])
+
+
+def test_another_instance_sees_the_writes(backend):
+    backend.index_chunks([chunk("a", axis(0))])
+    backend.set_indexed_commit("repo", "c1")
+    reader = LocalBackend(str(backend.path), dtype="float32")
+    assert names(reader.search(axis(0).tolist(), 5)) == ["a"]
+    assert reader.get_indexed_commit("repo") == "c1"
+    assert reader.get_indexed_commit("other") is None
+
+    backend.index_chunks([chunk("b", axis(0))])
+    assert sorted(names(reader.search(axis(0).tolist(), 5))) == ["a", "b"]
+
+
+def test_lexical_search(backend):
+    backend.index_chunks([
+        chunk("parse_json", axis(0), code="def parse_json(text):\n    return json.loads(text)"),
+        chunk("dump", axis(1), code="def dump(data):\n    return json.dumps(data)"),
+        chunk("other", axis(2), code="def other():\n    pass"),
+    ])
+    assert names(backend.lexical_search("json loads", 5)) == ["parse_json", "dump"]
+    # An exact name match is boosted
+    assert names(backend.lexical_search("dump", 5))[0] == "dump"
+    assert backend.lexical_search("missing", 5) == []
+
+
+def test_browse_pages_through_alive_chunks(backend):
+    backend.index_chunks([chunk(f"f{i}", axis(i % DIMS), file_path=f"{i}.py") for i in range(8)])
+    backend.delete_file_chunks("repo", ["3.py"])
+    seen, cursor = [], None
+    while True:
+        page, cursor = backend.browse(page_size=3, cursor=cursor, fields=["name"])
+        seen += names(page)
+        if cursor is None:
+            break
+    assert seen == [f"f{i}" for i in range(8) if i != 3]
+
+
+def test_ivf_search_matches_brute_force_when_probing_every_list(backend, monkeypatch):
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(200, DIMS)).astype(np.float32)
+    backend.index_chunks([chunk(f"f{i}", vector) for i, vector in enumerate(vectors)])
+    query = rng.normal(size=DIMS).tolist()
+    expected = names(backend.search(query, 10))
+
+    n_lists = backend.build_ivf(n_lists=8)
+    assert n_lists == 8
+    monkeypatch.setattr(local_index, "LOCAL_INDEX_NPROBE", n_lists)
+    assert names(backend.search(query, 10)) == expected
+    # Rows added after clustering are assigned on insert
+    backend.index_chunks([chunk("new", query)])
+    assert names(backend.search(query, 1)) == ["new"]
+
+
+def test_compact_drops_deleted_rows(backend):
+    backend.index_chunks([chunk(f"f{i}", axis(i), file_path=f"{i}.py") for i in range(4)])
+    backend.delete_file_chunks("repo", ["0.py", "2.py"])
+    assert backend.compact() == 2
+    assert sorted(names(backend.search(axis(1).tolist(), 5))) == ["f1", "f3"]
+    assert backend.storage_report()["chunks"] == 2
+    # Writes after compacting go to the new segment
+    backend.index_chunks([chunk("f1", axis(5), file_path="1.py", code="changed")])
+    assert backend.search(axis(5).tolist(), 1, fields=["name", "code"]) == [{"name": "f1", "code": "changed"}]
+    assert backend.storage_report()["chunks"] == 2
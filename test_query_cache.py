@@ -0,0 +1,95 @@
+import asyncio
+
+import query_cache
+from query_cache import LRUCache, QueryCache
+
+VECTOR = [0.25, -1.0, 3.5]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert cache.stats() == {"size": 2, "hits": 3, "misses": 1, "hit_rate": 0.75}
+
+
+def test_lru_ttl(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(query_cache.time, "monotonic", clock)
+    cache = LRUCache(10, ttl=60)
+    cache.set("a", 1)
+    clock.now += 59
+    assert cache.get("a") == 1
+    clock.now += 2
+    assert cache.get("a") is None
+    assert cache.stats()["size"] == 0
+
+
+def test_vectors_are_keyed_by_normalized_query():
+    cache = QueryCache(shared_url="")
+    cache.set_vector("  Parse   JSON ", VECTOR)
+    assert cache.get_vector("parse json") == VECTOR
+    assert cache.get_vector("parse yaml") is None
+
+
+def test_results_are_keyed_by_search():
+    cache = QueryCache(shared_url="")
+    generation = cache.generation()
+    cache.set_results(VECTOR, 5, {"repo": "a"}, [{"name": "hit"}], generation, {"mode": "vector"})
+    assert cache.get_results(VECTOR, 5, {"repo": "a"}, generation, {"mode": "vector"}) == [{"name": "hit"}]
+    assert cache.get_results(VECTOR, 10, {"repo": "a"}, generation, {"mode": "vector"}) is None
+    assert cache.get_results(VECTOR, 5, {"repo": "b"}, generation, {"mode": "vector"}) is None
+    assert cache.get_results(VECTOR, 5, {"repo": "a"}, generation, {"mode": "hybrid"}) is None
+    assert cache.get_results([0.0, 0.0, 0.0], 5, {"repo": "a"}, generation, {"mode": "vector"}) is None
+
+
+def test_bump_generation_invalidates_results():
+    cache = QueryCache(shared_url="")
+    cache.set_results(VECTOR, 5, None, [{"name": "old"}], cache.generation())
+    cache.set_vector("query", VECTOR)
+    cache.bump_generation()
+    assert cache.get_results(VECTOR, 5, None, cache.generation()) is None
+    # Query vectors don't depend on the index
+    assert cache.get_vector("query") == VECTOR
+
+
+def test_results_read_before_a_write_stay_under_the_old_generation():
+    cache = QueryCache(shared_url="")
+    generation = cache.generation()
+    # An index write lands while the search is running
+    cache.bump_generation()
+    cache.set_results(VECTOR, 5, None, [{"name": "stale"}], generation)
+    assert cache.get_results(VECTOR, 5, None, cache.generation()) is None
+
+
+def test_results_expire(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(query_cache.time, "monotonic", clock)
+    cache = QueryCache(result_ttl=30, shared_url="")
+    cache.set_results(VECTOR, 5, None, [{"name": "hit"}], 0)
+    clock.now += 31
+    assert cache.get_results(VECTOR, 5, None, 0) is None
+
+
+def test_async_api_without_shared_store():
+    cache = QueryCache(shared_url="")
+
+    async def main():
+        await cache.aset_vector("query", VECTOR)
+        generation = await cache.ageneration()
+        await cache.aset_results(VECTOR, 5, None, [{"name": "hit"}], generation)
+        return await cache.aget_vector("query"), await cache.aget_results(VECTOR, 5, None, generation)
+
+    assert asyncio.run(main()) == (VECTOR, [{"name": "hit"}])
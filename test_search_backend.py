@@ -0,0 +1,106 @@
+import pytest
+
+from search_backend import (
+    SearchBackend,
+    chunk_id,
+    decode_cursor,
+    encode_cursor,
+    project,
+    reciprocal_rank_fusion,
+    with_id_fields,
+)
+
+
+def doc(name, **extra):
+    return {"repo": "repo", "file_path": "module.py", "name": name, "start_line": 1, **extra}
+
+
+def names(docs):
+    return [d["name"] for d in docs]
+
+
+def test_rrf_rewards_hits_found_by_both_rankings():
+    lexical = [doc("a"), doc("b"), doc("c")]
+    vector = [doc("c"), doc("d"), doc("b")]
+    assert names(reciprocal_rank_fusion([lexical, vector], [1.0, 1.0], top_k=4)) == ["c", "b", "a", "d"]
+
+
+def test_rrf_scores():
+    fused = reciprocal_rank_fusion([[doc("a"), doc("b")], [doc("b")]], [1.0, 1.0], top_k=2, k=1)
+    # b: 1/(1+2) + 1/(1+1) beats a: 1/(1+1)
+    assert names(fused) == ["b", "a"]
+
+
+def test_rrf_weights():
+    lexical = [doc("a"), doc("b")]
+    vector = [doc("b"), doc("a")]
+    assert names(reciprocal_rank_fusion([lexical, vector], [2.0, 1.0], top_k=2)) == ["a", "b"]
+    assert names(reciprocal_rank_fusion([lexical, vector], [1.0, 2.0], top_k=2)) == ["b", "a"]
+    assert names(reciprocal_rank_fusion([lexical, vector], [0.0, 1.0], top_k=2)) == ["b", "a"]
+
+
+def test_rrf_matches_hits_by_chunk_id_and_keeps_the_first_copy():
+    fused = reciprocal_rank_fusion([[doc("a", source="lexical")], [doc("a", source="vector")]], [1.0, 1.0], top_k=5)
+    assert fused == [doc("a", source="lexical")]
+    # Same name in another file is another chunk
+    other = {**doc("a"), "file_path": "other.py"}
+    assert chunk_id(other) != chunk_id(doc("a"))
+    assert len(reciprocal_rank_fusion([[doc("a")], [other]], [1.0, 1.0], top_k=5)) == 2
+
+
+def test_rrf_truncates_to_top_k():
+    ranking = [doc(str(i)) for i in range(10)]
+    assert names(reciprocal_rank_fusion([ranking], [1.0], top_k=3)) == ["0", "1", "2"]
+    assert reciprocal_rank_fusion([[], []], [1.0, 1.0], top_k=3) == []
+
+
+def test_projection_keeps_id_fields_for_fusion():
+    assert with_id_fields(None) is None
+    assert with_id_fields(["code", "name"]) == ["code", "name", "repo", "file_path", "start_line"]
+    assert project([doc("a", code="pass")], ["name", "code", "missing"]) == [{"name": "a", "code": "pass"}]
+    docs = [doc("a")]
+    assert project(docs, None) is docs
+
+
+class ListBackend(SearchBackend):
+    """Serves a fixed ranking, to exercise the default offset paging."""
+
+    def __init__(self, ranking):
+        self.ranking = ranking
+
+    def run_search(self, mode, query, query_vector, top_k=5, filters=None, weights=(1.0, 1.0), fields=None):
+        return self.ranking[:top_k]
+
+
+@pytest.mark.parametrize(
+    "state",
+    [{"offset": 40}, {"pit": "a/b+c==", "search_after": [0.5, "id"], "seen": ["x"]}, {"row": 0}],
+)
+def test_cursor_round_trip(state):
+    cursor = encode_cursor(state)
+    # Safe to pass as a query parameter as is
+    assert all(c.isalnum() or c in "-_=" for c in cursor)
+    assert decode_cursor(cursor) == state
+
+
+def test_no_cursor():
+    assert encode_cursor(None) is None
+    assert decode_cursor(None) == {}
+    assert decode_cursor("") == {}
+
+
+@pytest.mark.parametrize("cursor", ["not a cursor", "bm90IGpzb24=", "é"])
+def test_invalid_cursor(cursor):
+    with pytest.raises(ValueError, match="Invalid page cursor"):
+        decode_cursor(cursor)
+
+
+def test_search_page_walks_every_hit_once():
+    backend = ListBackend([doc(str(i)) for i in range(7)])
+    pages, cursor = [], None
+    while True:
+        page, cursor = backend.search_page("vector", "query", [0.0], page_size=3, cursor=cursor)
+        pages.append(names(page))
+        if cursor is None:
+            break
+    assert pages == [["0", "1", "2"], ["3", "4", "5"], ["6"]]